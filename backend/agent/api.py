@@ -2,10 +2,11 @@ from fastapi import APIRouter, HTTPException, Depends, Request, Body, File, Uplo
 from fastapi.responses import JSONResponse, StreamingResponse
 import asyncio
 import json
+import re
 import traceback
 from datetime import datetime, timezone
 import uuid
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import jwt
 from pydantic import BaseModel
 import tempfile
@@ -16,14 +17,20 @@ from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
 from services import redis
 from agent.run import run_agent
+from agent.stream_coalescer import coalesce_response_chunks
+from agent.response_archive import RunResponseArchiver, fetch_run_responses
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger
-from services.billing import check_billing_status
-from sandbox.sandbox import create_sandbox, get_or_start_sandbox
+from utils.config import config
+from services.billing import check_billing_status, record_agent_run_usage
+from sandbox.sandbox import create_sandbox, get_or_start_sandbox, run_sandbox_call, AsyncSandbox
+from sandbox.pool import claim_pooled_sandbox
+from sandbox.transfer import upload_stream
 from services.llm import make_llm_api_call
 from utils.id_utils import normalize_uuid
 from utils.prompt_utils import check_prompt_limit
-import requests 
+from services import http_client
+from services import blob_store
 
 # Initialize shared resources
 router = APIRouter()
@@ -31,8 +38,20 @@ thread_manager = None
 db = None
 instance_id = None # Global instance ID for this backend instance
 
-# TTL for Redis response lists (24 hours)
-REDIS_RESPONSE_LIST_TTL = 3600 * 24
+# TTL for Redis response streams (24 hours)
+REDIS_RESPONSE_STREAM_TTL = 3600 * 24
+
+# Approximate cap on entries kept in a run's response stream
+REDIS_RESPONSE_STREAM_MAXLEN = 100000
+
+# How long a stream reader blocks on XREAD before re-checking control signals (ms)
+STREAM_READ_BLOCK_MS = 1000
+
+# Largest page of responses returned by /agent-run/{agent_run_id}/responses
+MAX_RESPONSES_PAGE_SIZE = 1000
+
+# Screenshots are addressed by the SHA-256 of their content (services/blob_store.py)
+SCREENSHOT_HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
 
 MODEL_NAME_ALIASES = {
     # Short names to full names
@@ -123,11 +142,11 @@ async def update_agent_run_status(
     client,
     agent_run_id: str,
     status: str,
-    error: Optional[str] = None,
-    responses: Optional[List[Any]] = None # Expects parsed list of dicts
+    error: Optional[str] = None
 ) -> bool:
     """
     Centralized function to update agent run status.
+    Responses are archived separately (agent/response_archive.py), so this is a small row update.
     Returns True if update was successful.
     """
     try:
@@ -139,10 +158,6 @@ async def update_agent_run_status(
         if error:
             update_data["error"] = error
 
-        if responses:
-            # Ensure responses are stored correctly as JSONB
-            update_data["responses"] = responses
-
         # Retry up to 3 times
         for retry in range(3):
             try:
@@ -151,12 +166,14 @@ async def update_agent_run_status(
                 if hasattr(update_result, 'data') and update_result.data:
                     logger.info(f"Successfully updated agent run {agent_run_id} status to '{status}' (retry {retry})")
 
-                    # Verify the update
-                    verify_result = await client.table('agent_runs').select('status', 'completed_at').eq("id", agent_run_id).execute()
-                    if verify_result.data:
-                        actual_status = verify_result.data[0].get('status')
-                        completed_at = verify_result.data[0].get('completed_at')
-                        logger.info(f"Verified agent run update: status={actual_status}, completed_at={completed_at}")
+                    # Add the run to its account's monthly usage, using the row returned by the update
+                    run_data = update_result.data[0]
+                    completed_at = run_data.get('completed_at')
+                    if run_data.get('started_at') and completed_at:
+                        thread_result = await client.table('threads').select('account_id').eq("thread_id", run_data['thread_id']).execute()
+                        account_id = thread_result.data[0].get('account_id') if thread_result.data else None
+                        if account_id:
+                            await record_agent_run_usage(account_id, agent_run_id, run_data['started_at'], completed_at)
                     return True
                 else:
                     logger.warning(f"Database update returned no data for agent run {agent_run_id} on retry {retry}: {update_result}")
@@ -182,20 +199,9 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-        # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
-
-    # Update the agent run status in the database
+    # Update the agent run status in the database; the run's own task archives its responses as it stops
     update_success = await update_agent_run_status(
-        client, agent_run_id, final_status, error=error_message, responses=all_responses
+        client, agent_run_id, final_status, error=error_message
     )
 
     if not update_success:
@@ -228,8 +234,8 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
             else:
                  logger.warning(f"Unexpected key format found: {key}")
 
-        # Clean up the response list immediately on stop/fail
-        await _cleanup_redis_response_list(agent_run_id)
+        # Clean up the response stream immediately on stop/fail
+        await _cleanup_redis_response_stream(agent_run_id)
 
     except Exception as e:
         logger.error(f"Failed to find or signal active instances for {agent_run_id}: {str(e)}")
@@ -237,14 +243,32 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     logger.info(f"Successfully initiated stop process for agent run: {agent_run_id}")
 
 
-async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+def _response_stream_key(agent_run_id: str) -> str:
+    """Redis Stream key holding the responses of an agent run."""
+    return f"agent_run:{agent_run_id}:response_stream"
+
+async def _append_run_response(agent_run_id: str, response: Dict[str, Any]) -> str:
+    """Append a response to the run's Redis Stream and return its entry ID."""
+    return await redis.xadd(
+        _response_stream_key(agent_run_id), {"data": json.dumps(response)},
+        maxlen=REDIS_RESPONSE_STREAM_MAXLEN
+    )
+
+def _is_valid_stream_id(entry_id: Optional[str]) -> bool:
+    """Check that a client-supplied ID looks like a Redis Stream entry ID."""
+    if not entry_id:
+        return False
+    parts = entry_id.split("-")
+    return 1 <= len(parts) <= 2 and all(part.isdigit() for part in parts)
+
+async def _cleanup_redis_response_stream(agent_run_id: str):
+    """Set TTL on the Redis response stream."""
+    response_stream_key = _response_stream_key(agent_run_id)
     try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
+        await redis.expire(response_stream_key, REDIS_RESPONSE_STREAM_TTL)
+        logger.debug(f"Set TTL ({REDIS_RESPONSE_STREAM_TTL}s) on response stream: {response_stream_key}")
     except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+        logger.warning(f"Failed to set TTL on response stream {response_stream_key}: {str(e)}")
 
 async def restore_running_agent_runs():
     """Mark agent runs that were still 'running' in the database as failed and clean up Redis resources."""
@@ -262,9 +286,14 @@ async def restore_running_agent_runs():
             active_run_key = f"active_run:{instance_id}:{agent_run_id}"
             await redis.delete(active_run_key)
             
-            # Clean up response list
-            response_list_key = f"agent_run:{agent_run_id}:responses"
-            await redis.delete(response_list_key)
+            # Archive what the lost instance had not archived yet, then clean up the response stream
+            archiver = RunResponseArchiver(client, agent_run_id, _response_stream_key(agent_run_id))
+            try:
+                await archiver.resume()
+                await archiver.finish()
+            except Exception as e:
+                logger.error(f"Error archiving responses of interrupted agent run {agent_run_id}: {e}")
+            await redis.delete(_response_stream_key(agent_run_id))
             
             # Clean up control channels
             control_channel = f"agent_run:{agent_run_id}:control"
@@ -318,8 +347,8 @@ async def _cleanup_redis_instance_key(agent_run_id: str):
         logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
 
 
-async def get_or_create_project_sandbox(client, project_id: str):
-    """Get or create a sandbox for a project."""
+async def get_or_create_project_sandbox(client, project_id: str, use_pool: bool = False):
+    """Get or create a sandbox for a project, claiming a pre-created one if use_pool is set."""
     project = await client.table('projects').select('*').eq('project_id', project_id).execute()
     if not project.data:
         raise ValueError(f"Project {project_id} not found")
@@ -330,19 +359,25 @@ async def get_or_create_project_sandbox(client, project_id: str):
         sandbox_pass = project_data['sandbox']['pass']
         logger.info(f"Project {project_id} already has sandbox {sandbox_id}, retrieving it")
         try:
-            sandbox = await get_or_start_sandbox(sandbox_id)
+            sandbox = AsyncSandbox(await get_or_start_sandbox(sandbox_id))
             return sandbox, sandbox_id, sandbox_pass
         except Exception as e:
             logger.error(f"Failed to retrieve existing sandbox {sandbox_id}: {str(e)}. Creating a new one.")
 
-    logger.info(f"Creating new sandbox for project {project_id}")
-    sandbox_pass = str(uuid.uuid4())
-    sandbox = create_sandbox(sandbox_pass, project_id)
-    sandbox_id = sandbox.id
-    logger.info(f"Created new sandbox {sandbox_id}")
-
-    vnc_link = sandbox.get_preview_link(6080)
-    website_link = sandbox.get_preview_link(8080)
+    pooled = await claim_pooled_sandbox() if use_pool else None
+    if pooled:
+        sandbox, sandbox_pass = pooled
+        sandbox_id = sandbox.id
+        logger.info(f"Using pooled sandbox {sandbox_id} for project {project_id}")
+    else:
+        logger.info(f"Creating new sandbox for project {project_id}")
+        sandbox_pass = str(uuid.uuid4())
+        sandbox = AsyncSandbox(await run_sandbox_call(project_id, create_sandbox, sandbox_pass, project_id))
+        sandbox_id = sandbox.id
+        logger.info(f"Created new sandbox {sandbox_id}")
+
+    vnc_link = await sandbox.get_preview_link(6080)
+    website_link = await sandbox.get_preview_link(8080)
     vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
     website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
     token = None
@@ -419,7 +454,11 @@ async def start_agent(
     #        }
     #    )
 
-    validacao_convite_e_pagamento = requests.get(f"https://n8n-blue.up.railway.app/webhook/ab889841-79cf-4dd2-a149-21734f5d97a5?user_id={user_id}")
+    validacao_convite_e_pagamento = await http_client.get(
+        "https://n8n-blue.up.railway.app/webhook/ab889841-79cf-4dd2-a149-21734f5d97a5",
+        params={"user_id": user_id},
+        timeout=15
+    )
 
     if validacao_convite_e_pagamento.status_code == 200:
         logger.info(f"Convite válido para o usuário {user_id}. Nenhum modal será exibido.")
@@ -542,7 +581,10 @@ async def get_agent_runs(thread_id: str, user_id: str = Depends(get_current_user
     logger.info(f"Fetching agent runs for thread: {thread_id}")
     client = await db.client
     await verify_thread_access(client, thread_id, user_id)
-    agent_runs = await client.table('agent_runs').select('*').eq("thread_id", thread_id).order('created_at', desc=True).execute()
+    # Responses are fetched per page from /agent-run/{agent_run_id}/responses
+    agent_runs = await client.table('agent_runs') \
+        .select('id', 'thread_id', 'status', 'started_at', 'completed_at', 'error', 'created_at', 'updated_at') \
+        .eq("thread_id", thread_id).order('created_at', desc=True).execute()
     logger.debug(f"Found {len(agent_runs.data)} agent runs for thread: {thread_id}")
     return {"agent_runs": agent_runs.data}
 
@@ -562,42 +604,80 @@ async def get_agent_run(agent_run_id: str, user_id: str = Depends(get_current_us
         "error": agent_run_data['error']
     }
 
+@router.get("/agent-run/{agent_run_id}/responses")
+async def get_agent_run_responses(
+    agent_run_id: str,
+    offset: int = 0,
+    limit: int = 100,
+    user_id: str = Depends(get_current_user_id_from_jwt)
+):
+    """Get a page of an agent run's responses."""
+    if offset < 0 or not 1 <= limit <= MAX_RESPONSES_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {MAX_RESPONSES_PAGE_SIZE}")
+    client = await db.client
+    await get_agent_run_with_access_check(client, agent_run_id, user_id)
+    return await fetch_run_responses(client, agent_run_id, _response_stream_key(agent_run_id), offset=offset, limit=limit)
+
+@router.get("/thread/{thread_id}/screenshots/{screenshot_hash}")
+async def get_thread_screenshot_url(
+    thread_id: str,
+    screenshot_hash: str,
+    user_id: str = Depends(get_current_user_id_from_jwt)
+):
+    """Get a short-lived signed URL for a browser screenshot referenced in a thread."""
+    if not SCREENSHOT_HASH_PATTERN.fullmatch(screenshot_hash):
+        raise HTTPException(status_code=400, detail="Invalid screenshot hash")
+    client = await db.client
+    await verify_thread_access(client, thread_id, user_id)
+    url = await blob_store.get_screenshot_url(blob_store.screenshot_ref(screenshot_hash))
+    if not url:
+        raise HTTPException(status_code=404, detail="Screenshot not available")
+    return {"url": url, "expires_in": config.SCREENSHOT_URL_TTL}
+
 @router.get("/agent-run/{agent_run_id}/stream")
 async def stream_agent_run(
     agent_run_id: str,
     token: Optional[str] = None,
+    last_event_id: Optional[str] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run from its Redis Stream.
+
+    Each SSE event carries the stream entry ID, so a reconnecting client can
+    resume with the Last-Event-ID header (sent automatically by EventSource)
+    or the last_event_id query parameter instead of replaying the whole run.
+    """
     logger.info(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
     user_id = await get_user_id_from_stream_auth(request, token)
     agent_run_data = await get_agent_run_with_access_check(client, agent_run_id, user_id)
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
+    response_stream_key = _response_stream_key(agent_run_id)
     control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
 
+    resume_id = (request.headers.get("last-event-id") if request else None) or last_event_id
+    if not _is_valid_stream_id(resume_id):
+        resume_id = "0"
+
     async def stream_generator():
-        logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
-        last_processed_index = -1
-        pubsub_response = None
+        logger.debug(f"Streaming responses for {agent_run_id} from Redis stream {response_stream_key} after ID {resume_id}")
+        last_id = resume_id
         pubsub_control = None
         listener_task = None
-        terminate_stream = False
+        control_signal = None
         initial_yield_complete = False
 
+        async def read_new_entries(block: Optional[int] = None):
+            """Read entries after last_id, blocking up to block ms."""
+            result = await redis.xread({response_stream_key: last_id}, block=block)
+            return [entry for _, entries in result or [] for entry in entries]
+
         try:
-            # 1. Fetch and yield initial responses from Redis list
-            initial_responses_json = await redis.lrange(response_list_key, 0, -1)
-            initial_responses = []
-            if initial_responses_json:
-                initial_responses = [json.loads(r) for r in initial_responses_json]
-                logger.debug(f"Sending {len(initial_responses)} initial responses for {agent_run_id}")
-                for response in initial_responses:
-                    yield f"data: {json.dumps(response)}\n\n"
-                last_processed_index = len(initial_responses) - 1
+            # 1. Yield everything after the resume point
+            for entry_id, fields in await read_new_entries():
+                yield f"id: {entry_id}\ndata: {fields['data']}\n\n"
+                last_id = entry_id
             initial_yield_complete = True
 
             # 2. Check run status *after* yielding initial data
@@ -609,134 +689,71 @@ async def stream_agent_run(
                 yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
                 return
 
-            # 3. Set up Pub/Sub listeners for new responses and control signals
-            pubsub_response = await redis.create_pubsub()
-            await pubsub_response.subscribe(response_channel)
-            logger.debug(f"Subscribed to response channel: {response_channel}")
-
+            # 3. Listen for control signals; new responses are picked up by XREAD BLOCK
             pubsub_control = await redis.create_pubsub()
             await pubsub_control.subscribe(control_channel)
             logger.debug(f"Subscribed to control channel: {control_channel}")
 
-            # Queue to communicate between listeners and the main generator loop
-            message_queue = asyncio.Queue()
+            async def listen_control():
+                nonlocal control_signal
+                try:
+                    async for message in pubsub_control.listen():
+                        if message and isinstance(message, dict) and message.get("type") == "message":
+                            data = message.get("data")
+                            if isinstance(data, bytes): data = data.decode('utf-8')
+                            if data in ["STOP", "END_STREAM", "ERROR"]:
+                                logger.info(f"Received control signal '{data}' for {agent_run_id}")
+                                control_signal = data
+                                return
+                except Exception as e:
+                    logger.error(f"Error in control listener for {agent_run_id}: {e}")
+                    control_signal = "ERROR"
 
-            async def listen_messages():
-                response_reader = pubsub_response.listen()
-                control_reader = pubsub_control.listen()
-                tasks = [asyncio.create_task(response_reader.__anext__()), asyncio.create_task(control_reader.__anext__())]
+            listener_task = asyncio.create_task(listen_control())
 
-                while not terminate_stream:
-                    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-                    for task in done:
-                        try:
-                            message = task.result()
-                            if message and isinstance(message, dict) and message.get("type") == "message":
-                                channel = message.get("channel")
-                                data = message.get("data")
-                                if isinstance(data, bytes): data = data.decode('utf-8')
-
-                                if channel == response_channel and data == "new":
-                                    await message_queue.put({"type": "new_response"})
-                                elif channel == control_channel and data in ["STOP", "END_STREAM", "ERROR"]:
-                                    logger.info(f"Received control signal '{data}' for {agent_run_id}")
-                                    await message_queue.put({"type": "control", "data": data})
-                                    return # Stop listening on control signal
-
-                        except StopAsyncIteration:
-                            logger.warning(f"Listener {task} stopped.")
-                            # Decide how to handle listener stopping, maybe terminate?
-                            await message_queue.put({"type": "error", "data": "Listener stopped unexpectedly"})
-                            return
-                        except Exception as e:
-                            logger.error(f"Error in listener for {agent_run_id}: {e}")
-                            await message_queue.put({"type": "error", "data": "Listener failed"})
-                            return
-                        finally:
-                            # Reschedule the completed listener task
-                            if task in tasks:
-                                tasks.remove(task)
-                                if message and isinstance(message, dict) and message.get("channel") == response_channel:
-                                     tasks.append(asyncio.create_task(response_reader.__anext__()))
-                                elif message and isinstance(message, dict) and message.get("channel") == control_channel:
-                                     tasks.append(asyncio.create_task(control_reader.__anext__()))
-
-                # Cancel pending listener tasks on exit
-                for p_task in pending: p_task.cancel()
-                for task in tasks: task.cancel()
-
-
-            listener_task = asyncio.create_task(listen_messages())
-
-            # 4. Main loop to process messages from the queue
+            # 4. Main loop: block on the stream, yield new entries, stop on completion or control signal
+            terminate_stream = False
             while not terminate_stream:
-                try:
-                    queue_item = await message_queue.get()
-
-                    if queue_item["type"] == "new_response":
-                        # Fetch new responses from Redis list starting after the last processed index
-                        new_start_index = last_processed_index + 1
-                        new_responses_json = await redis.lrange(response_list_key, new_start_index, -1)
-
-                        if new_responses_json:
-                            new_responses = [json.loads(r) for r in new_responses_json]
-                            num_new = len(new_responses)
-                            logger.debug(f"Received {num_new} new responses for {agent_run_id} (index {new_start_index} onwards)")
-                            for response in new_responses:
-                                yield f"data: {json.dumps(response)}\n\n"
-                                # Check if this response signals completion
-                                if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
-                                    logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
-                                    terminate_stream = True
-                                    break # Stop processing further new responses
-                            last_processed_index += num_new
-                        if terminate_stream: break
-
-                    elif queue_item["type"] == "control":
-                        control_signal = queue_item["data"]
-                        terminate_stream = True # Stop the stream on any control signal
-                        yield f"data: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
-                        break
-
-                    elif queue_item["type"] == "error":
-                        logger.error(f"Listener error for {agent_run_id}: {queue_item['data']}")
+                # Once a control signal arrives, drain what is left without blocking
+                entries = await read_new_entries(block=None if control_signal else STREAM_READ_BLOCK_MS)
+                for entry_id, fields in entries:
+                    yield f"id: {entry_id}\ndata: {fields['data']}\n\n"
+                    last_id = entry_id
+                    response = json.loads(fields['data'])
+                    # Check if this response signals completion
+                    if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
+                        logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
                         terminate_stream = True
-                        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
                         break
 
-                except asyncio.CancelledError:
-                     logger.info(f"Stream generator main loop cancelled for {agent_run_id}")
-                     terminate_stream = True
-                     break
-                except Exception as loop_err:
-                    logger.error(f"Error in stream generator main loop for {agent_run_id}: {loop_err}", exc_info=True)
+                if not terminate_stream and control_signal:
+                    yield f"data: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
                     terminate_stream = True
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {loop_err}'})}\n\n"
-                    break
 
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id}")
         except Exception as e:
-            logger.error(f"Error setting up stream for agent run {agent_run_id}: {e}", exc_info=True)
-            # Only yield error if initial yield didn't happen
+            logger.error(f"Error streaming agent run {agent_run_id}: {e}", exc_info=True)
             if not initial_yield_complete:
-                 yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'})}\n\n"
         finally:
-            terminate_stream = True
-            # Graceful shutdown order: unsubscribe → close → cancel
-            if pubsub_response: await pubsub_response.unsubscribe(response_channel)
-            if pubsub_control: await pubsub_control.unsubscribe(control_channel)
-            if pubsub_response: await pubsub_response.close()
-            if pubsub_control: await pubsub_control.close()
+            if pubsub_control:
+                try:
+                    await pubsub_control.unsubscribe(control_channel)
+                    await pubsub_control.close()
+                except Exception as e:
+                    logger.debug(f"Error closing control pubsub for {agent_run_id}: {e}")
 
             if listener_task:
                 listener_task.cancel()
                 try:
-                    await listener_task  # Reap inner tasks & swallow their errors
+                    await listener_task
                 except asyncio.CancelledError:
                     pass
                 except Exception as e:
                     logger.debug(f"listener_task ended with: {e}")
-            # Wait briefly for tasks to cancel
-            await asyncio.sleep(0.1)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
     return StreamingResponse(stream_generator(), media_type="text/event-stream", headers={
@@ -765,10 +782,10 @@ async def run_agent_background(
     pubsub = None
     stop_checker = None
     stop_signal_received = False
+    agent_gen = None
+    archiver = RunResponseArchiver(client, agent_run_id, _response_stream_key(agent_run_id))
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
     instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
     instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
@@ -807,12 +824,16 @@ async def run_agent_background(
         # Ensure active run key exists and has TTL
         await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
 
-        # Initialize agent generator
-        agent_gen = run_agent(
-            thread_id=thread_id, project_id=project_id, stream=stream,
-            thread_manager=thread_manager, model_name=model_name,
-            enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
-            enable_context_manager=enable_context_manager
+        # Initialize agent generator, merging token-level chunks before they hit Redis
+        agent_gen = coalesce_response_chunks(
+            run_agent(
+                thread_id=thread_id, project_id=project_id, stream=stream,
+                thread_manager=thread_manager, model_name=model_name,
+                enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
+                enable_context_manager=enable_context_manager
+            ),
+            window_ms=config.AGENT_STREAM_COALESCE_MS,
+            max_bytes=config.AGENT_STREAM_COALESCE_BYTES
         )
 
         final_status = "running"
@@ -824,11 +845,11 @@ async def run_agent_background(
                 final_status = "stopped"
                 break
 
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            await redis.rpush(response_list_key, response_json)
-            await redis.publish(response_channel, "new")
+            # Append response to the run's Redis stream; readers pick it up via XREAD BLOCK
+            await _append_run_response(agent_run_id, response)
             total_responses += 1
+            if total_responses % archiver.segment_size == 0:
+                archiver.schedule()
 
             # Check for agent-signaled completion or error
             if response.get('type') == 'status':
@@ -840,21 +861,24 @@ async def run_agent_background(
                          error_message = response.get('message', f"Run ended with status: {status_val}")
                      break
 
+        # Close the generator so queued thread messages are flushed before the status update
+        await agent_gen.aclose()
+
         # If loop finished without explicit completion/error/stop signal, mark as completed
         if final_status == "running":
              final_status = "completed"
              duration = (datetime.now(timezone.utc) - start_time).total_seconds()
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await _append_run_response(agent_run_id, completion_message)
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-
-        # Update DB status
-        await update_agent_run_status(client, agent_run_id, final_status, error=error_message, responses=all_responses)
+        # Archive the responses not yet in a segment, then record the final status
+        try:
+            await archiver.finish()
+        except Exception as archive_err:
+            # The responses stay in the Redis stream until its TTL expires
+            logger.error(f"Failed to archive responses for {agent_run_id}: {archive_err}")
+        await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
 
         # Publish final control signal (END_STREAM or ERROR)
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
@@ -872,25 +896,26 @@ async def run_agent_background(
         logger.error(f"Error in agent run {agent_run_id} after {duration:.2f}s: {error_message}\n{traceback_str} (Instance: {instance_id})")
         final_status = "failed"
 
-        # Push error message to Redis list
+        # Flush any queued thread messages before recording the failure
+        if agent_gen:
+            try: await agent_gen.aclose()
+            except Exception as close_err: logger.warning(f"Error closing agent generator for {agent_run_id}: {close_err}")
+
+        # Push error message to Redis stream
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            await _append_run_response(agent_run_id, error_response)
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
+        # Archive the remaining responses (including the error)
         try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
+             await archiver.finish()
+        except Exception as archive_err:
+             logger.error(f"Failed to archive responses after error for {agent_run_id}: {archive_err}")
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}", responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
 
         # Publish ERROR signal
         try:
@@ -916,8 +941,8 @@ async def run_agent_background(
             except Exception as e:
                 logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
 
-        # Set TTL on the response list in Redis
-        await _cleanup_redis_response_list(agent_run_id)
+        # Set TTL on the response stream in Redis
+        await _cleanup_redis_response_stream(agent_run_id)
 
         # Remove the instance-specific active run key
         await _cleanup_redis_instance_key(agent_run_id)
@@ -966,6 +991,90 @@ async def generate_and_update_project_name(project_id: str, prompt: str):
         # No need to disconnect DBConnection singleton instance here
         logger.info(f"Finished background naming task for project: {project_id}")
 
+async def _publish_upload_result(agent_run_id: str, result: Dict[str, Any]):
+    """Append a file upload result (file_name, path, state and details) to the run's response stream."""
+    content = {"status_type": "file_upload", **result}
+    file_name = result.get("file_name")
+    try:
+        await _append_run_response(agent_run_id, {
+            "type": "status",
+            "content": json.dumps(content),
+            "metadata": json.dumps({})
+        })
+    except Exception as e:
+        logger.warning(f"Failed to publish upload progress for {file_name}: {str(e)}")
+
+async def _upload_files_to_sandbox(sandbox: AsyncSandbox, files: List[UploadFile]) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    """
+    Upload attachments to /workspace concurrently and verify them.
+
+    At most FILE_UPLOAD_CONCURRENCY files are transferred at once, and uploads are
+    verified with a single listing per directory.
+
+    Returns:
+        Tuple of (uploaded sandbox paths, names of files that failed, per-file
+        results with file_name, path, state ("uploaded" or "failed") and bytes or error)
+    """
+    semaphore = asyncio.Semaphore(config.FILE_UPLOAD_CONCURRENCY)
+
+    # Files with the same name share a path; as with sequential uploads, the last one wins
+    targets: Dict[str, UploadFile] = {}
+    for file in files:
+        if not file.filename:
+            continue
+        safe_filename = file.filename.replace('/', '_').replace('\\', '_')
+        target_path = f"/workspace/{safe_filename}"
+        superseded = targets.pop(target_path, None)
+        if superseded:
+            await superseded.close()
+        targets[target_path] = file
+
+    results_by_path: Dict[str, Dict[str, Any]] = {}
+
+    async def upload(target_path: str, file: UploadFile) -> bool:
+        file_name = os.path.basename(target_path)
+        try:
+            async with semaphore:
+                size = await upload_stream(sandbox, target_path, file)
+            logger.debug(f"Streamed {size} bytes to {target_path}")
+            results_by_path[target_path] = {"file_name": file_name, "path": target_path, "state": "uploaded", "bytes": size}
+            return True
+        except Exception as e:
+            logger.error(f"Error during sandbox upload call for {file_name}: {str(e)}", exc_info=True)
+            results_by_path[target_path] = {"file_name": file_name, "path": target_path, "state": "failed", "error": str(e)[:200]}
+            return False
+        finally:
+            await file.close()
+
+    results = await asyncio.gather(*(upload(path, file) for path, file in targets.items()))
+    uploaded = [path for path, ok in zip(targets, results) if ok]
+    failed_uploads = [os.path.basename(path) for path, ok in zip(targets, results) if not ok]
+
+    # Verify every upload with one listing per directory
+    directories = list(dict.fromkeys(os.path.dirname(path) for path in uploaded))
+    listings = await asyncio.gather(*(sandbox.fs.list_files(d) for d in directories), return_exceptions=True)
+    names_by_dir = {}
+    for directory, listing in zip(directories, listings):
+        if isinstance(listing, Exception):
+            logger.error(f"Error verifying uploads in {directory}: {str(listing)}")
+            names_by_dir[directory] = set()
+        else:
+            names_by_dir[directory] = {f.name for f in listing}
+
+    successful_uploads = []
+    for path in uploaded:
+        file_name = os.path.basename(path)
+        if file_name in names_by_dir[os.path.dirname(path)]:
+            successful_uploads.append(path)
+            logger.info(f"Successfully uploaded and verified file {file_name} to sandbox path {path}")
+        else:
+            logger.error(f"Verification failed for {file_name}: File not found in {os.path.dirname(path)} after upload attempt.")
+            failed_uploads.append(file_name)
+            results_by_path[path] = {"file_name": file_name, "path": path, "state": "failed", "error": "File not found after upload"}
+
+    upload_results = [results_by_path[path] for path in targets if path in results_by_path]
+    return successful_uploads, failed_uploads, upload_results
+
 # Constante para o limite de caracteres
 MAX_PROMPT_CHARS = 5000
 
@@ -1171,7 +1280,7 @@ async def initiate_agent_with_files(
         asyncio.create_task(generate_and_update_project_name(project_id=project_id, prompt=prompt))
 
         # 3. Create Sandbox
-        sandbox, sandbox_id, sandbox_pass = await get_or_create_project_sandbox(client, project_id)
+        sandbox, sandbox_id, sandbox_pass = await get_or_create_project_sandbox(client, project_id, use_pool=True)
         logger.info(f"Using sandbox {sandbox_id} for new project {project_id}")
         
                 # Não incrementamos o contador de prompts aqui para evitar a contagem dupla
@@ -1181,53 +1290,9 @@ async def initiate_agent_with_files(
 
         # 4. Upload Files to Sandbox (if any)
         message_content = prompt
+        upload_results = []
         if files:
-            successful_uploads = []
-            failed_uploads = []
-            for file in files:
-                if file.filename:
-                    try:
-                        safe_filename = file.filename.replace('/', '_').replace('\\', '_')
-                        target_path = f"/workspace/{safe_filename}"
-                        logger.info(f"Attempting to upload {safe_filename} to {target_path} in sandbox {sandbox_id}")
-                        content = await file.read()
-                        upload_successful = False
-                        try:
-                            if hasattr(sandbox, 'fs') and hasattr(sandbox.fs, 'upload_file'):
-                                import inspect
-                                if inspect.iscoroutinefunction(sandbox.fs.upload_file):
-                                    await sandbox.fs.upload_file(target_path, content)
-                                else:
-                                    sandbox.fs.upload_file(target_path, content)
-                                logger.debug(f"Called sandbox.fs.upload_file for {target_path}")
-                                upload_successful = True
-                            else:
-                                raise NotImplementedError("Suitable upload method not found on sandbox object.")
-                        except Exception as upload_error:
-                            logger.error(f"Error during sandbox upload call for {safe_filename}: {str(upload_error)}", exc_info=True)
-
-                        if upload_successful:
-                            try:
-                                await asyncio.sleep(0.2)
-                                parent_dir = os.path.dirname(target_path)
-                                files_in_dir = sandbox.fs.list_files(parent_dir)
-                                file_names_in_dir = [f.name for f in files_in_dir]
-                                if safe_filename in file_names_in_dir:
-                                    successful_uploads.append(target_path)
-                                    logger.info(f"Successfully uploaded and verified file {safe_filename} to sandbox path {target_path}")
-                                else:
-                                    logger.error(f"Verification failed for {safe_filename}: File not found in {parent_dir} after upload attempt.")
-                                    failed_uploads.append(safe_filename)
-                            except Exception as verify_error:
-                                logger.error(f"Error verifying file {safe_filename} after upload: {str(verify_error)}", exc_info=True)
-                                failed_uploads.append(safe_filename)
-                        else:
-                            failed_uploads.append(safe_filename)
-                    except Exception as file_error:
-                        logger.error(f"Error processing file {file.filename}: {str(file_error)}", exc_info=True)
-                        failed_uploads.append(file.filename)
-                    finally:
-                        await file.close()
+            successful_uploads, failed_uploads, upload_results = await _upload_files_to_sandbox(sandbox, files)
 
             if successful_uploads:
                 message_content += "\n\n" if message_content else ""
@@ -1237,7 +1302,19 @@ async def initiate_agent_with_files(
                 for failed_file in failed_uploads: message_content += f"- {failed_file}\n"
 
 
-        # 5. Add initial user message to thread
+        # 5. Create the agent run once uploads are done, so upload time is not billed as runtime
+        agent_run = await client.table('agent_runs').insert({
+            "thread_id": thread_id, "status": "running",
+            "started_at": datetime.now(timezone.utc).isoformat()
+        }).execute()
+        agent_run_id = agent_run.data[0]['id']
+        logger.info(f"Created new agent run: {agent_run_id}")
+
+        # The client learns the run ID from this response, so upload results lead the run's stream
+        for upload_result in upload_results:
+            await _publish_upload_result(agent_run_id, upload_result)
+
+        # 6. Add initial user message to thread
         message_id = str(uuid.uuid4())
         message_payload = {"role": "user", "content": message_content}
         await client.table('messages').insert({
@@ -1245,14 +1322,6 @@ async def initiate_agent_with_files(
             "is_llm_message": True, "content": json.dumps(message_payload),
             "created_at": datetime.now(timezone.utc).isoformat()
         }).execute()
-
-        # 6. Start Agent Run
-        agent_run = await client.table('agent_runs').insert({
-            "thread_id": thread_id, "status": "running",
-            "started_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-        agent_run_id = agent_run.data[0]['id']
-        logger.info(f"Created new agent run: {agent_run_id}")
         
         # Incrementar o contador de prompts
         logger.info(f"Incrementando contagem de prompts para o usuário {formatted_user_id}")
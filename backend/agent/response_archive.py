@@ -0,0 +1,209 @@
+"""
+Incremental archiving of agent run responses.
+
+Responses are appended to a run's Redis Stream while it runs. Instead of
+copying the whole stream into agent_runs.responses when the run ends, the
+archiver moves it into agent_run_response_segments as the run progresses:
+every AGENT_RUN_ARCHIVE_SEGMENT_SIZE responses become one immutable,
+zlib-compressed segment, and the remainder is written when the run finishes.
+Each segment records the range of responses it holds (start_index and
+response_count), so a page of run history is read from the few segments that
+cover it whatever segment size they were written with.
+
+Runs archived before segments existed keep their responses in
+agent_runs.responses; fetch_run_responses falls back to that column.
+"""
+
+import asyncio
+import base64
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+SEGMENTS_TABLE = "agent_run_response_segments"
+
+
+def _encode_segment(responses: List[Dict[str, Any]]) -> str:
+    raw = json.dumps(responses, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.b64encode(zlib.compress(raw, 6)).decode('ascii')
+
+
+def _decode_segment(data: str) -> List[Dict[str, Any]]:
+    return json.loads(zlib.decompress(base64.b64decode(data)).decode('utf-8'))
+
+
+class RunResponseArchiver:
+    """Moves a run's Redis Stream responses into compressed segments.
+
+    One archiver owns a run's segments; archive() calls are serialized, so it
+    can be triggered from the response loop without waiting on the database.
+    """
+
+    def __init__(self, client, agent_run_id: str, stream_key: str, segment_size: Optional[int] = None):
+        """Initialize the archiver.
+
+        Args:
+            client: Supabase client
+            agent_run_id: ID of the agent run
+            stream_key: Redis Stream holding the run's responses
+            segment_size: Responses per segment, AGENT_RUN_ARCHIVE_SEGMENT_SIZE if omitted
+        """
+        self.client = client
+        self.agent_run_id = agent_run_id
+        self.stream_key = stream_key
+        self.segment_size = segment_size or config.AGENT_RUN_ARCHIVE_SEGMENT_SIZE
+        self.next_segment = 0
+        self.archived_count = 0
+        self.last_entry_id = "0"
+        self._lock = asyncio.Lock()
+        self._pending_task: Optional[asyncio.Task] = None
+
+    async def resume(self):
+        """Continue after the segments already written for the run (e.g. by another instance)."""
+        last = await _get_last_segment(self.client, self.agent_run_id)
+        if last:
+            self.next_segment = last['segment_index'] + 1
+            self.archived_count = last['start_index'] + last['response_count']
+            self.last_entry_id = last['last_entry_id']
+
+    def schedule(self):
+        """Archive completed segments in the background unless a pass is already running."""
+        if self._pending_task and not self._pending_task.done():
+            return
+        self._pending_task = asyncio.create_task(self._archive_in_background())
+
+    async def _archive_in_background(self):
+        try:
+            await self.archive()
+        except Exception as e:
+            # The responses stay in Redis; the next pass or the final archive retries them
+            logger.warning(f"Background archiving failed for agent run {self.agent_run_id}: {str(e)}")
+
+    async def archive(self, final: bool = False) -> int:
+        """Write every complete segment pending in the stream, and the remainder if final.
+
+        Returns:
+            Number of responses archived by this call
+        """
+        async with self._lock:
+            archived = 0
+            while True:
+                entries = await redis.xrange(self.stream_key, min=f"({self.last_entry_id}", count=self.segment_size)
+                if not entries or (len(entries) < self.segment_size and not final):
+                    break
+                await self._write_segment(entries)
+                archived += len(entries)
+                if len(entries) < self.segment_size:
+                    break
+            return archived
+
+    async def finish(self) -> int:
+        """Wait for a background pass and archive everything left in the stream.
+
+        Safe to call again: a later call only archives responses appended since
+        (e.g. an error status), as one more segment after the existing ones.
+        """
+        if self._pending_task:
+            await asyncio.gather(self._pending_task, return_exceptions=True)
+        return await self.archive(final=True)
+
+    async def _write_segment(self, entries: List[Tuple[str, Dict[str, str]]]):
+        responses = [json.loads(fields["data"]) for _, fields in entries]
+        row = {
+            "agent_run_id": self.agent_run_id,
+            "segment_index": self.next_segment,
+            "start_index": self.archived_count,
+            "response_count": len(responses),
+            "last_entry_id": entries[-1][0],
+            "data": _encode_segment(responses)
+        }
+        await self.client.table(SEGMENTS_TABLE).insert(row).execute()
+        logger.debug(f"Archived responses {self.archived_count}-{self.archived_count + len(responses) - 1} of agent run {self.agent_run_id}")
+        self.next_segment += 1
+        self.archived_count += len(responses)
+        self.last_entry_id = entries[-1][0]
+
+
+async def _get_last_segment(client, agent_run_id: str) -> Optional[Dict[str, Any]]:
+    result = await client.table(SEGMENTS_TABLE) \
+        .select('segment_index', 'start_index', 'response_count', 'last_entry_id') \
+        .eq('agent_run_id', agent_run_id) \
+        .order('segment_index', desc=True) \
+        .limit(1) \
+        .execute()
+    return result.data[0] if result.data else None
+
+
+async def fetch_run_responses(
+    client,
+    agent_run_id: str,
+    stream_key: str,
+    offset: int = 0,
+    limit: int = 100
+) -> Dict[str, Any]:
+    """Read a page of a run's responses.
+
+    Archived responses come from the segments covering the page; responses not
+    archived yet (the run is still going) come from the Redis Stream.
+
+    Returns:
+        Dict with the page of 'responses', its 'offset', the number of responses
+        known so far as 'total', and whether more follow as 'has_more'
+    """
+    end = offset + limit
+    last = await _get_last_segment(client, agent_run_id)
+
+    if last is None:
+        legacy = await client.table('agent_runs').select('responses').eq('id', agent_run_id).maybe_single().execute()
+        legacy_responses = (legacy.data or {}).get('responses') or []
+        if legacy_responses:
+            return {
+                "responses": legacy_responses[offset:end],
+                "offset": offset,
+                "total": len(legacy_responses),
+                "has_more": end < len(legacy_responses)
+            }
+
+    archived_total = last['start_index'] + last['response_count'] if last else 0
+    last_entry_id = last['last_entry_id'] if last else "0"
+    responses: List[Dict[str, Any]] = []
+
+    if offset < archived_total:
+        # The page starts in the last segment starting at or before offset
+        first = await client.table(SEGMENTS_TABLE) \
+            .select('start_index') \
+            .eq('agent_run_id', agent_run_id) \
+            .lte('start_index', offset) \
+            .order('start_index', desc=True) \
+            .limit(1) \
+            .execute()
+        first_start = first.data[0]['start_index'] if first.data else 0
+        segments = await client.table(SEGMENTS_TABLE) \
+            .select('start_index', 'data') \
+            .eq('agent_run_id', agent_run_id) \
+            .gte('start_index', first_start) \
+            .lt('start_index', end) \
+            .order('start_index') \
+            .execute()
+        for segment in segments.data or []:
+            start = segment['start_index']
+            decoded = _decode_segment(segment['data'])
+            responses.extend(decoded[max(offset - start, 0):max(end - start, 0)])
+
+    tail_count = 0
+    try:
+        tail = await redis.xrange(stream_key, min=f"({last_entry_id}")
+        tail_count = len(tail)
+        if end > archived_total:
+            skip = max(offset - archived_total, 0)
+            for _, fields in tail[skip:skip + end - max(offset, archived_total)]:
+                responses.append(json.loads(fields["data"]))
+    except Exception as e:
+        logger.warning(f"Could not read unarchived responses of agent run {agent_run_id}: {str(e)}")
+
+    total = archived_total + tail_count
+    return {"responses": responses, "offset": offset, "total": total, "has_more": end < total}
@@ -16,12 +16,13 @@ from agentpress.thread_manager import ThreadManager
 from agentpress.response_processor import ProcessorConfig
 from agent.tools.sb_shell_tool import SandboxShellTool
 from agent.tools.sb_files_tool import SandboxFilesTool
-from agent.tools.sb_browser_tool import SandboxBrowserTool
+from agent.tools.sb_browser_tool import SandboxBrowserTool, expand_browser_state
 from agent.tools.data_providers_tool import DataProvidersTool
 from agent.prompt import get_system_prompt
 from utils.logger import logger, warning, error, info, debug
 from utils.auth_utils import get_account_id_from_thread
 from services.billing import check_billing_status
+from services import blob_store
 from agent.tools.sb_vision_tool import SandboxVisionTool
 
 load_dotenv()
@@ -79,171 +80,183 @@ async def run_agent(
     iteration_count = 0
     continue_execution = True
     
-    while continue_execution and iteration_count < max_iterations:
-        iteration_count += 1
-        # logger.debug(f"Running iteration {iteration_count}...")
-
-        # Billing check on each iteration - still needed within the iterations
-        can_run, message, subscription = await check_billing_status(client, account_id)
-        if not can_run:
-            error_msg = f"Billing limit reached: {message}"
-            # Yield a special message to indicate billing limit reached
-            yield {
-                "type": "status",
-                "status": "stopped",
-                "message": error_msg
-            }
-            break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()  
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get('type')
-            if message_type == 'assistant':
-                print(f"Last message was from assistant, stopping execution")
-                continue_execution = False
+    try:
+        while continue_execution and iteration_count < max_iterations:
+            iteration_count += 1
+            # logger.debug(f"Running iteration {iteration_count}...")
+
+            # Billing check on each iteration - still needed within the iterations
+            can_run, message, subscription = await check_billing_status(client, account_id)
+            if not can_run:
+                error_msg = f"Billing limit reached: {message}"
+                # Yield a special message to indicate billing limit reached
+                yield {
+                    "type": "status",
+                    "status": "stopped",
+                    "message": error_msg
+                }
                 break
+            # Persist queued messages before reading the thread back directly
+            await thread_manager.flush_messages(thread_id)
+
+            # Check if last message is from assistant using direct Supabase query
+            latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()  
+            if latest_message.data and len(latest_message.data) > 0:
+                message_type = latest_message.data[0].get('type')
+                if message_type == 'assistant':
+                    print(f"Last message was from assistant, stopping execution")
+                    continue_execution = False
+                    break
             
-        # ---- Temporary Message Handling (Browser State & Image Context) ----
-        temporary_message = None
-        temp_message_content_list = [] # List to hold text/image blocks
-
-        # Get the latest browser_state message
-        latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
-            try:
-                browser_content = json.loads(latest_browser_state_msg.data[0]["content"])
-                screenshot_base64 = browser_content.get("screenshot_base64")
-                # Create a copy of the browser state without screenshot
-                browser_state_text = browser_content.copy()
-                browser_state_text.pop('screenshot_base64', None)
-                browser_state_text.pop('screenshot_url', None)
-                browser_state_text.pop('screenshot_url_base64', None)
-
-                if browser_state_text:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
-                    })
-                if screenshot_base64:
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{screenshot_base64}",
-                        }
-                    })
-                else:
-                    logger.warning("Browser state found but no screenshot base64 data.")
+            # ---- Temporary Message Handling (Browser State & Image Context) ----
+            temporary_message = None
+            temp_message_content_list = [] # List to hold text/image blocks
+
+            # Get the latest browser_state message
+            latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
+            if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
+                try:
+                    browser_content = await expand_browser_state(
+                        project_id, json.loads(latest_browser_state_msg.data[0]["content"])
+                    )
+                    screenshot_base64 = browser_content.get("screenshot_base64")
+                    if not screenshot_base64 and browser_content.get("screenshot_ref"):
+                        screenshot_base64 = await blob_store.load_screenshot_base64(browser_content["screenshot_ref"])
+                    # Create a copy of the browser state without screenshot
+                    browser_state_text = browser_content.copy()
+                    browser_state_text.pop('screenshot_base64', None)
+                    browser_state_text.pop('screenshot_ref', None)
+                    browser_state_text.pop('screenshot_url', None)
+                    browser_state_text.pop('screenshot_url_base64', None)
+
+                    if browser_state_text:
+                        temp_message_content_list.append({
+                            "type": "text",
+                            "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
+                        })
+                    if screenshot_base64:
+                        temp_message_content_list.append({
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{screenshot_base64}",
+                            }
+                        })
+                    else:
+                        logger.warning("Browser state found but no screenshot base64 data.")
                 
-                await client.table('messages').delete().eq('message_id', latest_browser_state_msg.data[0]["message_id"]).execute()
-            except Exception as e:
-                logger.error(f"Error parsing browser state: {e}")
-
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
-            try:
-                image_context_content = json.loads(latest_image_context_msg.data[0]["content"])
-                base64_image = image_context_content.get("base64")
-                mime_type = image_context_content.get("mime_type")
-                file_path = image_context_content.get("file_path", "unknown file")
-
-                if base64_image and mime_type:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"Here is the image you requested to see: '{file_path}'"
-                    })
-                    temp_message_content_list.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}",
-                        }
-                    })
-                else:
-                    logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
+                    await client.table('messages').delete().eq('message_id', latest_browser_state_msg.data[0]["message_id"]).execute()
+                except Exception as e:
+                    logger.error(f"Error parsing browser state: {e}")
+
+            # Get the latest image_context message (NEW)
+            latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
+            if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
+                try:
+                    image_context_content = json.loads(latest_image_context_msg.data[0]["content"])
+                    base64_image = image_context_content.get("base64")
+                    mime_type = image_context_content.get("mime_type")
+                    file_path = image_context_content.get("file_path", "unknown file")
+
+                    if base64_image and mime_type:
+                        temp_message_content_list.append({
+                            "type": "text",
+                            "text": f"Here is the image you requested to see: '{file_path}'"
+                        })
+                        temp_message_content_list.append({
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime_type};base64,{base64_image}",
+                            }
+                        })
+                    else:
+                        logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
                 
-                await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
-            except Exception as e:
-                logger.error(f"Error parsing image context: {e}")
-
-        # If we have any content, construct the temporary_message
-        if temp_message_content_list:
-            temporary_message = {"role": "user", "content": temp_message_content_list}
-            # logger.debug(f"Constructed temporary message with {len(temp_message_content_list)} content blocks.")
-        # ---- End Temporary Message Handling ----
-
-        max_tokens = 64000 if "sonnet" in model_name.lower() else None
-
-        response = await thread_manager.run_thread(
-            thread_id=thread_id,
-            system_prompt=system_message,
-            stream=stream,
-            llm_model=model_name,
-            llm_temperature=0,
-            llm_max_tokens=max_tokens,
-            tool_choice="auto",
-            max_xml_tool_calls=1,
-            temporary_message=temporary_message,
-            processor_config=ProcessorConfig(
-                xml_tool_calling=True,
-                native_tool_calling=False,
-                execute_tools=True,
-                execute_on_stream=True,
-                tool_execution_strategy="parallel",
-                xml_adding_strategy="user_message"
-            ),
-            native_max_auto_continues=native_max_auto_continues,
-            include_xml_examples=True,
-            enable_thinking=enable_thinking,
-            reasoning_effort=reasoning_effort,
-            enable_context_manager=enable_context_manager
-        )
+                    await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
+                except Exception as e:
+                    logger.error(f"Error parsing image context: {e}")
+
+            # If we have any content, construct the temporary_message
+            if temp_message_content_list:
+                temporary_message = {"role": "user", "content": temp_message_content_list}
+                # logger.debug(f"Constructed temporary message with {len(temp_message_content_list)} content blocks.")
+            # ---- End Temporary Message Handling ----
+
+            max_tokens = 64000 if "sonnet" in model_name.lower() else None
+
+            response = await thread_manager.run_thread(
+                thread_id=thread_id,
+                system_prompt=system_message,
+                stream=stream,
+                llm_model=model_name,
+                llm_temperature=0,
+                llm_max_tokens=max_tokens,
+                tool_choice="auto",
+                max_xml_tool_calls=1,
+                temporary_message=temporary_message,
+                processor_config=ProcessorConfig(
+                    xml_tool_calling=True,
+                    native_tool_calling=False,
+                    execute_tools=True,
+                    execute_on_stream=True,
+                    tool_execution_strategy="parallel",
+                    xml_adding_strategy="user_message"
+                ),
+                native_max_auto_continues=native_max_auto_continues,
+                include_xml_examples=True,
+                enable_thinking=enable_thinking,
+                reasoning_effort=reasoning_effort,
+                enable_context_manager=enable_context_manager
+            )
             
-        if isinstance(response, dict) and "status" in response and response["status"] == "error":
-            yield response 
-            break
+            if isinstance(response, dict) and "status" in response and response["status"] == "error":
+                yield response 
+                break
             
-        # Track if we see ask, complete, or web-browser-takeover tool calls
-        last_tool_call = None
+            # Track if we see ask, complete, or web-browser-takeover tool calls
+            last_tool_call = None
         
-        async for chunk in response:
-            # print(f"CHUNK: {chunk}") # Uncomment for detailed chunk logging
-
-            # Check for XML versions like <ask>, <complete>, or <web-browser-takeover> in assistant content chunks
-            if chunk.get('type') == 'assistant' and 'content' in chunk:
-                try:
-                    # The content field might be a JSON string or object
-                    content = chunk.get('content', '{}')
-                    if isinstance(content, str):
-                        assistant_content_json = json.loads(content)
-                    else:
-                        assistant_content_json = content
+            async for chunk in response:
+                # print(f"CHUNK: {chunk}") # Uncomment for detailed chunk logging
+
+                # Check for XML versions like <ask>, <complete>, or <web-browser-takeover> in assistant content chunks
+                if chunk.get('type') == 'assistant' and 'content' in chunk:
+                    try:
+                        # The content field might be a JSON string or object
+                        content = chunk.get('content', '{}')
+                        if isinstance(content, str):
+                            assistant_content_json = json.loads(content)
+                        else:
+                            assistant_content_json = content
                         
-                    # The actual text content is nested within
-                    assistant_text = assistant_content_json.get('content', '')
-                    if isinstance(assistant_text, str): # Ensure it's a string
-                         # Check for the closing tags as they signal the end of the tool usage
-                        if '</ask>' in assistant_text or '</complete>' in assistant_text or '</web-browser-takeover>' in assistant_text:
-                           if '</ask>' in assistant_text:
-                               xml_tool = 'ask'
-                           elif '</complete>' in assistant_text:
-                               xml_tool = 'complete'
-                           elif '</web-browser-takeover>' in assistant_text:
-                               xml_tool = 'web-browser-takeover'
+                        # The actual text content is nested within
+                        assistant_text = assistant_content_json.get('content', '')
+                        if isinstance(assistant_text, str): # Ensure it's a string
+                             # Check for the closing tags as they signal the end of the tool usage
+                            if '</ask>' in assistant_text or '</complete>' in assistant_text or '</web-browser-takeover>' in assistant_text:
+                               if '</ask>' in assistant_text:
+                                   xml_tool = 'ask'
+                               elif '</complete>' in assistant_text:
+                                   xml_tool = 'complete'
+                               elif '</web-browser-takeover>' in assistant_text:
+                                   xml_tool = 'web-browser-takeover'
                            
-                           last_tool_call = xml_tool
-                           print(f"Agent used XML tool: {xml_tool}")
-                except json.JSONDecodeError:
-                    # Handle cases where content might not be valid JSON
-                    print(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}")
-                except Exception as e:
-                    print(f"Error processing assistant chunk: {e}")
+                               last_tool_call = xml_tool
+                               print(f"Agent used XML tool: {xml_tool}")
+                    except json.JSONDecodeError:
+                        # Handle cases where content might not be valid JSON
+                        print(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}")
+                    except Exception as e:
+                        print(f"Error processing assistant chunk: {e}")
                     
-            yield chunk
+                yield chunk
         
-        # Check if we should stop based on the last tool call
-        if last_tool_call in ['ask', 'complete', 'web-browser-takeover']:
-            print(f"Agent decided to stop with tool: {last_tool_call}")
-            continue_execution = False
+            # Check if we should stop based on the last tool call
+            if last_tool_call in ['ask', 'complete', 'web-browser-takeover']:
+                print(f"Agent decided to stop with tool: {last_tool_call}")
+                continue_execution = False
+    finally:
+        # Make sure write-behind messages are durable however the run ends
+        await thread_manager.flush_messages()
 
 
 # # TESTING
@@ -0,0 +1,138 @@
+"""
+Coalescing of streamed assistant chunks for agent runs.
+
+The response processor yields one message per LLM delta. Writing each of them
+to Redis and sending each as its own SSE frame costs far more than the few
+characters they carry, so adjacent assistant content chunks are merged into a
+single chunk per time window or size limit. Every other message (status, tool
+results, complete assistant messages) flushes the pending chunk and is passed
+through immediately, preserving order.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from utils.logger import logger
+
+
+def _chunk_parts(message: Dict[str, Any]) -> Optional[tuple]:
+    """Return (text, thread_run_id) if the message is an assistant content chunk."""
+    if message.get('type') != 'assistant' or message.get('message_id') is not None:
+        return None
+    try:
+        metadata = message.get('metadata')
+        metadata = json.loads(metadata) if isinstance(metadata, str) else (metadata or {})
+        if metadata.get('stream_status') != 'chunk':
+            return None
+        content = message.get('content')
+        content = json.loads(content) if isinstance(content, str) else (content or {})
+        text = content.get('content')
+        if not isinstance(text, str):
+            return None
+        return text, metadata.get('thread_run_id')
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+def _merge_chunks(first: Dict[str, Any], texts: List[str]) -> Dict[str, Any]:
+    """Build a single chunk message carrying the concatenated text."""
+    if len(texts) == 1:
+        return first
+    return {**first, 'content': json.dumps({"role": "assistant", "content": "".join(texts)})}
+
+
+async def coalesce_response_chunks(
+    responses: AsyncGenerator[Dict[str, Any], None],
+    window_ms: int = 50,
+    max_bytes: int = 4096
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Merge adjacent assistant content chunks from an agent response generator.
+
+    Closing this generator also closes the wrapped one.
+
+    Args:
+        responses: Generator of agent response messages
+        window_ms: Longest time a chunk may be held back before it is emitted
+        max_bytes: Emit as soon as the pending text reaches this many bytes
+
+    Yields:
+        The same messages, with runs of assistant chunks merged
+    """
+    if window_ms <= 0 or max_bytes <= 0:
+        async for response in responses:
+            yield response
+        return
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    pending_first: Optional[Dict[str, Any]] = None
+    pending_texts: List[str] = []
+    pending_bytes = 0
+    pending_run_id = None
+    deadline = 0.0
+    merged_count = 0
+
+    def take_pending() -> Dict[str, Any]:
+        nonlocal pending_first, pending_texts, pending_bytes, pending_run_id, merged_count
+        merged_count += len(pending_texts) - 1
+        merged = _merge_chunks(pending_first, pending_texts)
+        pending_first, pending_texts, pending_bytes, pending_run_id = None, [], 0, None
+        return merged
+
+    # Keep the same __anext__ task across timeouts: cancelling it would close the generator
+    next_task: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_task is None:
+                next_task = asyncio.ensure_future(responses.__anext__())
+
+            if pending_first is not None:
+                timeout = max(deadline - loop.time(), 0)
+                done, _ = await asyncio.wait({next_task}, timeout=timeout)
+                if not done:
+                    # Window elapsed while the LLM is still producing the next delta
+                    yield take_pending()
+                    continue
+            else:
+                await asyncio.wait({next_task})
+
+            task, next_task = next_task, None
+            try:
+                response = task.result()
+            except StopAsyncIteration:
+                break
+
+            parts = _chunk_parts(response)
+            if parts is None:
+                if pending_first is not None:
+                    yield take_pending()
+                yield response
+                continue
+
+            text, run_id = parts
+            if pending_first is not None and run_id != pending_run_id:
+                yield take_pending()
+            if pending_first is None:
+                pending_first = response
+                pending_run_id = run_id
+                deadline = loop.time() + window
+            pending_texts.append(text)
+            pending_bytes += len(text.encode('utf-8'))
+
+            if pending_bytes >= max_bytes:
+                yield take_pending()
+
+        if pending_first is not None:
+            yield take_pending()
+    finally:
+        if next_task is not None:
+            if not next_task.done():
+                next_task.cancel()
+            try:
+                await next_task
+            except BaseException:
+                pass
+        await responses.aclose()
+        if merged_count:
+            logger.debug(f"Coalesced {merged_count} streamed chunks into fewer events")
@@ -1,5 +1,5 @@
 import os
-import requests
+from services import http_client
 from typing import Dict, Any, Optional, TypedDict, Literal
 
 
@@ -19,7 +19,7 @@ class RapidDataProviderBase:
     def get_endpoints(self):
         return self.endpoints
     
-    def call_endpoint(
+    async def call_endpoint(
             self,
             route: str,
             payload: Optional[Dict[str, Any]] = None
@@ -53,9 +53,10 @@ class RapidDataProviderBase:
         method = endpoint.get('method', 'GET').upper()
         
         if method == 'GET':
-            response = requests.get(url, params=payload, headers=headers)
+            response = await http_client.get(url, params=payload, headers=headers)
         elif method == 'POST':
-            response = requests.post(url, json=payload, headers=headers)
+            response = await http_client.post(url, json=payload, headers=headers)
         else:
             raise ValueError(f"Unsupported HTTP method: {method}")
+        response.raise_for_status()
         return response.json()
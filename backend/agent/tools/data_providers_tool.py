@@ -6,10 +6,20 @@ from agent.tools.data_providers.YahooFinanceProvider import YahooFinanceProvider
 from agent.tools.data_providers.AmazonProvider import AmazonProvider
 from agent.tools.data_providers.ZillowProvider import ZillowProvider
 from agent.tools.data_providers.TwitterProvider import TwitterProvider
+from services import tool_cache
 
 class DataProvidersTool(Tool):
     """Tool for making requests to various data providers."""
 
+    # Seconds a provider response is served from the result cache, by how fast its data changes
+    CACHE_TTLS = {
+        "yahoo_finance": 300,
+        "twitter": 600,
+        "amazon": 3600,
+        "zillow": 3600,
+        "linkedin": 86400
+    }
+
     def __init__(self):
         super().__init__()
 
@@ -159,8 +169,12 @@ Use this tool when you need to discover what endpoints are available.
             if route not in data_provider.get_endpoints().keys():
                 return self.fail_response(f"Endpoint '{route}' not found in {service_name} data provider.")
             
-            
-            result = data_provider.call_endpoint(route, payload)
+            result = await tool_cache.cached_call(
+                f"data_provider:{service_name}",
+                {"route": route, "payload": payload},
+                lambda: data_provider.call_endpoint(route, payload),
+                ttl=self.CACHE_TTLS.get(service_name)
+            )
             return self.success_response(result)
             
         except Exception as e:
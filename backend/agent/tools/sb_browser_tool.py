@@ -1,11 +1,120 @@
 import traceback
 import json
+import shlex
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+import httpx
 
 from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
 from sandbox.sandbox import SandboxToolsBase, Sandbox
+from services import blob_store
+from services import http_client
+from services import redis
+from utils.config import config
 from utils.logger import logger
 
+# Port of the browser automation API inside the sandbox, and timeout of an action (seconds)
+BROWSER_API_PORT = 8002
+BROWSER_API_TIMEOUT = 150
+# Each thread gets its own browser session (an isolated context) in the sandbox,
+# selected by this header; the browser API runs one request per session at a time
+BROWSER_SESSION_HEADER = "X-Browser-Session"
+
+# Browser API base URL and preview token per sandbox ID
+_browser_api_endpoints: Dict[str, Tuple[str, Optional[str]]] = {}
+
+# Full element state of a browser tab, rebuilt from the deltas sent by the browser API
+BROWSER_TAB_STATE_KEY = "browser_state:{project_id}:{tab_id}"
+
+# Result fields describing the element state; the rest of a result is passed through
+STATE_DELTA_FIELDS = ("base_state_id", "elements_added", "elements_changed", "elements_removed", "ocr_unchanged")
+
+
+def _elements_string(elements: list) -> str:
+    lines = [element.get("line", "") for element in sorted(elements, key=lambda element: element.get("index", 0))]
+    return "\n".join(lines) if lines else "No interactive elements found"
+
+
+def full_tab_state(result: dict) -> dict:
+    """Take the element state of a full browser API result."""
+    elements = result.get("interactive_elements") or []
+    return {
+        "tab_id": result.get("tab_id"),
+        "state_id": result.get("state_id"),
+        "elements": {element.get("hash", str(element.get("index"))): element for element in elements},
+        "elements_string": result.get("elements") or _elements_string(elements),
+        "ocr_text": result.get("ocr_text") or ""
+    }
+
+
+def apply_state_delta(base: dict, result: dict) -> dict:
+    """Apply a delta result to the tab state it was computed against."""
+    elements = dict(base["elements"])
+    for key in result.get("elements_removed") or []:
+        elements.pop(key, None)
+    for element in (result.get("elements_added") or []) + (result.get("elements_changed") or []):
+        elements[element["hash"]] = element
+    return {
+        "tab_id": result.get("tab_id"),
+        "state_id": result.get("state_id"),
+        "elements": elements,
+        "elements_string": _elements_string(list(elements.values())),
+        "ocr_text": base.get("ocr_text", "") if result.get("ocr_unchanged") else result.get("ocr_text") or ""
+    }
+
+
+async def load_tab_state(project_id: str, tab_id) -> dict:
+    """Load the stored full state of a browser tab, None if there is none."""
+    try:
+        stored = await redis.get(BROWSER_TAB_STATE_KEY.format(project_id=project_id, tab_id=tab_id))
+        return json.loads(stored) if stored else None
+    except Exception as e:
+        logger.warning(f"Could not load browser state of tab {tab_id}: {str(e)}")
+        return None
+
+
+async def save_tab_state(project_id: str, state: dict):
+    """Store the full state of a browser tab."""
+    try:
+        await redis.set(
+            BROWSER_TAB_STATE_KEY.format(project_id=project_id, tab_id=state.get("tab_id")),
+            json.dumps(state), ex=redis.REDIS_KEY_TTL
+        )
+    except Exception as e:
+        logger.warning(f"Could not store browser state of tab {state.get('tab_id')}: {str(e)}")
+
+
+async def expand_browser_state(project_id: str, content: dict) -> dict:
+    """Turn a stored browser_state message into the full state shown to the LLM.
+
+    Deltas are replaced by the tab's stored full state when it matches the
+    message; per-element hashes and lines are dropped as they only serve the
+    delta encoding.
+    """
+    content = dict(content)
+    state = None
+    if content.get("state_mode") == "delta":
+        state = await load_tab_state(project_id, content.get("tab_id"))
+        if state is None or state.get("state_id") != content.get("state_id"):
+            logger.warning(f"Full browser state {content.get('state_id')} not found, showing the delta")
+            return content
+    elif content.get("interactive_elements") is not None:
+        state = full_tab_state(content)
+
+    if state is not None:
+        for field in STATE_DELTA_FIELDS:
+            content.pop(field, None)
+        elements = sorted(state["elements"].values(), key=lambda element: element.get("index", 0))
+        content["elements"] = state["elements_string"]
+        content["interactive_elements"] = [
+            {key: value for key, value in element.items() if key not in ("hash", "line")} for element in elements
+        ]
+        content["ocr_text"] = state["ocr_text"]
+        content["state_mode"] = "full"
+    return content
+
 
 class SandboxBrowserTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities."""
@@ -13,6 +122,101 @@ class SandboxBrowserTool(SandboxToolsBase):
     def __init__(self, project_id: str, thread_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
+        # Full element state per browser tab, the base for applying deltas
+        self._tab_states = {}
+
+    async def _get_browser_api_endpoint(self) -> Tuple[str, Optional[str]]:
+        """Get the base URL of the sandbox's browser API and its preview token"""
+        endpoint = _browser_api_endpoints.get(self.sandbox.id)
+        if endpoint is None:
+            preview_link = await self.sandbox.get_preview_link(BROWSER_API_PORT)
+            url = preview_link.url if hasattr(preview_link, 'url') else str(preview_link).split("url='")[1].split("'")[0]
+            endpoint = (url.rstrip("/"), getattr(preview_link, 'token', None))
+            _browser_api_endpoints[self.sandbox.id] = endpoint
+        return endpoint
+
+    async def _call_browser_api_http(self, endpoint: str, params: dict = None, method: str = "POST") -> dict:
+        """Call the browser API over pooled keep-alive HTTP through the sandbox preview link"""
+        base_url, token = await self._get_browser_api_endpoint()
+        url = f"{base_url}/api/automation/{endpoint}"
+        headers = {BROWSER_SESSION_HEADER: self.thread_id}
+        if token:
+            headers["X-Daytona-Preview-Token"] = token
+        logger.debug(f"Calling browser API: {method} {url}")
+
+        async with http_client.stream(
+            method, url,
+            params=params if method == "GET" else None,
+            json=None if method == "GET" else (params or {}),
+            headers=headers,
+            timeout=BROWSER_API_TIMEOUT
+        ) as response:
+            if response.status_code >= 400:
+                body = (await response.aread())[:500]
+                raise RuntimeError(f"Browser automation request failed ({response.status_code}): {body!r}")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > config.BROWSER_API_MAX_RESPONSE_BYTES:
+                    raise RuntimeError(f"Browser automation response exceeded {config.BROWSER_API_MAX_RESPONSE_BYTES} bytes")
+        return json.loads(bytes(body))
+
+    async def _call_browser_api_exec(self, endpoint: str, params: dict = None, method: str = "POST") -> dict:
+        """Call the browser API with curl inside the sandbox"""
+        url = f"http://localhost:{BROWSER_API_PORT}/api/automation/{endpoint}"
+        if method == "GET" and params:
+            url = f"{url}?{urlencode(params)}"
+        curl_cmd = (
+            f"curl -s -X {method} {shlex.quote(url)} -H 'Content-Type: application/json'"
+            f" -H {shlex.quote(f'{BROWSER_SESSION_HEADER}: {self.thread_id}')}"
+        )
+        if params and method != "GET":
+            curl_cmd += f" -d {shlex.quote(json.dumps(params))}"
+
+        logger.debug("\033[95mExecuting curl command:\033[0m")
+        logger.debug(f"{curl_cmd}")
+
+        response = await self.sandbox.process.exec(curl_cmd, timeout=BROWSER_API_TIMEOUT)
+
+        if response.exit_code != 0:
+            raise RuntimeError(f"Browser automation request failed 2: {response}")
+        return json.loads(response.result)
+
+    async def _call_browser_api(self, endpoint: str, params: dict = None, method: str = "POST") -> dict:
+        """Call the browser automation API in the sandbox and return its parsed JSON response"""
+        if config.BROWSER_API_TRANSPORT != "http":
+            return await self._call_browser_api_exec(endpoint, params, method)
+        try:
+            return await self._call_browser_api_http(endpoint, params, method)
+        except httpx.ConnectError as e:
+            # The preview link is unreachable from here; the request never reached the API
+            logger.warning(f"Browser API preview link unreachable ({e}), falling back to exec")
+            _browser_api_endpoints.pop(self.sandbox.id, None)
+            return await self._call_browser_api_exec(endpoint, params, method)
+
+    async def _resolve_tab_state(self, result: dict) -> dict:
+        """Rebuild the full element state of the result's tab and store it for the prompt.
+        
+        Full results are taken as they are; a delta is applied to the tab's stored
+        state, which is fetched again from the browser API if it is not the
+        delta's base.
+        """
+        if result.get("state_mode") != "delta":
+            state = full_tab_state(result)
+        else:
+            base = self._tab_states.get(result.get("tab_id"))
+            if base is None or base.get("state_id") != result.get("base_state_id"):
+                base = await load_tab_state(self.project_id, result.get("tab_id"))
+            if base is not None and base.get("state_id") == result.get("base_state_id"):
+                state = apply_state_delta(base, result)
+            else:
+                logger.debug(f"Browser state base {result.get('base_state_id')} unknown, fetching full state")
+                state = full_tab_state(await self._call_browser_api("get_state", {}))
+        
+        if state.get("state_id"):
+            self._tab_states[state.get("tab_id")] = state
+            await save_tab_state(self.project_id, state)
+        return state
 
     async def _execute_browser_action(self, endpoint: str, params: dict = None, method: str = "POST") -> ToolResult:
         """Execute a browser automation action through the API
@@ -29,75 +233,75 @@ class SandboxBrowserTool(SandboxToolsBase):
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            # Build the curl command
-            url = f"http://localhost:8002/api/automation/{endpoint}"
-            
-            if method == "GET" and params:
-                query_params = "&".join([f"{k}={v}" for k, v in params.items()])
-                url = f"{url}?{query_params}"
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-            else:
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-                if params:
-                    json_data = json.dumps(params)
-                    curl_cmd += f" -d '{json_data}'"
-            
-            logger.debug("\033[95mExecuting curl command:\033[0m")
-            logger.debug(f"{curl_cmd}")
-            
-            response = self.sandbox.process.exec(curl_cmd, timeout=150)
+            try:
+                result = await self._call_browser_api(endpoint, params, method)
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to parse response JSON: {e.doc} {e}")
+                return self.fail_response(f"Failed to parse response JSON: {e.doc} {e}")
+            except RuntimeError as e:
+                logger.error(str(e))
+                return self.fail_response(str(e))
+
+            if not "content" in result:
+                result["content"] = ""
             
-            if response.exit_code == 0:
-                try:
-                    result = json.loads(response.result)
-
-                    if not "content" in result:
-                        result["content"] = ""
-                    
-                    if not "role" in result:
-                        result["role"] = "assistant"
-
-                    logger.info("Browser automation request completed successfully")
-
-                    # Add full result to thread messages for state tracking
-                    added_message = await self.thread_manager.add_message(
-                        thread_id=self.thread_id,
-                        type="browser_state",
-                        content=result,
-                        is_llm_message=False
-                    )
-
-                    # Return tool-specific success response
-                    success_response = {
-                        "success": True,
-                        "message": result.get("message", "Browser action completed successfully")
-                    }
+            if not "role" in result:
+                result["role"] = "assistant"
 
-                    # Add message ID if available
-                    if added_message and 'message_id' in added_message:
-                        success_response['message_id'] = added_message['message_id']
-
-                    # Add relevant browser-specific info
-                    if result.get("url"):
-                        success_response["url"] = result["url"]
-                    if result.get("title"):
-                        success_response["title"] = result["title"]
-                    if result.get("element_count"):
-                        success_response["elements_found"] = result["element_count"]
-                    if result.get("pixels_below"):
-                        success_response["scrollable_content"] = result["pixels_below"] > 0
-                    # Add OCR text when available
-                    if result.get("ocr_text"):
-                        success_response["ocr_text"] = result["ocr_text"]
-
-                    return self.success_response(success_response)
-
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse response JSON: {response.result} {e}")
-                    return self.fail_response(f"Failed to parse response JSON: {response.result} {e}")
-            else:
-                logger.error(f"Browser automation request failed 2: {response}")
-                return self.fail_response(f"Browser automation request failed 2: {response}")
+            logger.info("Browser automation request completed successfully")
+
+            # The stored message keeps the delta as sent; the full state is kept for the prompt
+            tab_state = await self._resolve_tab_state(result)
+            if result.get("interactive_elements"):
+                # A snapshot carries the elements string already
+                result["interactive_elements"] = [
+                    {key: value for key, value in element.items() if key != "line"}
+                    for element in result["interactive_elements"]
+                ]
+
+            # Keep only a reference to the screenshot in the message
+            screenshot_base64 = result.pop("screenshot_base64", None)
+            if screenshot_base64:
+                screenshot_ref = await blob_store.store_screenshot(screenshot_base64)
+                if screenshot_ref:
+                    # Display URLs are signed on read; a stored one would expire
+                    result["screenshot_ref"] = screenshot_ref
+                else:
+                    # Storage failed: fall back to inlining the image
+                    result["screenshot_base64"] = screenshot_base64
+
+            # Add full result to thread messages for state tracking
+            added_message = await self.thread_manager.add_message(
+                thread_id=self.thread_id,
+                type="browser_state",
+                content=result,
+                is_llm_message=False
+            )
+
+            # Return tool-specific success response
+            success_response = {
+                "success": True,
+                "message": result.get("message", "Browser action completed successfully")
+            }
+
+            # Add message ID if available
+            if added_message and 'message_id' in added_message:
+                success_response['message_id'] = added_message['message_id']
+
+            # Add relevant browser-specific info
+            if result.get("url"):
+                success_response["url"] = result["url"]
+            if result.get("title"):
+                success_response["title"] = result["title"]
+            if result.get("element_count"):
+                success_response["elements_found"] = result["element_count"]
+            if result.get("pixels_below"):
+                success_response["scrollable_content"] = result["pixels_below"] > 0
+            # Add OCR text when available
+            if tab_state.get("ocr_text"):
+                success_response["ocr_text"] = tab_state["ocr_text"]
+
+            return self.success_response(success_response)
 
         except Exception as e:
             logger.error(f"Error executing browser action: {e}")
@@ -108,13 +312,23 @@ class SandboxBrowserTool(SandboxToolsBase):
         "type": "function",
         "function": {
             "name": "browser_navigate_to",
-            "description": "Navigate to a specific url",
+            "description": "Navigate to a specific url. Use the 'fast' or 'text' profile when you only need to read the page: they skip images, media, fonts and ad/analytics requests, and 'text' also skips stylesheets and the screenshot.",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "url": {
                         "type": "string",
                         "description": "The url to navigate to"
+                    },
+                    "profile": {
+                        "type": "string",
+                        "enum": ["full", "fast", "text"],
+                        "description": "What the page loads: 'full' everything, 'fast' no heavy resources or trackers, 'text' also no stylesheets or screenshot. Applies to this tab until the next navigation."
+                    },
+                    "wait_until": {
+                        "type": "string",
+                        "enum": ["domcontentloaded", "load", "networkidle"],
+                        "description": "Load state to wait for; 'domcontentloaded' returns soonest, 'networkidle' waits for the page to stop loading"
                     }
                 },
                 "required": ["url"]
@@ -124,24 +338,33 @@ class SandboxBrowserTool(SandboxToolsBase):
     @xml_schema(
         tag_name="browser-navigate-to",
         mappings=[
-            {"param_name": "url", "node_type": "content", "path": "."}
+            {"param_name": "url", "node_type": "content", "path": "."},
+            {"param_name": "profile", "node_type": "attribute", "path": "profile"},
+            {"param_name": "wait_until", "node_type": "attribute", "path": "wait_until"}
         ],
         example='''
-        <browser-navigate-to>
+        <browser-navigate-to profile="text" wait_until="domcontentloaded">
         https://example.com
         </browser-navigate-to>
         '''
     )
-    async def browser_navigate_to(self, url: str) -> ToolResult:
+    async def browser_navigate_to(self, url: str, profile: Optional[str] = None, wait_until: Optional[str] = None) -> ToolResult:
         """Navigate to a specific url
         
         Args:
             url (str): The url to navigate to
+            profile (str, optional): Navigation profile, "full", "fast" or "text"
+            wait_until (str, optional): Load state to wait for
             
         Returns:
             dict: Result of the execution
         """
-        return await self._execute_browser_action("navigate_to", {"url": url})
+        params = {"url": url}
+        if profile:
+            params["profile"] = profile
+        if wait_until:
+            params["wait_until"] = wait_until
+        return await self._execute_browser_action("navigate_to", params)
 
     # @openapi_schema({
     #     "type": "function",
@@ -895,4 +1118,31 @@ class SandboxBrowserTool(SandboxToolsBase):
             dict: Result of the execution
         """
         logger.debug(f"\033[95mClicking at coordinates: ({x}, {y})\033[0m")
-        return await self._execute_browser_action("click_coordinates", {"x": x, "y": y})
\ No newline at end of file
+        return await self._execute_browser_action("click_coordinates", {"x": x, "y": y})
+
+    @openapi_schema({
+        "type": "function",
+        "function": {
+            "name": "browser_ocr_text",
+            "description": "Read the text visible in the current browser viewport using OCR. Use it when the page text is needed and not present in the previous browser state.",
+            "parameters": {
+                "type": "object",
+                "properties": {}
+            }
+        }
+    })
+    @xml_schema(
+        tag_name="browser-ocr-text",
+        mappings=[],
+        example='''
+        <browser-ocr-text></browser-ocr-text>
+        '''
+    )
+    async def browser_ocr_text(self) -> ToolResult:
+        """Read the text visible in the current viewport using OCR
+        
+        Returns:
+            dict: Result of the execution
+        """
+        logger.debug(f"\033[95mExtracting viewport text with OCR\033[0m")
+        return await self._execute_browser_action("ocr_text", {})
\ No newline at end of file
@@ -83,7 +83,7 @@ class SandboxDeployTool(SandboxToolsBase):
             
             # Verify the directory exists
             try:
-                dir_info = self.sandbox.fs.get_file_info(full_path)
+                dir_info = await self.sandbox.fs.get_file_info(full_path)
                 if not dir_info.is_dir:
                     return self.fail_response(f"'{directory_path}' is not a directory")
             except Exception as e:
@@ -103,7 +103,7 @@ class SandboxDeployTool(SandboxToolsBase):
                     npx wrangler pages deploy {full_path} --project-name {project_name}))'''
 
                 # Execute the command directly using the sandbox's process.exec method
-                response = self.sandbox.process.exec(deploy_cmd, timeout=150)
+                response = await self.sandbox.process.exec(deploy_cmd, timeout=150)
                 
                 print(f"Deployment command output: {response.result}")
                 
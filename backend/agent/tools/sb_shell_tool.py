@@ -19,7 +19,7 @@ class SandboxShellTool(SandboxToolsBase):
             session_id = str(uuid4())
             try:
                 await self._ensure_sandbox()  # Ensure sandbox is initialized
-                self.sandbox.process.create_session(session_id)
+                await self.sandbox.process.create_session(session_id)
                 self._sessions[session_name] = session_id
             except Exception as e:
                 raise RuntimeError(f"Failed to create session: {str(e)}")
@@ -30,7 +30,7 @@ class SandboxShellTool(SandboxToolsBase):
         if session_name in self._sessions:
             try:
                 await self._ensure_sandbox()  # Ensure sandbox is initialized
-                self.sandbox.process.delete_session(self._sessions[session_name])
+                await self.sandbox.process.delete_session(self._sessions[session_name])
                 del self._sessions[session_name]
             except Exception as e:
                 print(f"Warning: Failed to cleanup session {session_name}: {str(e)}")
@@ -179,14 +179,14 @@ class SandboxShellTool(SandboxToolsBase):
                 cwd=cwd  # Still set the working directory for reference
             )
             
-            response = self.sandbox.process.execute_session_command(
+            response = await self.sandbox.process.execute_session_command(
                 session_id=session_id,
                 req=req,
                 timeout=timeout
             )
             
             # Get detailed logs
-            logs = self.sandbox.process.get_session_command_logs(
+            logs = await self.sandbox.process.get_session_command_logs(
                 session_id=session_id,
                 command_id=response.cmd_id
             )
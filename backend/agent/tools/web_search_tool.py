@@ -1,5 +1,5 @@
 from tavily import AsyncTavilyClient
-import httpx
+from services import http_client, tool_cache
 from typing import List, Optional
 from datetime import datetime
 import os
@@ -8,6 +8,10 @@ from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
 from utils.config import config
 import json
 
+# Seconds search results and scraped pages are served from the result cache
+WEB_SEARCH_CACHE_TTL = 1800
+SCRAPE_CACHE_TTL = 3600
+
 # TODO: add subpages, etc... in filters as sometimes its necessary 
 
 class WebSearchTool(Tool):
@@ -114,38 +118,47 @@ class WebSearchTool(Tool):
             else:
                 num_results = 20
 
-            # Execute the search with Tavily
-            search_response = await self.tavily_client.search(
-                query=query,
-                max_results=num_results,
-                include_answer=False,
-                include_images=False,
-            )
+            async def search() -> List[dict]:
+                # Execute the search with Tavily
+                search_response = await self.tavily_client.search(
+                    query=query,
+                    max_results=num_results,
+                    include_answer=False,
+                    include_images=False,
+                )
 
-            # Normalize the response format
-            raw_results = (
-                search_response.get("results")
-                if isinstance(search_response, dict)
-                else search_response
-            )
+                # Normalize the response format
+                raw_results = (
+                    search_response.get("results")
+                    if isinstance(search_response, dict)
+                    else search_response
+                )
 
-            # Format results consistently
-            formatted_results = []
-            for result in raw_results:
-                formatted_result = {
-                    "title": result.get("title", ""),
-                    "url": result.get("url", ""),
-                }
+                # Format results consistently
+                formatted_results = []
+                for result in raw_results:
+                    formatted_result = {
+                        "title": result.get("title", ""),
+                        "url": result.get("url", ""),
+                    }
 
-                # if summary:
-                #     # Prefer full content; fall back to description
-                #     formatted_result["snippet"] = (
-                #         result.get("content") or 
-                #         result.get("description") or 
-                #         ""
-                #     )
+                    # if summary:
+                    #     # Prefer full content; fall back to description
+                    #     formatted_result["snippet"] = (
+                    #         result.get("content") or 
+                    #         result.get("description") or 
+                    #         ""
+                    #     )
 
-                formatted_results.append(formatted_result)
+                    formatted_results.append(formatted_result)
+                return formatted_results
+
+            formatted_results = await tool_cache.cached_call(
+                "web_search",
+                {"query": " ".join(query.split()), "num_results": num_results},
+                search,
+                ttl=WEB_SEARCH_CACHE_TTL
+            )
             
             # Return a properly formatted ToolResult
             return ToolResult(
@@ -259,8 +272,8 @@ class WebSearchTool(Tool):
             else:
                 return self.fail_response("URL must be a string.")
                 
-            # ---------- Firecrawl scrape endpoint ----------
-            async with httpx.AsyncClient() as client:
+            async def scrape() -> dict:
+                # ---------- Firecrawl scrape endpoint ----------
                 headers = {
                     "Authorization": f"Bearer {self.firecrawl_api_key}",
                     "Content-Type": "application/json",
@@ -269,25 +282,35 @@ class WebSearchTool(Tool):
                     "url": url,
                     "formats": ["markdown"]
                 }
-                response = await client.post(
+                # Scraping has no side effects, so it is safe to retry
+                response = await http_client.post(
                     "https://api.firecrawl.dev/v1/scrape",
                     json=payload,
                     headers=headers,
                     timeout=150,
+                    retries=config.HTTP_MAX_RETRIES,
                 )
                 response.raise_for_status()
                 data = response.json()
 
-            # Format the response
-            formatted_result = {
-                "Title": data.get("data", {}).get("metadata", {}).get("title", ""),
-                "URL": url,
-                "Text": data.get("data", {}).get("markdown", "")
-            }
+                # Format the response
+                formatted_result = {
+                    "Title": data.get("data", {}).get("metadata", {}).get("title", ""),
+                    "URL": url,
+                    "Text": data.get("data", {}).get("markdown", "")
+                }
             
-            # Add metadata if available
-            if "metadata" in data.get("data", {}):
-                formatted_result["Metadata"] = data["data"]["metadata"]
+                # Add metadata if available
+                if "metadata" in data.get("data", {}):
+                    formatted_result["Metadata"] = data["data"]["metadata"]
+                return formatted_result
+
+            formatted_result = await tool_cache.cached_call(
+                "scrape_webpage",
+                {"url": url},
+                scrape,
+                ttl=SCRAPE_CACHE_TTL
+            )
             
             return self.success_response([formatted_result])
         
@@ -1,12 +1,16 @@
 """
 Context Management for AgentPress Threads.
 
-This module handles token counting and thread summarization to prevent
-reaching the context window limitations of LLM models.
+This module handles token counting, deterministic compaction and thread
+summarization to prevent reaching the context window limitations of LLM models.
 """
 
+import re
 import json
-from typing import List, Dict, Any, Optional
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
 
 from litellm import token_counter, completion_cost
 from services.supabase import DBConnection
@@ -17,6 +21,258 @@ from utils.logger import logger
 DEFAULT_TOKEN_THRESHOLD = 80000  # 80k tokens threshold for summarization
 SUMMARY_TARGET_TOKENS = 30000    # Target ~10k tokens for the summary message
 RESERVE_TOKENS = 5000            # Reserve tokens for new messages
+LEDGER_MAX_THREADS = 1000        # Threads kept in the in-process token ledger
+
+# Deterministic compaction
+COMPACTION_KEEP_RECENT = 10      # Latest messages are never compacted
+TOOL_RESULT_MAX_CHARS = 2000     # Older tool results are cut down to about this size
+
+_TOOL_RESULT_TAG = re.compile(r'^<tool_result>\s*<([\w-]+)>')
+_FILE_WRITE_BLOCK = re.compile(
+    r'<(create-file|full-file-rewrite|delete-file)\s+file_path="([^"]+)"\s*(?:/>|>(.*?)</\1>)',
+    re.DOTALL
+)
+_NATIVE_FILE_WRITES = {'create_file', 'full_file_rewrite', 'delete_file'}
+_BROWSER_URL = re.compile(r'\\?"url\\?":\s*\\?"([^"\\]+)')
+_BROWSER_TITLE = re.compile(r'\\?"title\\?":\s*\\?"([^"\\]*)')
+
+
+def _tool_result_name(message: Dict[str, Any]) -> Optional[str]:
+    """Return the tool name if the message is a tool result, else None."""
+    content = message.get('content')
+    if message.get('role') == 'tool':
+        return message.get('name') or ''
+    if isinstance(content, str):
+        match = _TOOL_RESULT_TAG.match(content)
+        if match:
+            return match.group(1)
+        if content.startswith('Result for '):
+            return content[len('Result for '):].split(':', 1)[0]
+    return None
+
+
+def _with_content(message: Dict[str, Any], content: str) -> Dict[str, Any]:
+    """Copy a tool result message with new text, keeping its XML wrapper."""
+    name = _tool_result_name(message)
+    if message.get('role') != 'tool' and isinstance(message.get('content'), str) and _TOOL_RESULT_TAG.match(message['content']):
+        content = f"<tool_result> <{name}> {content} </{name}> </tool_result>"
+    return {**message, 'content': content}
+
+
+def _drop_superseded_file_contents(messages: List[Dict[str, Any]], compactable: int) -> List[Dict[str, Any]]:
+    """Blank file contents in write calls that a later write or delete of the same path replaced."""
+    result = list(messages)
+    later_paths = set()
+    for i in range(len(messages) - 1, -1, -1):
+        message = messages[i]
+        if message.get('role') != 'assistant':
+            continue
+        written = []
+
+        content = message.get('content')
+        if isinstance(content, str) and 'file_path=' in content:
+            def replace(match):
+                tag, path, body = match.group(1), match.group(2), match.group(3)
+                written.append(path)
+                if i < compactable and body and path in later_paths:
+                    return f'<{tag} file_path="{path}">[{len(body)} characters omitted: file was later rewritten or deleted]</{tag}>'
+                return match.group(0)
+            new_content = _FILE_WRITE_BLOCK.sub(replace, content)
+            if new_content != content:
+                result[i] = {**message, 'content': new_content}
+
+        tool_calls = message.get('tool_calls') or []
+        new_calls = []
+        for tool_call in tool_calls:
+            function = tool_call.get('function', {}) if isinstance(tool_call, dict) else {}
+            if function.get('name') in _NATIVE_FILE_WRITES:
+                try:
+                    arguments = json.loads(function.get('arguments') or '{}')
+                except (json.JSONDecodeError, TypeError):
+                    arguments = {}
+                path = arguments.get('file_path')
+                if path:
+                    written.append(path)
+                    if i < compactable and path in later_paths and arguments.get('file_contents'):
+                        omitted = len(arguments['file_contents'])
+                        arguments['file_contents'] = f"[{omitted} characters omitted: file was later rewritten or deleted]"
+                        tool_call = {**tool_call, 'function': {**function, 'arguments': json.dumps(arguments)}}
+            new_calls.append(tool_call)
+        if tool_calls and new_calls != tool_calls:
+            result[i] = {**result[i], 'tool_calls': new_calls}
+
+        later_paths.update(written)
+    return result
+
+
+def _collapse_browser_states(messages: List[Dict[str, Any]], compactable: int) -> List[Dict[str, Any]]:
+    """Reduce every browser tool result but the latest to its URL and title."""
+    browser_indexes = [
+        i for i, message in enumerate(messages)
+        if (_tool_result_name(message) or '').replace('_', '-').startswith('browser-')
+    ]
+    result = list(messages)
+    for i in browser_indexes[:-1]:
+        if i >= compactable:
+            break
+        content = messages[i].get('content')
+        if not isinstance(content, str):
+            continue
+        url = _BROWSER_URL.search(content)
+        title = _BROWSER_TITLE.search(content)
+        summary = "[Earlier browser state omitted"
+        if url:
+            summary += f"; url: {url.group(1)}"
+        if title and title.group(1):
+            summary += f"; title: {title.group(1)}"
+        result[i] = _with_content(messages[i], summary + "]")
+    return result
+
+
+def _truncate_tool_results(messages: List[Dict[str, Any]], compactable: int) -> List[Dict[str, Any]]:
+    """Cut older tool results down to their beginning and end."""
+    result = list(messages)
+    head = TOOL_RESULT_MAX_CHARS * 3 // 4
+    tail = TOOL_RESULT_MAX_CHARS - head
+    for i in range(compactable):
+        message = messages[i]
+        content = message.get('content')
+        if _tool_result_name(message) is None or not isinstance(content, str) or len(content) <= TOOL_RESULT_MAX_CHARS:
+            continue
+        omitted = len(content) - head - tail
+        result[i] = {**message, 'content': f"{content[:head]}\n... [{omitted} characters omitted] ...\n{content[-tail:]}"}
+    return result
+
+
+# Compaction tiers, least lossy first
+COMPACTION_TIERS = [
+    ("superseded_file_contents", _drop_superseded_file_contents),
+    ("browser_states", _collapse_browser_states),
+    ("tool_results", _truncate_tool_results),
+]
+
+
+def _format_transcript(messages: List[Dict[str, Any]]) -> str:
+    """Render messages as a readable transcript for the summarization prompt."""
+    parts = []
+    for message in messages:
+        role = message.get('role', 'unknown') if isinstance(message, dict) else 'unknown'
+        content = message.get('content') if isinstance(message, dict) else message
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        tool_calls = message.get('tool_calls') if isinstance(message, dict) else None
+        if tool_calls:
+            content += "\n" + json.dumps(tool_calls, ensure_ascii=False)
+        parts.append(f"[{role.upper()}]\n{content}")
+    return "\n\n".join(parts)
+
+class TokenLedger:
+    """Per-thread cache of token counts per message and model.
+
+    Messages are immutable once written, so the token count of a message only
+    has to be computed once per model tokenizer. Counts are keyed by message_id
+    and model; a thread's total is then a sum over cached values plus a count of
+    the messages not seen before, instead of re-tokenizing the whole history.
+
+    Each message is counted on its own, so totals include per-message framing
+    overhead from token_counter and can be slightly higher than counting the
+    whole list at once. That errs on the safe side for threshold checks.
+    """
+
+    def __init__(self, max_threads: int = LEDGER_MAX_THREADS):
+        """Initialize the ledger.
+
+        Args:
+            max_threads: Number of threads to keep before evicting the least recently used
+        """
+        self.max_threads = max_threads
+        # thread_id -> message_id -> model -> token count
+        self._threads: "OrderedDict[str, Dict[str, Dict[str, int]]]" = OrderedDict()
+        # thread_id -> models the thread has been counted with
+        self._models: Dict[str, set] = {}
+        # (model, content digest) -> token count for messages without an ID (e.g. system prompt)
+        self._static: Dict[Tuple[str, str], int] = {}
+
+    def _thread_entries(self, thread_id: str) -> Dict[str, Dict[str, int]]:
+        entries = self._threads.get(thread_id)
+        if entries is None:
+            entries = {}
+            self._threads[thread_id] = entries
+            while len(self._threads) > self.max_threads:
+                evicted, _ = self._threads.popitem(last=False)
+                self._models.pop(evicted, None)
+        else:
+            self._threads.move_to_end(thread_id)
+        return entries
+
+    def record_message(self, thread_id: str, message_id: str, message: Any):
+        """Count a newly written message for every model the thread is counted with.
+
+        Args:
+            thread_id: ID of the thread the message belongs to
+            message_id: ID of the stored message
+            message: LLM-formatted message dict
+        """
+        models = self._models.get(thread_id)
+        if not models or not isinstance(message, dict):
+            return # Counted lazily on the first count_tokens call
+        counts = self._thread_entries(thread_id).setdefault(message_id, {})
+        for model in models:
+            if model not in counts:
+                try:
+                    counts[model] = token_counter(model=model, messages=[message])
+                except Exception as e:
+                    logger.warning(f"Could not count tokens for message {message_id}: {str(e)}")
+
+    def count_tokens(
+        self,
+        thread_id: str,
+        model: str,
+        message_rows: List[Dict[str, Any]],
+        extra_messages: Optional[List[Dict[str, Any]]] = None
+    ) -> int:
+        """Return the token count of a thread's messages for a model.
+
+        Args:
+            thread_id: ID of the thread
+            model: Model whose tokenizer should be used
+            message_rows: Dicts with 'message_id' and the LLM-formatted 'message'
+            extra_messages: Messages without an ID (e.g. the system prompt),
+                cached by content digest
+
+        Returns:
+            Total token count
+        """
+        self._models.setdefault(thread_id, set()).add(model)
+        entries = self._thread_entries(thread_id)
+        total = 0
+        newly_counted = 0
+
+        for row in message_rows:
+            counts = entries.setdefault(row['message_id'], {})
+            if model not in counts:
+                counts[model] = token_counter(model=model, messages=[row['message']])
+                newly_counted += 1
+            total += counts[model]
+
+        for message in extra_messages or []:
+            digest = hashlib.sha1(json.dumps(message, sort_keys=True, default=str).encode()).hexdigest()
+            key = (model, digest)
+            if key not in self._static:
+                self._static[key] = token_counter(model=model, messages=[message])
+            total += self._static[key]
+
+        logger.debug(f"Token ledger for thread {thread_id} ({model}): {total} tokens, {newly_counted} newly counted messages")
+        return total
+
+    def forget_thread(self, thread_id: str):
+        """Drop all cached counts for a thread."""
+        self._threads.pop(thread_id, None)
+        self._models.pop(thread_id, None)
+
+
+# Shared across ContextManager instances so counts survive between agent runs
+token_ledger = TokenLedger()
 
 class ContextManager:
     """Manages thread context including token counting and summarization."""
@@ -29,12 +285,69 @@ class ContextManager:
         """
         self.db = DBConnection()
         self.token_threshold = token_threshold
+        self.token_ledger = token_ledger
     
-    async def get_thread_token_count(self, thread_id: str) -> int:
+    def compact_message_rows(
+        self,
+        thread_id: str,
+        model: str,
+        message_rows: List[Dict[str, Any]],
+        extra_messages: Optional[List[Dict[str, Any]]] = None,
+        target_tokens: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Apply deterministic compaction tiers until the prompt fits.
+
+        Tiers run in order (superseded file contents, then older browser states,
+        then older tool result bodies) and stop as soon as the token count is
+        below target_tokens. The COMPACTION_KEEP_RECENT latest messages are left
+        untouched. Only the prompt view is changed; stored messages are not.
+
+        Args:
+            thread_id: ID of the thread
+            model: Model whose tokenizer should be used
+            message_rows: Dicts with 'message_id' and the LLM-formatted 'message'
+            extra_messages: Messages counted alongside (e.g. the system prompt)
+            target_tokens: Token budget, the token threshold if omitted
+
+        Returns:
+            Tuple of (compacted message rows, token count)
+        """
+        target_tokens = target_tokens or self.token_threshold
+        token_count = self.token_ledger.count_tokens(thread_id, model, message_rows, extra_messages)
+        compactable = max(len(message_rows) - COMPACTION_KEEP_RECENT, 0)
+        if token_count < target_tokens or not compactable:
+            return message_rows, token_count
+
+        messages = [row['message'] for row in message_rows]
+        for tier_name, tier in COMPACTION_TIERS:
+            compacted = tier(messages, compactable)
+            if compacted == messages:
+                continue
+            messages = compacted
+            rows = []
+            for row, message in zip(message_rows, messages):
+                if message is row['message']:
+                    rows.append(row)
+                else:
+                    # Compacted variants get their own ledger entry, keyed by content
+                    digest = hashlib.sha1(json.dumps(message, sort_keys=True, default=str).encode()).hexdigest()[:12]
+                    rows.append({'message_id': f"{row['message_id']}:{digest}", 'message': message})
+            new_count = self.token_ledger.count_tokens(thread_id, model, rows, extra_messages)
+            logger.info(f"Compaction tier '{tier_name}' reduced thread {thread_id} from {token_count} to {new_count} tokens")
+            token_count = new_count
+            if token_count < target_tokens:
+                return rows, token_count
+            message_rows = rows
+            messages = [row['message'] for row in rows]
+
+        return message_rows, token_count
+
+    async def get_thread_token_count(self, thread_id: str, model: str = "gpt-4") -> int:
         """Get the current token count for a thread using LiteLLM.
         
         Args:
             thread_id: ID of the thread to analyze
+            model: Model whose tokenizer should be used
             
         Returns:
             The total token count for relevant messages in the thread
@@ -43,15 +356,15 @@ class ContextManager:
         
         try:
             # Get messages for the thread
-            messages = await self.get_messages_for_summarization(thread_id)
+            message_rows = await self.get_message_rows_for_summarization(thread_id)
             
-            if not messages:
+            if not message_rows:
                 logger.debug(f"No messages found for thread {thread_id}")
                 return 0
             
-            # Use litellm's token_counter for accurate model-specific counting
-            # This is much more accurate than the SQL-based estimation
-            token_count = token_counter(model="gpt-4", messages=messages)
+            # Use litellm's token_counter for accurate model-specific counting,
+            # only tokenizing messages the ledger has not seen yet
+            token_count = self.token_ledger.count_tokens(thread_id, model, message_rows)
             
             logger.info(f"Thread {thread_id} has {token_count} tokens (calculated with litellm)")
             return token_count
@@ -73,6 +386,18 @@ class ContextManager:
         Returns:
             List of message objects to summarize
         """
+        message_rows = await self.get_message_rows_for_summarization(thread_id)
+        return [row['message'] for row in message_rows]
+
+    async def get_message_rows_for_summarization(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Get the messages to summarize together with their message IDs.
+
+        Args:
+            thread_id: ID of the thread to get messages from
+
+        Returns:
+            List of dicts with 'message_id', the LLM-formatted 'message' and 'created_at'
+        """
         logger.debug(f"Getting messages for summarization for thread {thread_id}")
         client = await self.db.client
         
@@ -130,7 +455,7 @@ class ContextManager:
                     if role == 'assistant' or role == 'user' or role == 'system' or role == 'tool':
                         content = {'role': role, 'content': content}
                 
-                messages.append(content)
+                messages.append({'message_id': msg['message_id'], 'message': content, 'created_at': msg['created_at']})
             
             logger.info(f"Got {len(messages)} messages to summarize for thread {thread_id}")
             return messages
@@ -180,7 +505,7 @@ VERY IMPORTANT: This summary will replace older parts of the conversation in the
 THE CONVERSATION HISTORY TO SUMMARIZE IS AS FOLLOWS:
 ===============================================================
 ==================== CONVERSATION HISTORY ====================
-{messages}
+{_format_transcript(messages)}
 ==================== END OF CONVERSATION HISTORY ====================
 ===============================================================
 """
@@ -238,7 +563,9 @@ O texto acima é um resumo do histórico da conversa. A conversa continua abaixo
         thread_id: str, 
         add_message_callback, 
         model: str = "gpt-4o-mini",
-        force: bool = False
+        force: bool = False,
+        backdate: bool = False,
+        extra_tokens: int = 0
     ) -> bool:
         """Check if thread needs summarization and summarize if so.
         
@@ -247,13 +574,20 @@ O texto acima é um resumo do histórico da conversa. A conversa continua abaixo
             add_message_callback: Callback to add the summary message to the thread
             model: LLM model to use for summarization
             force: Whether to force summarization regardless of token count
+            backdate: Date the summary right after the last summarized message
+                instead of now, so messages written while it was generated stay
+                in the LLM view (used by background summarization)
+            extra_tokens: Tokens sent alongside the messages (e.g. the system
+                prompt), counted towards the threshold
             
         Returns:
             True if summarization was performed, False otherwise
         """
         try:
-            # Get token count using LiteLLM (accurate model-specific counting)
-            token_count = await self.get_thread_token_count(thread_id)
+            # Get messages to summarize and their token count from the ledger
+            message_rows = await self.get_message_rows_for_summarization(thread_id)
+            token_count = self.token_ledger.count_tokens(thread_id, model, message_rows) if message_rows else 0
+            token_count += extra_tokens
             
             # If token count is below threshold and not forcing, no summarization needed
             if token_count < self.token_threshold and not force:
@@ -266,8 +600,7 @@ O texto acima é um resumo do histórico da conversa. A conversa continua abaixo
             else:
                 logger.info(f"Thread {thread_id} exceeds token threshold ({token_count} >= {self.token_threshold}), summarizing...")
             
-            # Get messages to summarize
-            messages = await self.get_messages_for_summarization(thread_id)
+            messages = [row['message'] for row in message_rows]
             
             # If there are too few messages, don't summarize
             if len(messages) < 3:
@@ -279,12 +612,17 @@ O texto acima é um resumo do histórico da conversa. A conversa continua abaixo
             
             if summary:
                 # Add summary message to thread
+                extra = {}
+                if backdate:
+                    last_created_at = datetime.fromisoformat(message_rows[-1]['created_at'].replace('Z', '+00:00'))
+                    extra['created_at'] = (last_created_at + timedelta(microseconds=1)).isoformat()
                 await add_message_callback(
                     thread_id=thread_id,
                     type="summary",
                     content=summary,
                     is_llm_message=True,
-                    metadata={"token_count": token_count}
+                    metadata={"token_count": token_count},
+                    **extra
                 )
                 
                 logger.info(f"Successfully added summary to thread {thread_id}")
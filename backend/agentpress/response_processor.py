@@ -20,6 +20,7 @@ from litellm import completion_cost, token_counter
 
 from agentpress.tool import Tool, ToolResult
 from agentpress.tool_registry import ToolRegistry
+from agentpress.xml_stream_parser import XmlToolCallScanner
 from utils.logger import logger
 
 # Type alias for XML result adding strategy
@@ -114,7 +115,8 @@ class ResponseProcessor:
         """
         accumulated_content = ""
         tool_calls_buffer = {}
-        current_xml_content = ""
+        xml_scanner = XmlToolCallScanner(self.tool_registry.xml_tools.keys())
+        unprocessed_xml_chunks = [] # Chunks emitted by the scanner but skipped due to the limit
         xml_chunks_buffer = []
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
@@ -169,7 +171,6 @@ class ResponseProcessor:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
                         accumulated_content += chunk_content
-                        current_xml_content += chunk_content
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
@@ -186,9 +187,8 @@ class ResponseProcessor:
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
-                            for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+                            xml_chunks = xml_scanner.feed(chunk_content)
+                            for chunk_pos, xml_chunk in enumerate(xml_chunks):
                                 xml_chunks_buffer.append(xml_chunk)
                                 result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
@@ -215,6 +215,7 @@ class ResponseProcessor:
                                     if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls:
                                         logger.debug(f"Reached XML tool call limit ({config.max_xml_tool_calls})")
                                         finish_reason = "xml_tool_limit_reached"
+                                        unprocessed_xml_chunks.extend(xml_chunks[chunk_pos + 1:])
                                         break # Stop processing more XML chunks in this delta
 
                     # --- Process Native Tool Call Chunks ---
@@ -413,9 +414,8 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # Include chunks completed in the stream but not consumed before the limit hit
+                    xml_chunks_buffer.extend(unprocessed_xml_chunks)
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
@@ -847,69 +847,17 @@ class ResponseProcessor:
             return None
 
     def _extract_xml_chunks(self, content: str) -> List[str]:
-        """Extract complete XML chunks using start and end pattern matching."""
-        chunks = []
-        pos = 0
-        
+        """Extract complete XML chunks from a full content string.
+
+        Uses the same single-pass scanner as the streaming path, so both
+        paths agree on what constitutes a complete tool call.
+        """
         try:
-            while pos < len(content):
-                # Find the next tool tag
-                next_tag_start = -1
-                current_tag = None
-                
-                # Find the earliest occurrence of any registered tag
-                for tag_name in self.tool_registry.xml_tools.keys():
-                    start_pattern = f'<{tag_name}'
-                    tag_pos = content.find(start_pattern, pos)
-                    
-                    if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
-                        next_tag_start = tag_pos
-                        current_tag = tag_name
-                
-                if next_tag_start == -1 or not current_tag:
-                    break
-                
-                # Find the matching end tag
-                end_pattern = f'</{current_tag}>'
-                tag_stack = []
-                chunk_start = next_tag_start
-                current_pos = next_tag_start
-                
-                while current_pos < len(content):
-                    # Look for next start or end tag of the same type
-                    next_start = content.find(f'<{current_tag}', current_pos + 1)
-                    next_end = content.find(end_pattern, current_pos)
-                    
-                    if next_end == -1:  # No closing tag found
-                        break
-                    
-                    if next_start != -1 and next_start < next_end:
-                        # Found nested start tag
-                        tag_stack.append(next_start)
-                        current_pos = next_start + 1
-                    else:
-                        # Found end tag
-                        if not tag_stack:  # This is our matching end tag
-                            chunk_end = next_end + len(end_pattern)
-                            chunk = content[chunk_start:chunk_end]
-                            chunks.append(chunk)
-                            pos = chunk_end
-                            break
-                        else:
-                            # Pop nested tag
-                            tag_stack.pop()
-                            current_pos = next_end + 1
-                
-                if current_pos >= len(content):  # Reached end without finding closing tag
-                    break
-                
-                pos = max(pos + 1, current_pos)
-        
+            return XmlToolCallScanner(self.tool_registry.xml_tools.keys()).feed(content)
         except Exception as e:
             logger.error(f"Error extracting XML chunks: {e}")
             logger.error(f"Content was: {content}")
-        
-        return chunks
+            return []
 
     def _parse_xml_tool_call(self, xml_chunk: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
         """Parse XML chunk into tool call format and return parsing details.
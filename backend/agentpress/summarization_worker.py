@@ -0,0 +1,284 @@
+"""
+Background summarization of long threads.
+
+run_thread enqueues a thread once its token count reaches
+SUMMARIZATION_TRIGGER_PERCENT of the context threshold. A worker loop in each
+API process takes jobs from the queue and writes the summary while the agent
+keeps running, so the run rarely has to wait for an inline summarization call.
+
+A per-thread lock ensures only one worker (or an inline summarization) works on
+a thread at a time. The queue and lock live in Redis; LocalSummarizationQueue
+is an in-process stand-in for tests and single-process setups.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from agentpress.context_manager import ContextManager
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+SUMMARIZATION_QUEUE_KEY = "summarization:queue"
+SUMMARIZATION_QUEUED_KEY = "summarization:queued"
+SUMMARIZATION_LOCK_KEY = "summarization:lock:{thread_id}"
+# ID of the latest summary written by a worker, checked by message caches in other processes
+LATEST_SUMMARY_KEY = "summarization:latest:{thread_id}"
+SUMMARIZATION_LOCK_TTL = 300
+# Seconds a worker blocks waiting for a job; kept well below the Redis client's
+# 5s socket timeout so an idle BLPOP returns nil instead of timing out the read
+SUMMARIZATION_DEQUEUE_TIMEOUT = 1
+
+# Pushes a job unless the thread is already queued. KEYS: queue, queued set. ARGV: thread_id, payload
+_ENQUEUE_SCRIPT = """
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+    redis.call('RPUSH', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Deletes the lock only if it is still held with this token
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSummarizationQueue:
+    """Summarization jobs and thread locks shared by all workers through Redis."""
+
+    async def enqueue(self, thread_id: str, job: Dict[str, Any]) -> bool:
+        """Queue a job unless the thread is already queued. Returns True if queued."""
+        return bool(await redis.eval(
+            _ENQUEUE_SCRIPT, [SUMMARIZATION_QUEUE_KEY, SUMMARIZATION_QUEUED_KEY], [thread_id, json.dumps(job)]
+        ))
+
+    async def dequeue(self, timeout: int) -> Optional[Dict[str, Any]]:
+        """Wait up to timeout seconds for the next job."""
+        item = await redis.blpop([SUMMARIZATION_QUEUE_KEY], timeout=timeout)
+        return json.loads(item[1]) if item else None
+
+    async def mark_done(self, thread_id: str):
+        """Allow the thread to be queued again."""
+        await redis.srem(SUMMARIZATION_QUEUED_KEY, thread_id)
+
+    async def acquire_lock(self, thread_id: str) -> Optional[str]:
+        """Try to take the thread's lock. Returns a release token, or None if it is held."""
+        token = str(uuid.uuid4())
+        key = SUMMARIZATION_LOCK_KEY.format(thread_id=thread_id)
+        if await redis.set(key, token, ex=SUMMARIZATION_LOCK_TTL, nx=True):
+            return token
+        return None
+
+    async def release_lock(self, thread_id: str, token: str):
+        """Release the thread's lock if it is still held with token."""
+        await redis.eval(_RELEASE_LOCK_SCRIPT, [SUMMARIZATION_LOCK_KEY.format(thread_id=thread_id)], [token])
+
+    async def set_latest_summary(self, thread_id: str, message_id: str):
+        """Record the latest summary written for a thread."""
+        await redis.set(LATEST_SUMMARY_KEY.format(thread_id=thread_id), message_id, ex=redis.REDIS_KEY_TTL)
+
+    async def get_latest_summary(self, thread_id: str) -> Optional[str]:
+        """Get the latest summary written for a thread by a worker."""
+        return await redis.get(LATEST_SUMMARY_KEY.format(thread_id=thread_id))
+
+
+class LocalSummarizationQueue:
+    """In-process stand-in for RedisSummarizationQueue."""
+
+    def __init__(self):
+        self._jobs: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._queued: set = set()
+        self._locks: Dict[str, Tuple[str, float]] = {}
+        self._latest: Dict[str, str] = {}
+
+    async def enqueue(self, thread_id: str, job: Dict[str, Any]) -> bool:
+        if thread_id in self._queued:
+            return False
+        self._queued.add(thread_id)
+        self._jobs.put_nowait(job)
+        return True
+
+    async def dequeue(self, timeout: int) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self._jobs.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def mark_done(self, thread_id: str):
+        self._queued.discard(thread_id)
+
+    async def acquire_lock(self, thread_id: str) -> Optional[str]:
+        held = self._locks.get(thread_id)
+        if held and held[1] > time.monotonic():
+            return None
+        token = str(uuid.uuid4())
+        self._locks[thread_id] = (token, time.monotonic() + SUMMARIZATION_LOCK_TTL)
+        return token
+
+    async def release_lock(self, thread_id: str, token: str):
+        held = self._locks.get(thread_id)
+        if held and held[0] == token:
+            del self._locks[thread_id]
+
+    async def set_latest_summary(self, thread_id: str, message_id: str):
+        self._latest[thread_id] = message_id
+
+    async def get_latest_summary(self, thread_id: str) -> Optional[str]:
+        return self._latest.get(thread_id)
+
+
+_queue = None
+
+
+def get_summarization_queue():
+    """Get the summarization queue of this process (Redis unless configured as local)."""
+    global _queue
+    if _queue is None:
+        _queue = LocalSummarizationQueue() if config.SUMMARIZATION_QUEUE_BACKEND == "local" else RedisSummarizationQueue()
+    return _queue
+
+
+async def request_summarization(thread_id: str, model: str, extra_tokens: int = 0) -> bool:
+    """Queue a thread for background summarization. Returns True if it was queued.
+
+    extra_tokens is the size of what the run sends besides the thread's messages
+    (the system prompt); the worker adds it so both sides measure the same thing.
+    """
+    try:
+        job = {"thread_id": thread_id, "model": model, "extra_tokens": extra_tokens}
+        queued = await get_summarization_queue().enqueue(thread_id, job)
+        if queued:
+            logger.info(f"Queued thread {thread_id} for background summarization")
+        return queued
+    except Exception as e:
+        logger.warning(f"Could not queue thread {thread_id} for summarization: {str(e)}")
+        return False
+
+
+@asynccontextmanager
+async def summarization_lock(thread_id: str, wait: float = 0) -> AsyncIterator[Tuple[bool, bool]]:
+    """Hold the thread's summarization lock for the duration of the block.
+
+    Args:
+        thread_id: ID of the thread
+        wait: Seconds to keep retrying while another worker holds the lock
+
+    Yields:
+        Tuple of (acquired, waited): whether the lock is held, and whether
+        another holder had to be waited for (its summary may have landed)
+    """
+    queue = get_summarization_queue()
+    deadline = time.monotonic() + wait
+    waited = False
+    token = None
+    unlocked = False
+    try:
+        token = await queue.acquire_lock(thread_id)
+        while token is None and time.monotonic() < deadline:
+            waited = True
+            await asyncio.sleep(0.5)
+            token = await queue.acquire_lock(thread_id)
+    except Exception as e:
+        # Without Redis there is no cross-process lock; proceed unlocked
+        logger.warning(f"Could not take summarization lock for thread {thread_id}: {str(e)}")
+        unlocked = True
+
+    try:
+        yield token is not None or unlocked, waited
+    finally:
+        if token:
+            try:
+                await queue.release_lock(thread_id, token)
+            except Exception as e:
+                logger.warning(f"Could not release summarization lock for thread {thread_id}: {str(e)}")
+
+
+class SummarizationWorker:
+    """Consumes summarization jobs and writes summaries for queued threads."""
+
+    def __init__(self, thread_manager, concurrency: int = 1):
+        """Initialize the worker.
+
+        Args:
+            thread_manager: ThreadManager used to read and write thread messages
+            concurrency: Number of jobs processed at the same time
+        """
+        self.thread_manager = thread_manager
+        self.concurrency = concurrency
+        self._tasks = []
+        # Summarize once a thread reaches the trigger share of the context threshold
+        self.context_manager = ContextManager(
+            token_threshold=thread_manager.context_manager.token_threshold * config.SUMMARIZATION_TRIGGER_PERCENT // 100
+        )
+
+    def start(self):
+        """Start the worker loops."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+            logger.info(f"Started {self.concurrency} background summarization worker(s)")
+
+    async def stop(self):
+        """Stop the worker loops."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        queue = get_summarization_queue()
+        while True:
+            try:
+                job = await queue.dequeue(timeout=SUMMARIZATION_DEQUEUE_TIMEOUT)
+                if job:
+                    await self.process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Summarization worker error: {str(e)}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def process(self, job: Dict[str, Any]) -> bool:
+        """Summarize one queued thread unless another worker is already on it.
+
+        Returns:
+            True if a summary was written
+        """
+        thread_id = job["thread_id"]
+        queue = get_summarization_queue()
+        try:
+            async with summarization_lock(thread_id) as (acquired, _):
+                if not acquired:
+                    logger.debug(f"Thread {thread_id} is already being summarized, skipping job")
+                    return False
+
+                # Only persisted messages are summarized; queued ones land after the summary
+                await self.thread_manager.flush_messages(thread_id)
+                written = {}
+
+                async def add_summary(**kwargs):
+                    message = await self.thread_manager.add_message(**kwargs)
+                    written['message'] = message
+                    return message
+
+                summarized = await self.context_manager.check_and_summarize_if_needed(
+                    thread_id=thread_id,
+                    add_message_callback=add_summary,
+                    model=job.get("model") or "gpt-4o-mini",
+                    backdate=True,
+                    extra_tokens=job.get("extra_tokens", 0)
+                )
+                if summarized and written.get('message'):
+                    await self.thread_manager.flush_messages(thread_id)
+                    await queue.set_latest_summary(thread_id, written['message']['message_id'])
+                    logger.info(f"Background summary written for thread {thread_id}")
+                return summarized
+        finally:
+            await queue.mark_done(thread_id)
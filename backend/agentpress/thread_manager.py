@@ -8,24 +8,150 @@ This module provides comprehensive conversation management, including:
 - LLM interaction with streaming support
 - Error handling and cleanup
 - Context summarization to manage token limits
+- Write-behind batching of message inserts
+- In-process caching of LLM-formatted thread messages
 """
 
 import json
+import copy
+import uuid
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
 from services.llm import make_llm_api_call
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
 from agentpress.context_manager import ContextManager
+from agentpress.summarization_worker import get_summarization_queue, request_summarization, summarization_lock
 from agentpress.response_processor import (
     ResponseProcessor, 
     ProcessorConfig    
 )
 from services.supabase import DBConnection
 from utils.logger import logger
+from utils.config import config
 
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
 
+# Threads kept in the in-process LLM message cache
+MESSAGE_CACHE_MAX_THREADS = 256
+
+# Seconds before last_seen that the delta query re-lists. created_at comes from
+# different clocks (write-behind queue, API endpoints, database defaults), so a
+# row can land slightly behind messages already seen; re-listed known IDs are skipped
+MESSAGE_RECONCILE_WINDOW = 300
+
+# Rows per page when listing a thread's messages; matches PostgREST's max_rows
+# (supabase/config.toml), which silently truncates larger selects
+MESSAGE_PAGE_SIZE = 1000
+# Message IDs per in_() filter when fetching unknown messages, keeping the URL short
+MESSAGE_FETCH_BATCH_SIZE = 200
+
+# Seconds a run waits for a background summarization of its thread before summarizing inline
+SUMMARIZATION_LOCK_WAIT = 60
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """Parse a created_at value from the database or from add_message."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class ThreadMessageCache:
+    """Bounded LRU cache of LLM-formatted messages per thread.
+
+    Each entry holds the messages of the current LLM view (latest summary and
+    everything after it) in created_at order, plus the newest created_at that
+    was confirmed by a database read. Messages written through add_message are
+    added directly; a delta query on created_at reconciles messages written
+    elsewhere (e.g. a user message added through the API). The delta query
+    reaches MESSAGE_RECONCILE_WINDOW seconds behind last_seen and merges by
+    message ID, so rows with slightly earlier timestamps are not missed.
+    """
+
+    def __init__(self, max_threads: int = MESSAGE_CACHE_MAX_THREADS):
+        """Initialize the cache.
+
+        Args:
+            max_threads: Number of threads to keep before evicting the least recently used
+        """
+        self.max_threads = max_threads
+        # thread_id -> {'rows': [...], 'ids': set, 'last_seen': str}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Get the cache entry of a thread, marking it as recently used."""
+        entry = self._entries.get(thread_id)
+        if entry is not None:
+            self._entries.move_to_end(thread_id)
+        return entry
+
+    def set(self, thread_id: str, rows: List[Dict[str, Any]], last_seen: Optional[str]):
+        """Replace a thread's entry with rows loaded from the database."""
+        self._entries[thread_id] = {
+            'rows': rows,
+            'ids': {row['message_id'] for row in rows},
+            'last_seen': last_seen,
+        }
+        self._entries.move_to_end(thread_id)
+        while len(self._entries) > self.max_threads:
+            self._entries.popitem(last=False)
+
+    def add(self, thread_id: str, row: Dict[str, Any], is_summary: bool = False):
+        """Add a message written by this process to a cached thread.
+
+        A summary replaces the cached view, since older messages drop out of
+        the LLM context once it lands. last_seen is not advanced, so the next
+        delta query still catches messages written concurrently elsewhere.
+        """
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            return
+        if is_summary:
+            # A backdated summary (background summarization) keeps the messages written after it
+            summary_time = _parse_timestamp(row['created_at'])
+            rows = [row] + [r for r in entry['rows'] if _parse_timestamp(r['created_at']) > summary_time]
+            entry['rows'] = rows
+            entry['ids'] = {r['message_id'] for r in rows}
+        elif row['message_id'] not in entry['ids']:
+            entry['rows'].append(row)
+            entry['ids'].add(row['message_id'])
+
+    def merge(self, thread_id: str, rows: List[Dict[str, Any]], last_seen: str):
+        """Merge rows from a delta query into a cached thread.
+
+        Rows must be in created_at order. If a summary is among them, the view
+        is rebuilt from the latest summary onwards.
+        """
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            return
+        summary_index = max((i for i, row in enumerate(rows) if row.get('type') == 'summary'), default=None)
+        if summary_index is not None:
+            summary_time = _parse_timestamp(rows[summary_index]['created_at'])
+            kept = [row for row in entry['rows'] if _parse_timestamp(row['created_at']) > summary_time]
+            merged = rows[summary_index:] + [row for row in kept if row['message_id'] not in {r['message_id'] for r in rows}]
+            entry['ids'] = {row['message_id'] for row in merged}
+            entry['rows'] = merged
+        else:
+            for row in rows:
+                if row['message_id'] not in entry['ids']:
+                    entry['rows'].append(row)
+                    entry['ids'].add(row['message_id'])
+        if rows:
+            # Rows written elsewhere may interleave with ones added locally
+            entry['rows'].sort(key=lambda row: _parse_timestamp(row['created_at']))
+        entry['last_seen'] = last_seen
+
+    def invalidate(self, thread_id: str):
+        """Drop a thread's entry."""
+        self._entries.pop(thread_id, None)
+
+
+# Shared across ThreadManager instances so the cache survives between agent runs
+message_cache = ThreadMessageCache()
+
 class ThreadManager:
     """Manages conversation threads with LLM models and tool execution.
     
@@ -34,9 +160,24 @@ class ThreadManager:
     XML-based tool execution patterns.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        write_behind: bool = True,
+        message_batch_size: int = 25,
+        message_flush_interval: float = 0.25,
+        max_pending_messages: int = 500
+    ):
         """Initialize ThreadManager.
-    
+
+        Args:
+            write_behind: Queue message inserts per thread and persist them in
+                multi-row batches instead of one round trip per message.
+            message_batch_size: Maximum number of rows inserted per batch; a
+                full batch triggers an immediate background flush.
+            message_flush_interval: Seconds a queued message may wait before a
+                background flush persists it.
+            max_pending_messages: Queue length at which add_message flushes
+                inline, bounding memory if the database falls behind.
         """
         self.db = DBConnection()
         self.tool_registry = ToolRegistry()
@@ -46,6 +187,15 @@ class ThreadManager:
         )
         self.context_manager = ContextManager()
 
+        self.write_behind = write_behind
+        self.message_batch_size = message_batch_size
+        self.message_flush_interval = message_flush_interval
+        self.max_pending_messages = max_pending_messages
+        self._pending_messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._flush_locks: Dict[str, asyncio.Lock] = {}
+        self._flush_tasks: Dict[str, asyncio.Task] = {}
+        self._last_message_timestamp: Optional[datetime] = None
+
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
         self.tool_registry.register_tool(tool_class, function_names, **kwargs)
@@ -56,7 +206,8 @@ class ThreadManager:
         type: str, 
         content: Union[Dict[str, Any], List[Any], str], 
         is_llm_message: bool = False,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        created_at: Optional[str] = None
     ):
         """Add a message to the thread in the database.
 
@@ -69,10 +220,10 @@ class ThreadManager:
                             Defaults to False (user message).
             metadata: Optional dictionary for additional message metadata.
                       Defaults to None, stored as an empty JSONB object if None.
+            created_at: Optional ISO timestamp to store instead of the current time.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id}")
-        client = await self.db.client
-        
+
         # Prepare data for insertion
         data_to_insert = {
             'thread_id': thread_id,
@@ -81,13 +232,24 @@ class ThreadManager:
             'is_llm_message': is_llm_message,
             'metadata': json.dumps(metadata or {}), # Ensure metadata is always a JSON object
         }
-        
+        if created_at:
+            data_to_insert['created_at'] = created_at
+
+        if self.write_behind:
+            saved_message = await self._enqueue_message(thread_id, data_to_insert)
+            if is_llm_message:
+                self._track_llm_message(thread_id, saved_message, content)
+            return saved_message
+
+        client = await self.db.client
         try:
             # Add returning='representation' to get the inserted row data including the id
             result = await client.table('messages').insert(data_to_insert, returning='representation').execute()
             logger.info(f"Successfully added message to thread {thread_id}")
             
             if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
+                if is_llm_message:
+                    self._track_llm_message(thread_id, result.data[0], content)
                 return result.data[0]
             else:
                 logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
@@ -96,11 +258,130 @@ class ThreadManager:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
             raise
 
+    def _track_llm_message(self, thread_id: str, saved_message: Dict[str, Any], content: Any):
+        """Update the message cache and token ledger with a newly written LLM message."""
+        row = self._format_llm_message_row(saved_message)
+        if row is None:
+            message_cache.invalidate(thread_id)
+            return
+        message_cache.add(thread_id, row, is_summary=saved_message.get('type') == 'summary')
+        self.context_manager.token_ledger.record_message(thread_id, row['message_id'], row['message'])
+
+    def _next_message_timestamp(self) -> str:
+        """Return a strictly increasing UTC timestamp for client-side created_at.
+
+        Rows inserted in one batch would otherwise share the transaction's now(),
+        losing the order in which messages were added.
+        """
+        now = datetime.now(timezone.utc)
+        if self._last_message_timestamp and now <= self._last_message_timestamp:
+            now = self._last_message_timestamp + timedelta(microseconds=1)
+        self._last_message_timestamp = now
+        return now.isoformat()
+
+    async def _enqueue_message(self, thread_id: str, data_to_insert: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a message row for batched insertion and return its representation.
+
+        The message ID and timestamps are assigned here so callers get the same
+        object shape as an insert with returning='representation'.
+        """
+        timestamp = self._next_message_timestamp()
+        row = {
+            'message_id': str(uuid.uuid4()),
+            **data_to_insert,
+            'created_at': data_to_insert.get('created_at') or timestamp,
+            'updated_at': timestamp,
+        }
+
+        pending = self._pending_messages.setdefault(thread_id, [])
+        pending.append(row)
+
+        if len(pending) >= self.max_pending_messages:
+            logger.warning(f"{len(pending)} messages pending for thread {thread_id}, flushing inline")
+            await self.flush_messages(thread_id)
+        elif len(pending) >= self.message_batch_size:
+            self._schedule_flush(thread_id, 0)
+        else:
+            self._schedule_flush(thread_id, self.message_flush_interval)
+
+        return dict(row)
+
+    def _schedule_flush(self, thread_id: str, delay: float):
+        """Schedule a background flush of the thread's queue after delay seconds."""
+        existing = self._flush_tasks.get(thread_id)
+        if existing and not existing.done() and delay > 0:
+            return # A flush is already scheduled and will pick this message up
+
+        async def _background_flush():
+            try:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.flush_messages(thread_id)
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # Messages stay queued; the next flush retries them in order
+                logger.error(f"Background flush failed for thread {thread_id}: {str(e)}")
+
+        self._flush_tasks[thread_id] = asyncio.create_task(_background_flush())
+
+    async def flush_messages(self, thread_id: Optional[str] = None):
+        """Persist queued messages for a thread (or all threads) in order.
+
+        Must be awaited before reading a thread's messages back from the
+        database, and at the end of a run so nothing is lost.
+
+        Args:
+            thread_id: Thread to flush. Flushes every thread if None.
+
+        Raises:
+            Exception: If a batch could not be inserted after retries. The
+                failed rows remain queued.
+        """
+        thread_ids = [thread_id] if thread_id else list(self._pending_messages.keys())
+        for tid in thread_ids:
+            lock = self._flush_locks.setdefault(tid, asyncio.Lock())
+            async with lock:
+                pending = self._pending_messages.get(tid)
+                while pending:
+                    batch = pending[:self.message_batch_size]
+                    await self._insert_message_batch(tid, batch)
+                    del pending[:len(batch)]
+                if tid in self._pending_messages and not self._pending_messages[tid]:
+                    del self._pending_messages[tid]
+
+    async def _insert_message_batch(self, thread_id: str, batch: List[Dict[str, Any]]):
+        """Insert one batch of message rows, retrying with exponential backoff."""
+        client = await self.db.client
+        for retry in range(3):
+            try:
+                if retry == 0:
+                    await client.table('messages').insert(batch, returning='minimal').execute()
+                else:
+                    # The previous attempt may have landed; message IDs make the retry idempotent
+                    await client.table('messages').upsert(batch, returning='minimal', ignore_duplicates=True).execute()
+                logger.debug(f"Flushed {len(batch)} messages to thread {thread_id}")
+                return
+            except Exception as e:
+                logger.error(f"Failed to insert {len(batch)} messages for thread {thread_id} (retry {retry}): {str(e)}")
+                if retry < 2:
+                    await asyncio.sleep(0.5 * (2 ** retry))
+                else:
+                    raise
+
+    async def _flush_on_completion(self, thread_id: str, response_generator: AsyncGenerator) -> AsyncGenerator:
+        """Relay a response generator and flush queued messages when it ends or fails."""
+        try:
+            async for chunk in response_generator:
+                yield chunk
+        finally:
+            await self.flush_messages(thread_id)
+
     async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
         
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        Context truncation is handled by considering summary messages: only
+        the latest summary and the messages after it are returned.
         
         Args:
             thread_id: The ID of the thread to get messages for.
@@ -108,43 +389,171 @@ class ThreadManager:
         Returns:
             List of message objects.
         """
+        message_rows = await self.get_llm_message_rows(thread_id)
+        return [row['message'] for row in message_rows]
+
+    async def get_llm_message_rows(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Get the LLM-formatted messages of a thread together with their IDs.
+
+        Follows the same rules as the get_llm_formatted_messages SQL function
+        (latest summary and everything after it), but keeps each message's ID
+        so per-message data such as token counts can be cached. Parsed messages
+        are cached per thread; after the first load only messages newer than the
+        last one seen are fetched from the database.
+
+        Args:
+            thread_id: The ID of the thread to get messages for.
+
+        Returns:
+            List of dicts with 'message_id' and the LLM-formatted 'message'.
+        """
         logger.debug(f"Getting messages for thread {thread_id}")
-        client = await self.db.client
+        await self.flush_messages(thread_id)
         
         try:
-            result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            
-            # Parse the returned data which might be stringified JSON
-            if not result.data:
-                return []
-                
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result.data:
-                if isinstance(item, str):
-                    try:
-                        parsed_item = json.loads(item)
-                        messages.append(parsed_item)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse message: {item}")
-                else:
-                    messages.append(item)
-
-            # Ensure tool_calls have properly formatted function arguments
-            for message in messages:
-                if message.get('tool_calls'):
-                    for tool_call in message['tool_calls']:
-                        if isinstance(tool_call, dict) and 'function' in tool_call:
-                            # Ensure function.arguments is a string
-                            if 'arguments' in tool_call['function'] and not isinstance(tool_call['function']['arguments'], str):
-                                tool_call['function']['arguments'] = json.dumps(tool_call['function']['arguments'])
-
-            return messages
+            entry = message_cache.get(thread_id)
+            if entry is not None and await self._has_newer_background_summary(thread_id, entry):
+                # Background summaries are backdated, so the delta query would not see them
+                message_cache.invalidate(thread_id)
+                entry = None
+            if entry is None:
+                rows = await self._load_llm_message_rows(thread_id)
+                message_cache.set(thread_id, rows, rows[-1]['created_at'] if rows else None)
+            else:
+                await self._reconcile_llm_message_rows(thread_id, entry)
+                rows = message_cache.get(thread_id)['rows']
+
+            # Callers (e.g. prompt caching in the LLM service) mutate messages in place
+            return [{'message_id': row['message_id'], 'message': copy.deepcopy(row['message'])} for row in rows]
             
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
+            message_cache.invalidate(thread_id)
             return []
 
+    async def _has_newer_background_summary(self, thread_id: str, entry: Dict[str, Any]) -> bool:
+        """Check whether a summary written by a background worker is missing from the cached view."""
+        try:
+            latest_summary_id = await get_summarization_queue().get_latest_summary(thread_id)
+        except Exception as e:
+            logger.debug(f"Could not check background summary for thread {thread_id}: {str(e)}")
+            return False
+        return bool(latest_summary_id) and latest_summary_id not in entry['ids']
+
+    async def _select_all_pages(self, build_query) -> List[Dict[str, Any]]:
+        """Run an ordered select page by page until a short page comes back.
+
+        Args:
+            build_query: Returns a fresh filtered and ordered query on each call
+        """
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = await build_query().range(offset, offset + MESSAGE_PAGE_SIZE - 1).execute()
+            data = page.data or []
+            rows.extend(data)
+            if len(data) < MESSAGE_PAGE_SIZE:
+                return rows
+            offset += MESSAGE_PAGE_SIZE
+
+    async def _load_llm_message_rows(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Load the current LLM view of a thread from the database."""
+        client = await self.db.client
+
+        # Find the latest summary message if it exists
+        summary_result = await client.table('messages').select('message_id', 'created_at') \
+            .eq('thread_id', thread_id) \
+            .eq('type', 'summary') \
+            .eq('is_llm_message', True) \
+            .order('created_at', desc=True) \
+            .limit(1) \
+            .execute()
+
+        def build_query():
+            query = client.table('messages').select('message_id', 'type', 'content', 'created_at') \
+                .eq('thread_id', thread_id) \
+                .eq('is_llm_message', True)
+            if summary_result.data:
+                # The summary itself and everything after it
+                query = query.gte('created_at', summary_result.data[0]['created_at'])
+            # message_id breaks created_at ties so pages neither overlap nor skip rows
+            return query.order('created_at').order('message_id')
+
+        rows = [self._format_llm_message_row(item) for item in await self._select_all_pages(build_query)]
+        logger.debug(f"Loaded {len(rows)} LLM messages for thread {thread_id}")
+        return [row for row in rows if row]
+
+    async def _reconcile_llm_message_rows(self, thread_id: str, entry: Dict[str, Any]):
+        """Fetch messages newer than the cached view and merge them in."""
+        client = await self.db.client
+
+        # Cheap listing first; contents are only fetched for unknown messages
+        since = None
+        if entry['last_seen']:
+            since = _parse_timestamp(entry['last_seen']) - timedelta(seconds=MESSAGE_RECONCILE_WINDOW)
+
+        def build_listing():
+            query = client.table('messages').select('message_id', 'created_at') \
+                .eq('thread_id', thread_id) \
+                .eq('is_llm_message', True)
+            if since:
+                query = query.gt('created_at', since.isoformat())
+            return query.order('created_at').order('message_id')
+
+        listing = await self._select_all_pages(build_listing)
+        if not listing:
+            return
+
+        # Messages behind the view's summary were summarized away, even if the window re-lists them
+        summary_time = None
+        if entry['rows'] and entry['rows'][0].get('type') == 'summary':
+            summary_time = _parse_timestamp(entry['rows'][0]['created_at'])
+        missing_ids = [
+            item['message_id'] for item in listing
+            if item['message_id'] not in entry['ids']
+            and (summary_time is None or _parse_timestamp(item['created_at']) >= summary_time)
+        ]
+        new_rows = []
+        for start in range(0, len(missing_ids), MESSAGE_FETCH_BATCH_SIZE):
+            result = await client.table('messages').select('message_id', 'type', 'content', 'created_at') \
+                .in_('message_id', missing_ids[start:start + MESSAGE_FETCH_BATCH_SIZE]) \
+                .order('created_at') \
+                .execute()
+            new_rows.extend(row for row in (self._format_llm_message_row(item) for item in result.data or []) if row)
+        if missing_ids:
+            new_rows.sort(key=lambda row: _parse_timestamp(row['created_at']))
+            logger.debug(f"Fetched {len(new_rows)} new LLM messages for thread {thread_id}")
+
+        last_seen = listing[-1]['created_at']
+        if entry['last_seen'] and _parse_timestamp(entry['last_seen']) > _parse_timestamp(last_seen):
+            last_seen = entry['last_seen']
+        message_cache.merge(thread_id, new_rows, last_seen)
+
+    def _format_llm_message_row(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Turn a messages table row into a cached LLM message row."""
+        content = item['content']
+        if isinstance(content, str):
+            try:
+                content = json.loads(content)
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse message: {content}")
+                return None
+
+        # Ensure tool_calls have properly formatted function arguments
+        if isinstance(content, dict) and content.get('tool_calls'):
+            for tool_call in content['tool_calls']:
+                if isinstance(tool_call, dict) and 'function' in tool_call:
+                    # Ensure function.arguments is a string
+                    if 'arguments' in tool_call['function'] and not isinstance(tool_call['function']['arguments'], str):
+                        tool_call['function']['arguments'] = json.dumps(tool_call['function']['arguments'])
+
+        return {
+            'message_id': item['message_id'],
+            'type': item.get('type'),
+            'message': content,
+            'created_at': item['created_at'],
+        }
+
     async def run_thread(
         self,
         thread_id: str,
@@ -249,30 +658,63 @@ Here are the XML tools available with examples:
                 # Note: processor_config is now guaranteed to exist due to check above
                 
                 # 1. Get messages from thread for LLM call
-                messages = await self.get_llm_messages(thread_id)
+                message_rows = await self.get_llm_message_rows(thread_id)
+                messages = [row['message'] for row in message_rows]
                 
                 # 2. Check token count before proceeding
                 token_count = 0
                 try:
-                    from litellm import token_counter
-                    # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages) 
+                    # Use the potentially modified working_system_prompt for token counting;
+                    # the ledger only tokenizes messages it has not counted before
+                    token_count = self.context_manager.token_ledger.count_tokens(
+                        thread_id, llm_model, message_rows, extra_messages=[working_system_prompt]
+                    )
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
                     
                     if token_count >= token_threshold and enable_context_manager:
-                        logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
-                        summarized = await self.context_manager.check_and_summarize_if_needed(
-                            thread_id=thread_id,
-                            add_message_callback=self.add_message,
-                            model=llm_model,
-                            force=True
+                        # Cheap deterministic reductions first; summarize only if they are not enough
+                        message_rows, token_count = self.context_manager.compact_message_rows(
+                            thread_id, llm_model, message_rows, extra_messages=[working_system_prompt]
                         )
+                        messages = [row['message'] for row in message_rows]
+
+                    if enable_context_manager and token_threshold * config.SUMMARIZATION_TRIGGER_PERCENT // 100 <= token_count < token_threshold:
+                        # Summarize ahead of time so the run does not block on it later; the
+                        # worker counts messages only, so it is told the system prompt's share
+                        prompt_tokens = self.context_manager.token_ledger.count_tokens(
+                            thread_id, llm_model, [], extra_messages=[working_system_prompt]
+                        )
+                        await request_summarization(thread_id, llm_model, extra_tokens=prompt_tokens)
+
+                    if token_count >= token_threshold and enable_context_manager:
+                        summarized = False
+                        async with summarization_lock(thread_id, wait=SUMMARIZATION_LOCK_WAIT) as (acquired, waited):
+                            if waited:
+                                # A background worker held the lock; its summary may already cover this
+                                message_rows = await self.get_llm_message_rows(thread_id)
+                                message_rows, token_count = self.context_manager.compact_message_rows(
+                                    thread_id, llm_model, message_rows, extra_messages=[working_system_prompt]
+                                )
+                                messages = [row['message'] for row in message_rows]
+                            if token_count >= token_threshold and acquired:
+                                logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}) after compaction, summarizing...")
+                                summarized = await self.context_manager.check_and_summarize_if_needed(
+                                    thread_id=thread_id,
+                                    add_message_callback=self.add_message,
+                                    model=llm_model,
+                                    force=True
+                                )
+                            elif token_count < token_threshold:
+                                logger.info(f"Background summary brought thread {thread_id} to {token_count} tokens")
                         if summarized:
                             logger.info("Summarization complete, fetching updated messages with summary")
-                            messages = await self.get_llm_messages(thread_id)
+                            message_rows = await self.get_llm_message_rows(thread_id)
+                            messages = [row['message'] for row in message_rows]
                             # Recount tokens after summarization, using the modified prompt
-                            new_token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages) 
+                            new_token_count = self.context_manager.token_ledger.count_tokens(
+                                thread_id, llm_model, message_rows, extra_messages=[working_system_prompt]
+                            )
                             logger.info(f"After summarization: token count reduced from {token_count} to {new_token_count}")
                         else:
                             logger.warning("Summarization failed or wasn't needed - proceeding with original messages")
@@ -348,7 +790,7 @@ Here are the XML tools available with examples:
                         llm_model=llm_model
                     )
                     
-                    return response_generator
+                    return self._flush_on_completion(thread_id, response_generator)
                 else:
                     logger.debug("Processing non-streaming response")
                     try:
@@ -360,7 +802,7 @@ Here are the XML tools available with examples:
                             prompt_messages=prepared_messages,
                             llm_model=llm_model
                         )
-                        return response_generator # Return the generator
+                        return self._flush_on_completion(thread_id, response_generator) # Return the generator
                     except Exception as e:
                         logger.error(f"Error setting up non-streaming response: {str(e)}", exc_info=True)
                         raise # Re-raise the exception to be caught by the outer handler
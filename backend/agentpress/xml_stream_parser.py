@@ -0,0 +1,166 @@
+"""
+Incremental XML tool call scanner for AgentPress.
+
+This module provides a resumable, single-pass tokenizer that detects complete
+XML tool call chunks (e.g. <create-file ...>...</create-file>) in streamed LLM
+output. Unlike re-scanning the whole accumulated buffer on every delta, the
+scanner keeps its position across calls to feed(), so every streamed character
+is inspected a constant number of times.
+"""
+
+import re
+from typing import Iterable, List, Optional, Set
+
+# Characters allowed in an XML tool tag name (e.g. "create-file", "web_search")
+_TAG_NAME_CHARS = r'[\w\-.:]'
+
+# Characters that may follow a tag name inside an opening tag
+_TAG_NAME_DELIMITERS = frozenset(' \t\r\n>/')
+
+# Sentinel returned by the matcher when more input is needed to decide
+_PARTIAL = object()
+
+
+class XmlToolCallScanner:
+    """Resumable scanner that emits complete XML tool call chunks.
+
+    The scanner is a small state machine with two states: searching for the
+    opening tag of any registered tool, and inside a tool call waiting for its
+    matching closing tag (nested tags of the same name are tracked by depth).
+    Tag names are matched by reading the identifier after '<' once and looking
+    it up in a set, with a prefix set used to tell a tag split across deltas
+    apart from plain text. Only a partial marker (at most the longest tag name
+    plus a few characters) is ever carried between calls; confirmed text of an
+    in-progress chunk is kept as a list of parts and joined once on emission.
+
+    Attributes:
+        tag_names (Set[str]): XML tag names recognised as tool calls
+    """
+
+    def __init__(self, tag_names: Iterable[str]):
+        """Initialize the scanner.
+
+        Args:
+            tag_names: XML tag names of the registered tools
+        """
+        self.tag_names: Set[str] = set(tag_names)
+        self._prefixes: Set[str] = {
+            name[:i] for name in self.tag_names for i in range(len(name) + 1)
+        }
+        max_len = max((len(name) for name in self.tag_names), default=0)
+        # Read at most one character past the longest tag name
+        self._name_re = re.compile(f'{_TAG_NAME_CHARS}{{0,{max_len + 1}}}')
+
+        self._pending = ""            # Undecided tail carried to the next feed
+        self._current_tag: Optional[str] = None
+        self._depth = 0
+        self._parts: List[str] = []   # Confirmed text of the in-progress chunk
+
+    def reset(self) -> None:
+        """Discard all buffered state."""
+        self._pending = ""
+        self._current_tag = None
+        self._depth = 0
+        self._parts = []
+
+    @property
+    def in_tool_call(self) -> bool:
+        """Whether an opening tag has been seen without its closing tag."""
+        return self._current_tag is not None
+
+    def _match_open(self, data: str, pos: int, only_tag: Optional[str] = None):
+        """Match an opening tool tag at data[pos] == '<'.
+
+        Returns:
+            The tag name, None if this is not an opening tag, or _PARTIAL if
+            the buffer ends before the decision can be made.
+        """
+        name_start = pos + 1
+        name = self._name_re.match(data, name_start).group(0)
+        name_end = name_start + len(name)
+
+        if name_end >= len(data):
+            # Identifier runs up to the end of the buffer - may still grow
+            if only_tag is not None:
+                return _PARTIAL if only_tag.startswith(name) else None
+            return _PARTIAL if name in self._prefixes else None
+
+        if data[name_end] not in _TAG_NAME_DELIMITERS:
+            return None
+        if only_tag is not None:
+            return name if name == only_tag else None
+        return name if name in self.tag_names else None
+
+    def feed(self, text: str) -> List[str]:
+        """Consume the next piece of streamed content.
+
+        Args:
+            text: Newly received content (may be empty)
+
+        Returns:
+            List of complete XML chunks that were closed by this piece, in order
+        """
+        chunks: List[str] = []
+        if not self.tag_names:
+            return chunks
+
+        data = self._pending + text if self._pending else text
+        self._pending = ""
+        pos = 0
+        chunk_start = 0
+
+        while True:
+            if self._current_tag is None:
+                # --- Searching for the next opening tag ---
+                lt = data.find('<', pos)
+                if lt == -1:
+                    break
+                tag = self._match_open(data, lt)
+                if tag is _PARTIAL:
+                    self._pending = data[lt:]
+                    break
+                if tag is None:
+                    pos = lt + 1
+                    continue
+                self._current_tag = tag
+                self._depth = 1
+                self._parts = []
+                chunk_start = lt
+                pos = lt + 1 + len(tag)
+            else:
+                # --- Inside a tool call, tracking nesting of the same tag ---
+                tag = self._current_tag
+                close_tag = f'</{tag}>'
+                lt = data.find('<', pos)
+                if lt == -1:
+                    self._parts.append(data[chunk_start:])
+                    break
+
+                if data.startswith(close_tag, lt):
+                    self._depth -= 1
+                    pos = lt + len(close_tag)
+                    if self._depth == 0:
+                        self._parts.append(data[chunk_start:pos])
+                        chunks.append("".join(self._parts))
+                        self._parts = []
+                        self._current_tag = None
+                    continue
+
+                if close_tag.startswith(data[lt:lt + len(close_tag)]) and len(data) - lt < len(close_tag):
+                    # Closing tag split across deltas
+                    self._parts.append(data[chunk_start:lt])
+                    self._pending = data[lt:]
+                    break
+
+                nested = self._match_open(data, lt, only_tag=tag)
+                if nested is _PARTIAL:
+                    self._parts.append(data[chunk_start:lt])
+                    self._pending = data[lt:]
+                    break
+                if nested is not None:
+                    self._depth += 1
+                    pos = lt + 1 + len(tag)
+                else:
+                    pos = lt + 1
+
+        return chunks
@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from agentpress.thread_manager import ThreadManager
+from agentpress.summarization_worker import SummarizationWorker
 from services.supabase import DBConnection
 from datetime import datetime, timezone
 from dotenv import load_dotenv
@@ -16,7 +17,9 @@ from collections import OrderedDict
 # Import the agent API module
 from agent import api as agent_api
 from sandbox import api as sandbox_api
+from sandbox.pool import schedule_sandbox_pool_refill
 from services import billing as billing_api
+from services import http_client
 
 # Load environment variables (these will be available through config)
 load_dotenv()
@@ -24,6 +27,7 @@ load_dotenv()
 # Initialize managers
 db = DBConnection()
 thread_manager = None
+summarization_worker = None
 instance_id = "single"
 
 # Rate limiter state
@@ -33,7 +37,7 @@ MAX_CONCURRENT_IPS = 25
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global thread_manager
+    global thread_manager, summarization_worker
     logger.info(f"Starting up FastAPI application with instance ID: {instance_id} in {config.ENV_MODE.value} mode")
     
     try:
@@ -62,9 +66,19 @@ async def lifespan(app: FastAPI):
         
         # Start background tasks
         asyncio.create_task(agent_api.restore_running_agent_runs())
+        schedule_sandbox_pool_refill()
+        if config.SUMMARIZATION_WORKER_ENABLED:
+            summarization_worker = SummarizationWorker(
+                thread_manager, concurrency=config.SUMMARIZATION_WORKER_CONCURRENCY
+            )
+            summarization_worker.start()
         
         yield
         
+        # Stop background summarization before the connections it uses are closed
+        if summarization_worker:
+            await summarization_worker.stop()
+        
         # Clean up agent resources
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
@@ -77,6 +91,9 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.error(f"Error closing Redis connection: {e}")
         
+        # Close pooled outbound HTTP clients
+        await http_client.close()
+        
         # Clean up database connection
         logger.info("Disconnecting from database")
         await db.disconnect()
@@ -0,0 +1,172 @@
+"""
+Benchmark for the streaming XML tool call parser.
+
+Replays a recorded LLM stream through the previous re-scanning extractor and
+through the incremental XmlToolCallScanner, checks that both produce the same
+tool call chunks and prints the time spent by each. The legacy extractor
+skips a tool call that starts immediately after the previous one closes, so
+recordings containing adjacent calls will report a mismatch.
+
+Usage:
+    python benchmark_xml_parser.py                      # synthetic multi-MB stream
+    python benchmark_xml_parser.py stream.jsonl         # one {"content": "..."} delta per line
+    python benchmark_xml_parser.py response.txt --delta-size 16
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Iterable, List
+
+from agentpress.xml_stream_parser import XmlToolCallScanner
+
+DEFAULT_TAG_NAMES = [
+    "ask", "browser-click-coordinates", "browser-click-element", "browser-close-tab",
+    "browser-drag-drop", "browser-extract-content", "browser-get-dropdown-options",
+    "browser-go-back", "browser-input-text", "browser-navigate-to", "browser-open-tab",
+    "browser-scroll-down", "browser-scroll-to-text", "browser-scroll-up",
+    "browser-search-google", "browser-select-dropdown-option", "browser-send-keys",
+    "browser-switch-tab", "browser-wait", "click", "complete", "create-file", "delete-file",
+    "deploy", "drag-to", "execute-command", "execute-data-provider-call", "expose-port",
+    "full-file-rewrite", "get-data-provider-endpoints", "hotkey", "inform", "mouse-down",
+    "mouse-up", "move-to", "press", "read-file", "scrape-webpage", "scroll", "see-image",
+    "str-replace", "typing", "wait", "web-browser-takeover", "web-search",
+]
+
+
+def legacy_extract_xml_chunks(content: str, tag_names: List[str]) -> List[str]:
+    """Previous ResponseProcessor._extract_xml_chunks, kept for comparison."""
+    chunks = []
+    pos = 0
+    while pos < len(content):
+        next_tag_start = -1
+        current_tag = None
+        for tag_name in tag_names:
+            tag_pos = content.find(f'<{tag_name}', pos)
+            if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
+                next_tag_start = tag_pos
+                current_tag = tag_name
+        if next_tag_start == -1 or not current_tag:
+            break
+
+        end_pattern = f'</{current_tag}>'
+        tag_stack = []
+        chunk_start = next_tag_start
+        current_pos = next_tag_start
+        while current_pos < len(content):
+            next_start = content.find(f'<{current_tag}', current_pos + 1)
+            next_end = content.find(end_pattern, current_pos)
+            if next_end == -1:
+                break
+            if next_start != -1 and next_start < next_end:
+                tag_stack.append(next_start)
+                current_pos = next_start + 1
+            else:
+                if not tag_stack:
+                    chunk_end = next_end + len(end_pattern)
+                    chunks.append(content[chunk_start:chunk_end])
+                    pos = chunk_end
+                    break
+                tag_stack.pop()
+                current_pos = next_end + 1
+        if current_pos >= len(content):
+            break
+        pos = max(pos + 1, current_pos)
+    return chunks
+
+
+def run_legacy(deltas: Iterable[str], tag_names: List[str]) -> List[str]:
+    """Replay deltas the way process_streaming_response used to."""
+    found = []
+    current_xml_content = ""
+    for delta in deltas:
+        current_xml_content += delta
+        for xml_chunk in legacy_extract_xml_chunks(current_xml_content, tag_names):
+            current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+            found.append(xml_chunk)
+    return found
+
+
+def run_incremental(deltas: Iterable[str], tag_names: List[str]) -> List[str]:
+    """Replay deltas through the incremental scanner."""
+    found = []
+    scanner = XmlToolCallScanner(tag_names)
+    for delta in deltas:
+        found.extend(scanner.feed(delta))
+    return found
+
+
+def synthetic_stream(target_bytes: int, seed: int = 0) -> str:
+    """Build an assistant response mixing prose with large create-file calls."""
+    rng = random.Random(seed)
+    words = ["the", "file", "agent", "<div>", "value", "</span>", "a < b", "result", "\n"]
+    parts = []
+    size = 0
+    while size < target_bytes:
+        prose = " ".join(rng.choice(words) for _ in range(rng.randint(20, 200)))
+        body = "\n".join(
+            f"<p class='row-{i}'>{' '.join(rng.choice(words) for _ in range(12))}</p>"
+            for i in range(rng.randint(50, 2000))
+        )
+        part = (
+            f"{prose}\n\n<create-file file_path=\"src/page_{len(parts)}.html\">\n{body}\n</create-file>\n\n"
+            f"<execute-command>ls -la</execute-command>\n"
+        )
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def split_deltas(content: str, delta_size: int) -> List[str]:
+    """Split content into fixed-size deltas, approximating token-level streaming."""
+    return [content[i:i + delta_size] for i in range(0, len(content), delta_size)]
+
+
+def load_deltas(path: str, delta_size: int) -> List[str]:
+    """Load recorded deltas from a JSONL recording or a plain text response."""
+    if path.endswith(".jsonl"):
+        deltas = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    deltas.append(json.loads(line).get("content") or "")
+        return deltas
+    with open(path, encoding="utf-8") as f:
+        return split_deltas(f.read(), delta_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming XML tool call parsers")
+    parser.add_argument("recording", nargs="?", help="JSONL deltas or plain text response to replay")
+    parser.add_argument("--delta-size", type=int, default=8, help="Characters per delta for plain text input")
+    parser.add_argument("--size-mb", type=float, default=0.5, help="Size of the synthetic stream")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the incremental scanner")
+    args = parser.parse_args()
+
+    if args.recording:
+        deltas = load_deltas(args.recording, args.delta_size)
+    else:
+        deltas = split_deltas(synthetic_stream(int(args.size_mb * 1024 * 1024)), args.delta_size)
+
+    total = sum(len(d) for d in deltas)
+    print(f"Replaying {len(deltas)} deltas ({total / 1024 / 1024:.2f} MB), {len(DEFAULT_TAG_NAMES)} tags")
+
+    start = time.perf_counter()
+    incremental = run_incremental(deltas, DEFAULT_TAG_NAMES)
+    incremental_time = time.perf_counter() - start
+    print(f"incremental: {incremental_time:.3f}s, {len(incremental)} tool calls")
+
+    if not args.skip_legacy:
+        start = time.perf_counter()
+        legacy = run_legacy(deltas, DEFAULT_TAG_NAMES)
+        legacy_time = time.perf_counter() - start
+        print(f"legacy:      {legacy_time:.3f}s, {len(legacy)} tool calls")
+        print(f"speedup:     {legacy_time / max(incremental_time, 1e-9):.1f}x")
+        if legacy != incremental:
+            print(f"WARNING: parsers produced different tool call chunks ({len(legacy)} vs {len(incremental)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 import os
-from typing import List, Optional
+import re
+from typing import List, Optional, Tuple
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, APIRouter, Form, Depends, Request
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from utils.logger import logger
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, get_optional_user_id
-from sandbox.sandbox import get_or_start_sandbox
+from sandbox.sandbox import get_or_start_sandbox, AsyncSandbox
+from sandbox.transfer import upload_stream, get_file_size, iter_file_range
 from services.supabase import DBConnection
 from agent.api import get_or_create_project_sandbox
 
@@ -103,7 +105,7 @@ async def get_sandbox_by_id_safely(client, sandbox_id: str):
         if retrieved_sandbox_id != sandbox_id:
             logger.warning(f"Retrieved sandbox ID {retrieved_sandbox_id} doesn't match requested ID {sandbox_id} for project {project_id}")
             # Fall back to the direct method if IDs don't match (shouldn't happen but just in case)
-            sandbox = await get_or_start_sandbox(sandbox_id)
+            sandbox = AsyncSandbox(await get_or_start_sandbox(sandbox_id))
         
         return sandbox
     except Exception as e:
@@ -136,12 +138,9 @@ async def create_file(
         # Get sandbox using the safer method
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
-        # Read file content directly from the uploaded file
-        content = await file.read()
-        
-        # Create file using raw binary content
-        sandbox.fs.upload_file(path, content)
-        logger.info(f"File created at {path} in sandbox {sandbox_id}")
+        # Stream the upload to the sandbox in chunks instead of reading it into memory
+        size = await upload_stream(sandbox, path, file)
+        logger.info(f"File created at {path} in sandbox {sandbox_id} ({size} bytes)")
         
         return {"status": "success", "created": True, "path": path}
     except Exception as e:
@@ -180,7 +179,7 @@ async def create_file_json(
             content = content.encode('utf-8')
         
         # Create file
-        sandbox.fs.upload_file(path, content)
+        await sandbox.fs.upload_file(path, content)
         logger.info(f"File created at {path} in sandbox {sandbox_id}")
         
         return {"status": "success", "created": True, "path": path}
@@ -207,7 +206,7 @@ async def list_files(
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
         # List files
-        files = sandbox.fs.list_files(path)
+        files = await sandbox.fs.list_files(path)
         result = []
         
         for file in files:
@@ -230,6 +229,40 @@ async def list_files(
         logger.error(f"Error listing files in sandbox {sandbox_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range HTTP Range header.
+    
+    Returns:
+        (start, end) with end inclusive, or None to send the whole file
+        
+    Raises:
+        HTTPException: 416 if the range cannot be satisfied
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or (not match.group(1) and not match.group(2)):
+        # Multiple or malformed ranges: fall back to the full content
+        return None
+    
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else file_size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(file_size - int(match.group(2)), 0)
+        end = file_size - 1
+    end = min(end, file_size - 1)
+    
+    if start >= file_size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, end
+
 @router.get("/sandboxes/{sandbox_id}/files/content")
 async def read_file(
     sandbox_id: str, 
@@ -248,17 +281,28 @@ async def read_file(
         # Get sandbox using the safer method
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
-        # Read file
-        content = sandbox.fs.download_file(path)
+        file_size = await get_file_size(sandbox, path)
+        byte_range = parse_range_header(request.headers.get("range") if request else None, file_size)
+        start, end = byte_range or (0, file_size - 1)
         
-        # Return a Response object with the content directly
+        # Stream the file in chunks, honouring a Range request if one was sent
         filename = os.path.basename(path)
-        logger.info(f"Successfully read file {filename} from sandbox {sandbox_id}")
-        return Response(
-            content=content,
+        headers = {
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(max(end - start + 1, 0))
+        }
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        logger.info(f"Streaming file {filename} from sandbox {sandbox_id} (bytes {start}-{end} of {file_size})")
+        return StreamingResponse(
+            iter_file_range(sandbox, path, start, end, file_size) if file_size else iter(()),
+            status_code=206 if byte_range else 200,
             media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            headers=headers
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error reading file in sandbox {sandbox_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
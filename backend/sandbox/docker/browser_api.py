@@ -1,5 +1,5 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Body
-from playwright.async_api import async_playwright, Browser, Page, ElementHandle
+from fastapi import FastAPI, APIRouter, HTTPException, Body, Depends, Header
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, ElementHandle
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any, Union
 import asyncio
@@ -13,9 +13,236 @@ import os
 import random
 from functools import cached_property
 import traceback
+import time
+import contextvars
 import pytesseract
 from PIL import Image
 import io
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+
+# OCR of screenshots: "eager" runs it after every action, "lazy" only when
+# /automation/ocr_text is called, "off" never
+OCR_MODE = os.getenv("BROWSER_OCR_MODE", "eager").lower()
+OCR_MAX_WORKERS = max(1, int(os.getenv("BROWSER_OCR_WORKERS", "2")))
+OCR_CACHE_SIZE = int(os.getenv("BROWSER_OCR_CACHE_SIZE", "64"))
+
+# Page settle detection after actions: wait for the network to go idle and for
+# the DOM to stop changing for SETTLE_QUIET_MS, giving up after SETTLE_TIMEOUT_MS.
+# The network is idle with no requests in flight, or with at most
+# SETTLE_MAX_INFLIGHT left (long polls, hanging beacons) once no request has
+# started or finished for SETTLE_NETWORK_QUIET_MS
+SETTLE_TIMEOUT_MS = int(os.getenv("BROWSER_SETTLE_TIMEOUT_MS", "3000"))
+SETTLE_QUIET_MS = int(os.getenv("BROWSER_SETTLE_QUIET_MS", "150"))
+SETTLE_MAX_INFLIGHT = int(os.getenv("BROWSER_SETTLE_MAX_INFLIGHT", "2"))
+SETTLE_NETWORK_QUIET_MS = int(os.getenv("BROWSER_SETTLE_NETWORK_QUIET_MS", "500"))
+
+# Request types that stay open indefinitely and must not delay settling
+LONG_LIVED_RESOURCE_TYPES = {"eventsource", "websocket"}
+
+# Navigation profiles of navigate_to: "full" loads everything, "fast" blocks heavy
+# resource types and ad/analytics hosts, "text" also blocks stylesheets and skips
+# the screenshot. A tab keeps the profile of its last navigate_to
+NAVIGATION_PROFILE = os.getenv("BROWSER_NAVIGATION_PROFILE", "full").lower()
+NAVIGATION_BLOCKED_RESOURCE_TYPES = {
+    "full": set(),
+    "fast": {"image", "media", "font"},
+    "text": {"image", "media", "font", "stylesheet"}
+}
+# Load state navigate_to waits for: "domcontentloaded", "load" or "networkidle"
+NAVIGATION_WAIT_UNTIL = os.getenv("BROWSER_NAVIGATION_WAIT_UNTIL", "networkidle").lower()
+NAVIGATION_WAIT_STATES = {"domcontentloaded", "load", "networkidle"}
+
+# Ad and analytics hosts (and their subdomains) blocked by the fast and text profiles
+BLOCKED_HOSTS = {
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "google-analytics.com",
+    "googletagmanager.com", "googletagservices.com", "adservice.google.com", "amazon-adsystem.com",
+    "adnxs.com", "criteo.com", "criteo.net", "taboola.com", "outbrain.com", "scorecardresearch.com",
+    "quantserve.com", "hotjar.com", "segment.io", "segment.com", "mixpanel.com", "amplitude.com",
+    "connect.facebook.net", "analytics.tiktok.com", "bat.bing.com", "clarity.ms", "newrelic.com",
+    "nr-data.net", "optimizely.com", "adsrvr.org", "rubiconproject.com", "pubmatic.com", "openx.net"
+}
+BLOCKED_HOSTS.update(host.strip().lower() for host in os.getenv("BROWSER_BLOCKED_HOSTS", "").split(",") if host.strip())
+
+# Browser sessions: requests carrying an X-Browser-Session header run in their
+# own isolated BrowserContext, one request per session at a time. At most
+# MAX_BROWSER_SESSIONS extra sessions are kept; the least recently used idle one
+# is closed to make room, and sessions idle for SESSION_IDLE_TIMEOUT seconds are closed
+DEFAULT_SESSION_ID = "default"
+MAX_BROWSER_SESSIONS = max(1, int(os.getenv("BROWSER_MAX_SESSIONS", "4")))
+SESSION_IDLE_TIMEOUT = int(os.getenv("BROWSER_SESSION_IDLE_TIMEOUT", "900"))
+
+# Action results carry only the interactive elements that changed since the
+# tab's previous state, with a full snapshot every STATE_SNAPSHOT_INTERVAL states
+STATE_SNAPSHOT_INTERVAL = max(1, int(os.getenv("BROWSER_STATE_SNAPSHOT_INTERVAL", "10")))
+
+# Attribute stamped on each element of the selector map with its index, so an
+# action resolves its target with a single attribute lookup
+ELEMENT_INDEX_ATTRIBUTE = "data-agent-idx"
+
+# Counts DOM mutations per document (ignoring index stamps) in window.__agentDomVersion,
+# a "<document id>:<count>" string that identifies the DOM a selector map was built from
+DOM_VERSION_OBSERVER_JS = """
+(() => {
+    if (window.__agentDomObserver) return;
+    const documentId = Math.random().toString(36).slice(2);
+    let count = 0;
+    window.__agentDomVersion = documentId + ':0';
+    window.__agentDomObserver = new MutationObserver(mutations => {
+        if (mutations.some(m => m.type !== 'attributes' || m.attributeName !== '""" + ELEMENT_INDEX_ATTRIBUTE + """')) {
+            count += 1;
+            window.__agentDomVersion = documentId + ':' + count;
+        }
+    });
+    window.__agentDomObserver.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+})();
+"""
+
+# Collects the visible interactive elements of the page and stamps their indexes
+INTERACTIVE_ELEMENTS_JS = """
+() => {
+    """ + DOM_VERSION_OBSERVER_JS.strip() + """
+
+    // Helper function to get all attributes as an object
+    function getAttributes(el) {
+        const attributes = {};
+        for (const attr of el.attributes) {
+            attributes[attr.name] = attr.value;
+        }
+        return attributes;
+    }
+
+    // Find all potentially interactive elements
+    const interactiveElements = Array.from(document.querySelectorAll(
+        'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
+    ));
+
+    // Filter for visible elements
+    const visibleElements = interactiveElements.filter(el => {
+        const style = window.getComputedStyle(el);
+        const rect = el.getBoundingClientRect();
+        return style.display !== 'none' && 
+               style.visibility !== 'hidden' && 
+               style.opacity !== '0' &&
+               rect.width > 0 && 
+               rect.height > 0;
+    });
+
+    // Drop the stamps of the previous map before stamping this one
+    document.querySelectorAll('[""" + ELEMENT_INDEX_ATTRIBUTE + """]').forEach(el => el.removeAttribute('""" + ELEMENT_INDEX_ATTRIBUTE + """'));
+
+    // Map to our expected structure
+    return visibleElements.map((el, index) => {
+        const rect = el.getBoundingClientRect();
+        const isInViewport = rect.top >= 0 && 
+                          rect.left >= 0 && 
+                          rect.bottom <= window.innerHeight &&
+                          rect.right <= window.innerWidth;
+
+        const attributes = getAttributes(el);
+        el.setAttribute('""" + ELEMENT_INDEX_ATTRIBUTE + """', String(index + 1));
+
+        return {
+            index: index + 1,
+            tagName: el.tagName.toLowerCase(),
+            text: el.innerText || el.value || '',
+            attributes: attributes,
+            isVisible: true,
+            isInteractive: true,
+            pageCoordinates: {
+                x: rect.left + window.scrollX,
+                y: rect.top + window.scrollY,
+                width: rect.width,
+                height: rect.height
+            },
+            viewportCoordinates: {
+                x: rect.left,
+                y: rect.top,
+                width: rect.width,
+                height: rect.height
+            },
+            isInViewport: isInViewport
+        };
+    });
+}
+"""
+
+# Collects everything get_updated_browser_state needs in one round trip
+PAGE_STATE_JS = """
+() => {
+    const body = document.body;
+    const html = document.documentElement;
+    const totalHeight = Math.max(
+        body ? body.scrollHeight : 0, body ? body.offsetHeight : 0,
+        html.clientHeight, html.scrollHeight, html.offsetHeight
+    );
+    const scrollY = window.scrollY || window.pageYOffset;
+    const windowHeight = window.innerHeight;
+    
+    return {
+        elements: (""" + INTERACTIVE_ELEMENTS_JS.strip() + """)(),
+        title: document.title,
+        pixelsAbove: scrollY,
+        pixelsBelow: Math.max(0, totalHeight - scrollY - windowHeight),
+        viewportWidth: window.innerWidth,
+        viewportHeight: windowHeight,
+        domVersion: window.__agentDomVersion
+    };
+}
+"""
+
+# Current DOM version of the page, null if no selector map was built for this document
+DOM_VERSION_JS = "() => window.__agentDomVersion || null"
+
+# Returns the stamped element for an index, or null if the DOM changed since
+# expectedVersion (pass null to skip the check) or the element is gone
+RESOLVE_ELEMENT_JS = """
+({index, expectedVersion}) => {
+    if (expectedVersion !== null && window.__agentDomVersion !== expectedVersion) return null;
+    const el = document.querySelector('[""" + ELEMENT_INDEX_ATTRIBUTE + """="' + index + '"]');
+    return el && el.isConnected ? el : null;
+}
+"""
+
+# Resolves once the DOM has not changed for quietMs, or after timeoutMs
+DOM_SETTLE_JS = """
+({quietMs, timeoutMs}) => new Promise(resolve => {
+    let quietTimer = null;
+    let capTimer = null;
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(done, quietMs);
+    });
+    function done() {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(capTimer);
+        resolve();
+    }
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    quietTimer = setTimeout(done, quietMs);
+    capTimer = setTimeout(done, timeoutMs);
+})
+"""
+
+
+def run_ocr(image_bytes: bytes) -> str:
+    """Extract text from an encoded image. Runs in the OCR worker processes."""
+    image = Image.open(io.BytesIO(image_bytes))
+    return pytesseract.image_to_string(image).strip()
+
+
+def is_blocked_host(url: str) -> bool:
+    """Whether a request URL points at one of BLOCKED_HOSTS or a subdomain of it"""
+    host = (urlparse(url).hostname or "").lower()
+    while host:
+        if host in BLOCKED_HOSTS:
+            return True
+        host = host.partition(".")[2]
+    return False
 
 #######################################################
 # Action model definitions
@@ -34,6 +261,8 @@ class ClickCoordinatesAction(BaseModel):
 
 class GoToUrlAction(BaseModel):
     url: str
+    profile: Optional[str] = None  # "full", "fast" or "text", NAVIGATION_PROFILE if omitted
+    wait_until: Optional[str] = None  # "domcontentloaded", "load" or "networkidle", NAVIGATION_WAIT_UNTIL if omitted
 
 class InputTextAction(BaseModel):
     index: int
@@ -100,6 +329,18 @@ class HashedDomElement:
     attributes: Dict[str, str]
     is_visible: bool
     page_coordinates: Optional[CoordinateSet] = None
+    
+    @cached_property
+    def key(self) -> str:
+        """Short digest identifying the element across states of a tab"""
+        coordinates = self.page_coordinates
+        payload = json.dumps([
+            self.tag_name,
+            sorted(self.attributes.items()),
+            self.is_visible,
+            [round(coordinates.x), round(coordinates.y), round(coordinates.width), round(coordinates.height)] if coordinates else None
+        ])
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
 
 @dataclass
 class DOMBaseNode:
@@ -182,6 +423,41 @@ class DOMElementNode(DOMBaseNode):
         collect_text(self, 0)
         return '\n'.join(text_parts).strip()
     
+    def clickable_line(self, include_attributes: list[str] | None = None) -> str:
+        """Format this element as its line of clickable_elements_to_string"""
+        attributes_str = ''
+        text = self.get_all_text_till_next_clickable_element()
+        
+        # Process attributes for display
+        display_attributes = []
+        if include_attributes:
+            for key, value in self.attributes.items():
+                if key in include_attributes and value and value != self.tag_name:
+                    if text and value in text:
+                        continue  # Skip if attribute value is already in the text
+                    display_attributes.append(str(value))
+        
+        attributes_str = ';'.join(display_attributes)
+        
+        # Build the element string
+        line = f'[{self.highlight_index}]<{self.tag_name}'
+        
+        # Add important attributes for identification
+        for attr_name in ['id', 'href', 'name', 'value', 'type']:
+            if attr_name in self.attributes and self.attributes[attr_name]:
+                line += f' {attr_name}="{self.attributes[attr_name]}"'
+        
+        # Add the text content if available
+        if text:
+            line += f'> {text}'
+        elif attributes_str:
+            line += f'> {attributes_str}'
+        else:
+            # If no text and no attributes, use the tag name
+            line += f'> {self.tag_name.upper()}'
+        
+        return line + ' </>'
+    
     def clickable_elements_to_string(self, include_attributes: list[str] | None = None) -> str:
         """Convert the processed DOM content to HTML."""
         formatted_text = []
@@ -190,39 +466,7 @@ class DOMElementNode(DOMBaseNode):
             if isinstance(node, DOMElementNode):
                 # Add element with highlight_index
                 if node.highlight_index is not None:
-                    attributes_str = ''
-                    text = node.get_all_text_till_next_clickable_element()
-                    
-                    # Process attributes for display
-                    display_attributes = []
-                    if include_attributes:
-                        for key, value in node.attributes.items():
-                            if key in include_attributes and value and value != node.tag_name:
-                                if text and value in text:
-                                    continue  # Skip if attribute value is already in the text
-                                display_attributes.append(str(value))
-                    
-                    attributes_str = ';'.join(display_attributes)
-                    
-                    # Build the element string
-                    line = f'[{node.highlight_index}]<{node.tag_name}'
-                    
-                    # Add important attributes for identification
-                    for attr_name in ['id', 'href', 'name', 'value', 'type']:
-                        if attr_name in node.attributes and node.attributes[attr_name]:
-                            line += f' {attr_name}="{node.attributes[attr_name]}"'
-                    
-                    # Add the text content if available
-                    if text:
-                        line += f'> {text}'
-                    elif attributes_str:
-                        line += f'> {attributes_str}'
-                    else:
-                        # If no text and no attributes, use the tag name
-                        line += f'> {node.tag_name.upper()}'
-                    
-                    line += ' </>'
-                    formatted_text.append(line)
+                    formatted_text.append(node.clickable_line(include_attributes))
                 
                 # Process children regardless
                 for child in node.children:
@@ -265,6 +509,7 @@ class BrowserActionResult(BaseModel):
     pixels_below: int = 0
     content: Optional[str] = None
     ocr_text: Optional[str] = None  # Added field for OCR text
+    ocr_unchanged: bool = False  # OCR text omitted because it matches the tab's previous state
     
     # Additional metadata
     element_count: int = 0  # Number of interactive elements found
@@ -272,24 +517,99 @@ class BrowserActionResult(BaseModel):
     viewport_width: Optional[int] = None
     viewport_height: Optional[int] = None
     
+    # Element state encoding: "full" carries interactive_elements and elements,
+    # "delta" only the changes against base_state_id (elements keyed by hash)
+    tab_id: Optional[int] = None
+    state_id: Optional[str] = None
+    base_state_id: Optional[str] = None
+    state_mode: str = "full"
+    elements_added: Optional[List[Dict[str, Any]]] = None
+    elements_changed: Optional[List[Dict[str, Any]]] = None
+    elements_removed: Optional[List[str]] = None
+    
     class Config:
         arbitrary_types_allowed = True
 
+#######################################################
+# Browser Sessions
+#######################################################
+
+@dataclass
+class PageNetwork:
+    """Requests in flight on a page and when that set last changed"""
+    inflight: set = field(default_factory=set)
+    last_change: float = field(default_factory=time.monotonic)
+    
+    def add(self, request):
+        self.inflight.add(request)
+        self.last_change = time.monotonic()
+    
+    def discard(self, request):
+        self.inflight.discard(request)
+        self.last_change = time.monotonic()
+    
+    def is_idle(self) -> bool:
+        if not self.inflight:
+            return True
+        quiet_s = time.monotonic() - self.last_change
+        return len(self.inflight) <= SETTLE_MAX_INFLIGHT and quiet_s * 1000 >= SETTLE_NETWORK_QUIET_MS
+
+@dataclass
+class BrowserSession:
+    """Tabs of one isolated browser context and the lock serializing its requests"""
+    session_id: str
+    context: Optional[BrowserContext] = None  # None for the default session, whose tabs get their own contexts
+    pages: List[Page] = field(default_factory=list)
+    current_page_index: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+    requests: int = 0  # Requests holding or waiting for the lock; such sessions are never evicted
+    
+    async def new_page(self, browser: Browser) -> Page:
+        if self.context is None:
+            return await browser.new_page()
+        return await self.context.new_page()
+
+# Session and tab of the request being handled, set by BrowserAutomation.session_scope
+_request_session: contextvars.ContextVar[Optional[BrowserSession]] = contextvars.ContextVar("browser_session", default=None)
+_request_page: contextvars.ContextVar[Optional[Page]] = contextvars.ContextVar("browser_page", default=None)
+
 #######################################################
 # Browser Automation Implementation 
 #######################################################
 
 class BrowserAutomation:
     def __init__(self):
-        self.router = APIRouter()
+        self.router = APIRouter(dependencies=[Depends(self.session_scope)])
         self.browser: Browser = None
-        self.pages: List[Page] = []
-        self.current_page_index: int = 0
+        self.default_session = BrowserSession(DEFAULT_SESSION_ID)
+        self.sessions: "OrderedDict[str, BrowserSession]" = OrderedDict()
+        self.sessions_lock = asyncio.Lock()
         self.logger = logging.getLogger("browser_automation")
         self.include_attributes = ["id", "href", "src", "alt", "aria-label", "placeholder", "name", "role", "title", "value"]
         self.screenshot_dir = os.path.join(os.getcwd(), "screenshots")
         os.makedirs(self.screenshot_dir, exist_ok=True)
         
+        # OCR runs in worker processes, results cached by screenshot content hash
+        self.ocr_executor: Optional[ProcessPoolExecutor] = None
+        self.ocr_semaphore = asyncio.Semaphore(OCR_MAX_WORKERS)
+        self.ocr_cache: "OrderedDict[str, str]" = OrderedDict()
+        
+        # Requests in flight per page, used to detect when a page has settled
+        self.inflight_requests: Dict[Page, PageNetwork] = {}
+        
+        # Last selector map per page with the DOM version it was built from
+        self.selector_maps: Dict[Page, tuple] = {}
+        
+        # Element state last sent per tab, the base of the next delta
+        self.session_id = os.urandom(4).hex()
+        self.tab_ids: Dict[Page, int] = {}
+        self.tab_states: Dict[Page, Dict[str, Any]] = {}
+        
+        # Navigation profile of each tab and its request interceptor, if it blocks anything
+        self.page_profiles: Dict[Page, str] = {}
+        self.route_handlers: Dict[Page, Any] = {}
+        
         # Register routes
         self.router.on_startup.append(self.startup)
         self.router.on_shutdown.append(self.shutdown)
@@ -326,6 +646,12 @@ class BrowserAutomation:
         
         # Drag and drop
         self.router.post("/automation/drag_drop")(self.drag_drop)
+        
+        # OCR of the current viewport (for lazy OCR mode)
+        self.router.post("/automation/ocr_text")(self.ocr_text)
+        
+        # Full element state of the current tab, for clients that lost a delta's base
+        self.router.post("/automation/get_state")(self.get_state)
 
     async def startup(self):
         """Initialize the browser instance on startup"""
@@ -357,7 +683,7 @@ class BrowserAutomation:
                 self.current_page_index = 0
             except Exception as page_error:
                 print(f"Error finding existing page, creating new one. ( {page_error})")
-                page = await self.browser.new_page()
+                page = await self.create_page(self.default_session)
                 print("New page created successfully")
                 self.pages.append(page)
                 self.current_page_index = 0
@@ -373,85 +699,155 @@ class BrowserAutomation:
             
     async def shutdown(self):
         """Clean up browser instance on shutdown"""
+        for session in list(self.sessions.values()):
+            await self.close_session(session)
         if self.browser:
             await self.browser.close()
+        if self.ocr_executor:
+            self.ocr_executor.shutdown(wait=False, cancel_futures=True)
+            self.ocr_executor = None
+    
+    @property
+    def session(self) -> BrowserSession:
+        """Session of the request being handled, the default session outside requests"""
+        return _request_session.get() or self.default_session
+    
+    @property
+    def pages(self) -> List[Page]:
+        return self.session.pages
+    
+    @property
+    def current_page_index(self) -> int:
+        return self.session.current_page_index
+    
+    @current_page_index.setter
+    def current_page_index(self, index: int):
+        self.session.current_page_index = index
     
     async def get_current_page(self) -> Page:
         """Get the current active page"""
+        page = _request_page.get()
+        if page is not None:
+            return page
         if not self.pages:
             raise HTTPException(status_code=500, detail="No browser pages available")
         return self.pages[self.current_page_index]
     
-    async def get_selector_map(self) -> Dict[int, DOMElementNode]:
-        """Get a map of selectable elements on the page"""
+    async def session_scope(
+        self,
+        x_browser_session: Optional[str] = Header(None),
+        x_browser_tab: Optional[int] = Header(None)
+    ):
+        """Run a request in its session, holding the session's lock
+        
+        X-Browser-Session selects the session (the default one if absent) and
+        X-Browser-Tab a tab of it by tab ID for this request only.
+        """
+        session = await self.get_session(x_browser_session or DEFAULT_SESSION_ID)
+        try:
+            async with session.lock:
+                session_token = _request_session.set(session)
+                page_token = None
+                if x_browser_tab is not None:
+                    page = next((p for p in session.pages if self.tab_ids.get(p) == x_browser_tab), None)
+                    if page is None:
+                        _request_session.reset(session_token)
+                        raise HTTPException(status_code=404, detail=f"Tab {x_browser_tab} not found in session {session.session_id}")
+                    page_token = _request_page.set(page)
+                try:
+                    yield session
+                finally:
+                    session.last_used = time.monotonic()
+                    if page_token is not None:
+                        _request_page.reset(page_token)
+                    _request_session.reset(session_token)
+        finally:
+            session.requests -= 1
+    
+    async def get_session(self, session_id: str) -> BrowserSession:
+        """Get a session for a request, creating its context and first tab if it does not exist
+        
+        The session counts the request until session_scope releases it, so it
+        cannot be evicted while the request waits for its lock.
+        """
+        if session_id == DEFAULT_SESSION_ID:
+            self.default_session.requests += 1
+            return self.default_session
+        
+        async with self.sessions_lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                session.requests += 1
+                return session
+            
+            await self.evict_sessions()
+            if len(self.sessions) >= MAX_BROWSER_SESSIONS:
+                raise HTTPException(status_code=503, detail=f"All {MAX_BROWSER_SESSIONS} browser sessions are busy")
+            context = await self.browser.new_context()
+            session = BrowserSession(session_id, context=context)
+            session.pages.append(await self.create_page(session))
+            self.sessions[session_id] = session
+            session.requests += 1
+            print(f"Created browser session {session_id} ({len(self.sessions)} open)")
+            return session
+    
+    async def evict_sessions(self):
+        """Close idle sessions past the idle timeout, and the least recently used idle one if the pool is full
+        
+        Called only before creating a session; sessions with requests are never closed.
+        """
+        now = time.monotonic()
+        for session in list(self.sessions.values()):
+            if not session.requests and now - session.last_used > SESSION_IDLE_TIMEOUT:
+                await self.close_session(session)
+        
+        if len(self.sessions) >= MAX_BROWSER_SESSIONS:
+            idle = next((session for session in self.sessions.values() if not session.requests), None)
+            if idle is not None:
+                await self.close_session(idle)
+    
+    async def close_session(self, session: BrowserSession):
+        """Close a session's context and all its tabs"""
+        self.sessions.pop(session.session_id, None)
+        try:
+            await session.context.close()
+            print(f"Closed browser session {session.session_id}")
+        except Exception as e:
+            print(f"Error closing browser session {session.session_id}: {e}")
+    
+    def cache_selector_map(self, page: Page, dom_version: Optional[str], selector_map: Dict[int, DOMElementNode]):
+        """Remember the selector map built for a page at a DOM version"""
+        if not dom_version:
+            self.selector_maps.pop(page, None)
+            return
+        if page not in self.selector_maps:
+            page.on("close", lambda _: self.selector_maps.pop(page, None))
+        self.selector_maps[page] = (dom_version, selector_map)
+    
+    async def get_selector_map(self, elements: Optional[List[Dict[str, Any]]] = None) -> Dict[int, DOMElementNode]:
+        """Get a map of selectable elements on the page
+        
+        Args:
+            elements: Elements already collected by PAGE_STATE_JS. If omitted, the
+                cached map is returned while the page's DOM is unchanged, and the
+                page is probed otherwise
+        """
         page = await self.get_current_page()
         
+        if elements is None:
+            cached = self.selector_maps.get(page)
+            try:
+                if cached and await page.evaluate(DOM_VERSION_JS) == cached[0]:
+                    return cached[1]
+            except Exception as e:
+                print(f"Error checking DOM version: {e}")
+            return (await self.get_current_dom_state()).selector_map
+        
         # Create a selector map for interactive elements
         selector_map = {}
         
         try:
-            # More comprehensive JavaScript to find interactive elements
-            elements_js = """
-            (() => {
-                // Helper function to get all attributes as an object
-                function getAttributes(el) {
-                    const attributes = {};
-                    for (const attr of el.attributes) {
-                        attributes[attr.name] = attr.value;
-                    }
-                    return attributes;
-                }
-                
-                // Find all potentially interactive elements
-                const interactiveElements = Array.from(document.querySelectorAll(
-                    'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
-                ));
-                
-                // Filter for visible elements
-                const visibleElements = interactiveElements.filter(el => {
-                    const style = window.getComputedStyle(el);
-                    const rect = el.getBoundingClientRect();
-                    return style.display !== 'none' && 
-                           style.visibility !== 'hidden' && 
-                           style.opacity !== '0' &&
-                           rect.width > 0 && 
-                           rect.height > 0;
-                });
-                
-                // Map to our expected structure
-                return visibleElements.map((el, index) => {
-                    const rect = el.getBoundingClientRect();
-                    const isInViewport = rect.top >= 0 && 
-                                      rect.left >= 0 && 
-                                      rect.bottom <= window.innerHeight &&
-                                      rect.right <= window.innerWidth;
-                    
-                    return {
-                        index: index + 1,
-                        tagName: el.tagName.toLowerCase(),
-                        text: el.innerText || el.value || '',
-                        attributes: getAttributes(el),
-                        isVisible: true,
-                        isInteractive: true,
-                        pageCoordinates: {
-                            x: rect.left + window.scrollX,
-                            y: rect.top + window.scrollY,
-                            width: rect.width,
-                            height: rect.height
-                        },
-                        viewportCoordinates: {
-                            x: rect.left,
-                            y: rect.top,
-                            width: rect.width,
-                            height: rect.height
-                        },
-                        isInViewport: isInViewport
-                    };
-                });
-            })();
-            """
-            
-            elements = await page.evaluate(elements_js)
             print(f"Found {len(elements)} interactive elements in selector map")
             
             # Create a root element for the tree
@@ -526,11 +922,26 @@ class BrowserAutomation:
         
         return selector_map
     
-    async def get_current_dom_state(self) -> DOMState:
-        """Get the current DOM state including element tree and selector map"""
+    async def probe_page_state(self, page: Page) -> Dict[str, Any]:
+        """Collect elements, title, scroll position and viewport size in one evaluate call"""
+        try:
+            return await page.evaluate(PAGE_STATE_JS)
+        except Exception as e:
+            print(f"Error probing page state: {e}")
+            return {}
+    
+    async def get_current_dom_state(self, probe: Optional[Dict[str, Any]] = None) -> DOMState:
+        """Get the current DOM state including element tree and selector map
+        
+        Args:
+            probe: Result of probe_page_state, taken from the current page if omitted
+        """
         try:
             page = await self.get_current_page()
-            selector_map = await self.get_selector_map()
+            if probe is None:
+                probe = await self.probe_page_state(page)
+            selector_map = await self.get_selector_map(probe.get('elements') or [])
+            self.cache_selector_map(page, probe.get('domVersion'), selector_map)
             
             # Create a root element
             root = DOMElementNode(
@@ -548,38 +959,15 @@ class BrowserAutomation:
             
             # Get basic page info
             url = page.url
-            try:
-                title = await page.title()
-            except:
-                title = "Unknown Title"
+            title = probe.get('title')
+            if title is None:
+                try:
+                    title = await page.title()
+                except:
+                    title = "Unknown Title"
             
-            # Get more accurate scroll information - fix JavaScript syntax
-            try:
-                scroll_info = await page.evaluate("""
-                () => {
-                    const body = document.body;
-                    const html = document.documentElement;
-                    const totalHeight = Math.max(
-                        body.scrollHeight, body.offsetHeight,
-                        html.clientHeight, html.scrollHeight, html.offsetHeight
-                    );
-                    const scrollY = window.scrollY || window.pageYOffset;
-                    const windowHeight = window.innerHeight;
-                    
-                    return {
-                        pixelsAbove: scrollY,
-                        pixelsBelow: Math.max(0, totalHeight - scrollY - windowHeight),
-                        totalHeight: totalHeight,
-                        viewportHeight: windowHeight
-                    };
-                }
-                """)
-                pixels_above = scroll_info.get('pixelsAbove', 0)
-                pixels_below = scroll_info.get('pixelsBelow', 0)
-            except Exception as e:
-                print(f"Error getting scroll info: {e}")
-                pixels_above = 0
-                pixels_below = 0
+            pixels_above = probe.get('pixelsAbove', 0)
+            pixels_below = probe.get('pixelsBelow', 0)
             
             return DOMState(
                 element_tree=root,
@@ -609,6 +997,28 @@ class BrowserAutomation:
                 pixels_below=0
             )
     
+    async def get_element_handle(self, page: Page, index: int) -> Optional[ElementHandle]:
+        """Resolve a selector map index to its element
+        
+        While the DOM is unchanged since the cached map was built this is a
+        single attribute lookup; otherwise the map is rebuilt once and the
+        freshly stamped element is returned. None if no element has the index.
+        """
+        cached = self.selector_maps.get(page)
+        if cached:
+            handle = await page.evaluate_handle(RESOLVE_ELEMENT_JS, {"index": index, "expectedVersion": cached[0]})
+            element = handle.as_element()
+            if element is not None:
+                return element
+            await handle.dispose()
+        
+        await self.get_current_dom_state()
+        handle = await page.evaluate_handle(RESOLVE_ELEMENT_JS, {"index": index, "expectedVersion": None})
+        element = handle.as_element()
+        if element is None:
+            await handle.dispose()
+        return element
+    
     async def take_screenshot(self) -> str:
         """Take a screenshot and return as base64 encoded string"""
         try:
@@ -636,20 +1046,40 @@ class BrowserAutomation:
             return ""
     
     async def extract_ocr_text_from_screenshot(self, screenshot_base64: str) -> str:
-        """Extract text from screenshot using OCR"""
+        """Extract text from screenshot using OCR
+        
+        OCR runs in a process pool limited to OCR_MAX_WORKERS concurrent jobs.
+        Results are cached by a hash of the screenshot bytes, so an unchanged
+        viewport (scroll no-op, wait) is not OCRed again.
+        """
         if not screenshot_base64:
             return ""
             
         try:
             # Decode base64 to image
             image_bytes = base64.b64decode(screenshot_base64)
-            image = Image.open(io.BytesIO(image_bytes))
+            digest = hashlib.sha1(image_bytes).hexdigest()
+            
+            cached = self.ocr_cache.get(digest)
+            if cached is not None:
+                self.ocr_cache.move_to_end(digest)
+                return cached
+            
+            if self.ocr_executor is None:
+                # Spawned workers avoid forking a process that runs the browser and event loop
+                self.ocr_executor = ProcessPoolExecutor(
+                    max_workers=OCR_MAX_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
             
             # Extract text using pytesseract
-            ocr_text = pytesseract.image_to_string(image)
+            async with self.ocr_semaphore:
+                loop = asyncio.get_running_loop()
+                ocr_text = await loop.run_in_executor(self.ocr_executor, run_ocr, image_bytes)
             
-            # Clean up the text
-            ocr_text = ocr_text.strip()
+            self.ocr_cache[digest] = ocr_text
+            while len(self.ocr_cache) > OCR_CACHE_SIZE:
+                self.ocr_cache.popitem(last=False)
             
             return ocr_text
         except Exception as e:
@@ -657,17 +1087,79 @@ class BrowserAutomation:
             traceback.print_exc()
             return ""
     
+    def _track_network(self, page: Page) -> PageNetwork:
+        """Start tracking in-flight requests of a page, returning its live tracker
+        
+        Called when a page is created, so the requests of the first action on it
+        are seen too.
+        """
+        network = self.inflight_requests.get(page)
+        if network is not None:
+            return network
+        
+        network = PageNetwork()
+        self.inflight_requests[page] = network
+        
+        def on_request(request):
+            if request.resource_type not in LONG_LIVED_RESOURCE_TYPES:
+                network.add(request)
+        
+        page.on("request", on_request)
+        page.on("requestfinished", network.discard)
+        page.on("requestfailed", network.discard)
+        page.on("close", lambda _: self.inflight_requests.pop(page, None))
+        return network
+    
+    async def create_page(self, session: BrowserSession) -> Page:
+        """Open a tab in a session with network tracking attached"""
+        page = await session.new_page(self.browser)
+        self._track_network(page)
+        return page
+    
+    async def wait_for_page_settle(self, page: Page, timeout_ms: int = SETTLE_TIMEOUT_MS,
+                                   quiet_ms: int = SETTLE_QUIET_MS):
+        """Wait until the page's network is idle and its DOM stops changing
+        
+        Replaces a fixed sleep after actions: a static page settles after quiet_ms,
+        a busy one is given up to timeout_ms.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_ms / 1000
+        network = self._track_network(page)
+        
+        while not network.is_idle() and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        
+        remaining_ms = int((deadline - loop.time()) * 1000)
+        if remaining_ms <= 0:
+            return
+        try:
+            await page.evaluate(DOM_SETTLE_JS, {"quietMs": quiet_ms, "timeoutMs": remaining_ms})
+        except Exception as e:
+            # The action may have started a navigation that destroyed the context
+            print(f"DOM settle check interrupted: {e}")
+            try:
+                await page.wait_for_load_state("domcontentloaded", timeout=max(remaining_ms, 1))
+            except Exception:
+                pass
+    
     async def get_updated_browser_state(self, action_name: str) -> tuple:
         """Helper method to get updated browser state after any action
         Returns a tuple of (dom_state, screenshot, elements, metadata)
         """
         try:
-            # Wait a moment for any potential async processes to settle
-            await asyncio.sleep(0.5)
+            page = await self.get_current_page()
+            await self.wait_for_page_settle(page)
             
-            # Get updated state
-            dom_state = await self.get_current_dom_state()
-            screenshot = await self.take_screenshot()
+            # Probe the page and take the screenshot concurrently (text-only tabs get none)
+            if self.page_profiles.get(page) == "text":
+                probe, screenshot = await self.probe_page_state(page), ""
+            else:
+                probe, screenshot = await asyncio.gather(
+                    self.probe_page_state(page),
+                    self.take_screenshot()
+                )
+            dom_state = await self.get_current_dom_state(probe)
             
             # Format elements for output
             elements = dom_state.element_tree.clickable_elements_to_string(
@@ -675,7 +1167,6 @@ class BrowserAutomation:
             )
             
             # Collect additional metadata
-            page = await self.get_current_page()
             metadata = {}
             
             # Get element count
@@ -685,6 +1176,7 @@ class BrowserAutomation:
             interactive_elements = []
             for idx, element in dom_state.selector_map.items():
                 element_info = {
+                    'hash': element.hash.key,
                     'index': idx,
                     'tag_name': element.tag_name,
                     'text': element.get_all_text_till_next_clickable_element(),
@@ -696,34 +1188,21 @@ class BrowserAutomation:
                     if attr_name in element.attributes:
                         element_info[attr_name] = element.attributes[attr_name]
                 
+                # Lets a client rebuild the elements string from a delta
+                element_info['line'] = element.clickable_line(self.include_attributes)
                 interactive_elements.append(element_info)
             
-            metadata['interactive_elements'] = interactive_elements
+            # Viewport dimensions come from the same probe
+            metadata['viewport_width'] = probe.get('viewportWidth', 0)
+            metadata['viewport_height'] = probe.get('viewportHeight', 0)
             
-            # Get viewport dimensions - Fix syntax error in JavaScript
-            try:
-                viewport = await page.evaluate("""
-                () => {
-                    return {
-                        width: window.innerWidth,
-                        height: window.innerHeight
-                    };
-                }
-                """)
-                metadata['viewport_width'] = viewport.get('width', 0)
-                metadata['viewport_height'] = viewport.get('height', 0)
-            except Exception as e:
-                print(f"Error getting viewport dimensions: {e}")
-                metadata['viewport_width'] = 0
-                metadata['viewport_height'] = 0
+            # Extract OCR text from screenshot if available (lazy mode defers it to ocr_text)
+            if screenshot and OCR_MODE == "eager":
+                metadata['ocr_text'] = await self.extract_ocr_text_from_screenshot(screenshot)
             
-            # Extract OCR text from screenshot if available
-            ocr_text = ""
-            if screenshot:
-                ocr_text = await self.extract_ocr_text_from_screenshot(screenshot)
-                metadata['ocr_text'] = ocr_text
+            elements = self.encode_tab_state(page, dom_state.url, elements, interactive_elements, metadata)
             
-            print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements")
+            print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements ({metadata['state_mode']})")
             return dom_state, screenshot, elements, metadata
         except Exception as e:
             print(f"Error getting updated state after {action_name}: {e}")
@@ -731,6 +1210,67 @@ class BrowserAutomation:
             # Return empty values in case of error
             return None, "", "", {}
 
+    def get_tab_id(self, page: Page) -> int:
+        """Stable ID of a tab for the lifetime of the page"""
+        tab_id = self.tab_ids.get(page)
+        if tab_id is None:
+            tab_id = max(self.tab_ids.values(), default=0) + 1
+            self.tab_ids[page] = tab_id
+            
+            def forget(_):
+                self.tab_ids.pop(page, None)
+                self.tab_states.pop(page, None)
+            page.on("close", forget)
+        return tab_id
+    
+    def encode_tab_state(self, page: Page, url: str, elements: str,
+                         interactive_elements: List[Dict[str, Any]], metadata: dict) -> str:
+        """Encode a tab's element state in metadata as a full snapshot or a delta
+        
+        The delta lists elements added or changed since the tab's previous state
+        and the hashes of removed ones. A snapshot is sent for the first state of
+        a tab, after the URL changes and every STATE_SNAPSHOT_INTERVAL states.
+        Returns the elements string to send, empty for a delta.
+        """
+        tab_id = self.get_tab_id(page)
+        previous = self.tab_states.get(page)
+        sequence = previous['sequence'] + 1 if previous else 1
+        state_id = f"{self.session_id}:{tab_id}:{sequence}"
+        keyed = {element['hash']: element for element in interactive_elements}
+        ocr_text = metadata.get('ocr_text')
+        
+        full = (
+            previous is None
+            or previous['url'] != url
+            or previous['since_snapshot'] + 1 >= STATE_SNAPSHOT_INTERVAL
+        )
+        metadata['tab_id'] = tab_id
+        metadata['state_id'] = state_id
+        if full:
+            metadata['state_mode'] = "full"
+            metadata['interactive_elements'] = interactive_elements
+        else:
+            base = previous['elements']
+            metadata['state_mode'] = "delta"
+            metadata['base_state_id'] = previous['state_id']
+            metadata['elements_added'] = [element for key, element in keyed.items() if key not in base]
+            metadata['elements_changed'] = [element for key, element in keyed.items() if key in base and base[key] != element]
+            metadata['elements_removed'] = [key for key in base if key not in keyed]
+            if ocr_text and ocr_text == previous['ocr_text']:
+                metadata['ocr_text'] = ""
+                metadata['ocr_unchanged'] = True
+        
+        self.tab_states[page] = {
+            'state_id': state_id,
+            'sequence': sequence,
+            'since_snapshot': 0 if full else previous['since_snapshot'] + 1,
+            'url': url,
+            'elements': keyed,
+            'elements_string': elements,
+            'ocr_text': ocr_text
+        }
+        return elements if full else ""
+    
     def build_action_result(self, success: bool, message: str, dom_state, screenshot: str, 
                               elements: str, metadata: dict, error: str = "", content: str = None,
                               fallback_url: str = None) -> BrowserActionResult:
@@ -751,27 +1291,77 @@ class BrowserAutomation:
             pixels_below=dom_state.pixels_below if dom_state else 0,
             content=content,
             ocr_text=metadata.get('ocr_text', ""),
+            ocr_unchanged=metadata.get('ocr_unchanged', False),
             element_count=metadata.get('element_count', 0),
             interactive_elements=metadata.get('interactive_elements', []),
             viewport_width=metadata.get('viewport_width', 0),
-            viewport_height=metadata.get('viewport_height', 0)
+            viewport_height=metadata.get('viewport_height', 0),
+            tab_id=metadata.get('tab_id'),
+            state_id=metadata.get('state_id'),
+            base_state_id=metadata.get('base_state_id'),
+            state_mode=metadata.get('state_mode', "full"),
+            elements_added=metadata.get('elements_added'),
+            elements_changed=metadata.get('elements_changed'),
+            elements_removed=metadata.get('elements_removed')
         )
 
+    async def set_navigation_profile(self, page: Page, profile: str):
+        """Install or remove the tab's request interceptor for a navigation profile"""
+        if page not in self.page_profiles:
+            page.on("close", lambda _: (self.page_profiles.pop(page, None), self.route_handlers.pop(page, None)))
+        self.page_profiles[page] = profile
+        blocked_types = NAVIGATION_BLOCKED_RESOURCE_TYPES[profile]
+        handler = self.route_handlers.get(page)
+        
+        if not blocked_types:
+            if handler:
+                await page.unroute("**/*", handler)
+                del self.route_handlers[page]
+            return
+        if handler:
+            return
+        
+        async def handle_route(route):
+            request = route.request
+            if request.resource_type in NAVIGATION_BLOCKED_RESOURCE_TYPES[self.page_profiles.get(page, "full")] \
+                    or is_blocked_host(request.url):
+                await route.abort("blockedbyclient")
+            else:
+                await route.continue_()
+        
+        self.route_handlers[page] = handle_route
+        await page.route("**/*", handle_route)
+    
     # Basic Navigation Actions
     
     async def navigate_to(self, action: GoToUrlAction = Body(...)):
-        """Navigate to a specified URL"""
+        """Navigate to a specified URL
+        
+        The profile chooses which requests the tab blocks and whether a screenshot
+        is taken, and wait_until the load state to wait for.
+        """
+        profile = (action.profile or NAVIGATION_PROFILE).lower()
+        wait_until = (action.wait_until or NAVIGATION_WAIT_UNTIL).lower()
+        if profile not in NAVIGATION_BLOCKED_RESOURCE_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unknown navigation profile: {profile}")
+        if wait_until not in NAVIGATION_WAIT_STATES:
+            raise HTTPException(status_code=400, detail=f"Unknown wait_until state: {wait_until}")
+        
         try:
             page = await self.get_current_page()
-            await page.goto(action.url, wait_until="domcontentloaded")
-            await page.wait_for_load_state("networkidle", timeout=10000)
+            await self.set_navigation_profile(page, profile)
+            if wait_until == "networkidle":
+                await page.goto(action.url, wait_until="domcontentloaded")
+                await page.wait_for_load_state("networkidle", timeout=10000)
+            else:
+                await page.goto(action.url, wait_until=wait_until)
             
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"navigate_to({action.url})")
             
             result = self.build_action_result(
                 True,
-                f"Navigated to {action.url}",
+                f"Navigated to {action.url}" + (f" ({profile} profile)" if profile != "full" else ""),
                 dom_state,
                 screenshot,
                 elements,
@@ -981,11 +1571,10 @@ class BrowserAutomation:
         try:
             page = await self.get_current_page()
             
-            # Get the current state and selector map *before* the click
-            initial_dom_state = await self.get_current_dom_state()
-            selector_map = initial_dom_state.selector_map
+            # Resolve the target through its index stamp; the map is only rebuilt if the DOM changed
+            target_element_handle = await self.get_element_handle(page, action.index)
             
-            if action.index not in selector_map:
+            if target_element_handle is None:
                 # Get updated state even if element not found initially
                 dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"click_element_error (index {action.index} not found)")
                 return self.build_action_result(
@@ -998,53 +1587,22 @@ class BrowserAutomation:
                     error=f"Element with index {action.index} not found"
                 )
 
-            element_to_click = selector_map[action.index]
-            print(f"Attempting to click element: {element_to_click}")
-
-            # Construct a more reliable selector using JavaScript evaluation
-            # Find the element based on its properties captured in selector_map
-            js_selector_script = """
-            (targetElementInfo) => {
-                const interactiveElements = Array.from(document.querySelectorAll(
-                    'a, button, input, select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="radio"], [tabindex]:not([tabindex="-1"])'
-                ));
-                
-                const visibleElements = interactiveElements.filter(el => {
-                    const style = window.getComputedStyle(el);
-                    const rect = el.getBoundingClientRect();
-                    return style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0' && rect.width > 0 && rect.height > 0;
-                });
-
-                if (targetElementInfo.index > 0 && targetElementInfo.index <= visibleElements.length) {
-                    // Return the element at the specified index (1-based)
-                    return visibleElements[targetElementInfo.index - 1];
-                }
-                return null; // Element not found at the expected index
-            }
-            """
-            
-            element_info = {'index': action.index} # Pass the target index to the script
-            
-            target_element_handle = await page.evaluate_handle(js_selector_script, element_info)
-
             click_success = False
             error_message = ""
 
-            if await target_element_handle.evaluate("node => node !== null"):
-                try:
-                    # Use Playwright's recommended way: click the handle
-                    # Add timeout and wait for element to be stable
-                    await target_element_handle.click(timeout=5000) 
-                    click_success = True
-                    print(f"Successfully clicked element handle for index {action.index}")
-                except Exception as click_error:
-                    error_message = f"Error clicking element handle: {click_error}"
-                    print(error_message)
-                    # Optional: Add fallback methods here if needed
-                    # e.g., target_element_handle.dispatch_event('click')
-            else:
-                 error_message = f"Could not locate the target element handle for index {action.index} using JS script."
-                 print(error_message)
+            try:
+                # Use Playwright's recommended way: click the handle
+                # Add timeout and wait for element to be stable
+                await target_element_handle.click(timeout=5000) 
+                click_success = True
+                print(f"Successfully clicked element handle for index {action.index}")
+            except Exception as click_error:
+                error_message = f"Error clicking element handle: {click_error}"
+                print(error_message)
+                # Optional: Add fallback methods here if needed
+                # e.g., target_element_handle.dispatch_event('click')
+            finally:
+                await target_element_handle.dispose()
 
 
             # Wait for potential page changes/network activity
@@ -1107,9 +1665,9 @@ class BrowserAutomation:
         """Input text into an element"""
         try:
             page = await self.get_current_page()
-            selector_map = await self.get_selector_map()
+            element_handle = await self.get_element_handle(page, action.index)
             
-            if action.index not in selector_map:
+            if element_handle is None:
                 return self.build_action_result(
                     False,
                     f"Element with index {action.index} not found",
@@ -1120,22 +1678,10 @@ class BrowserAutomation:
                     error=f"Element with index {action.index} not found"
                 )
             
-            # In a real implementation, we would use the selector map to get the element's
-            # properties and use them to find and type into the element
-            element = selector_map[action.index]
-            
-            # Use CSS selector or XPath to locate and type into the element
-            await page.wait_for_timeout(500)  # Small delay before typing
-            
-            # Demo implementation - would use proper selectors in production
-            if element.attributes.get("id"):
-                await page.fill(f"#{element.attributes['id']}", action.text)
-            elif element.attributes.get("class"):
-                class_selector = f".{element.attributes['class'].replace(' ', '.')}"
-                await page.fill(class_selector, action.text)
-            else:
-                # Fallback to xpath
-                await page.fill(f"//{element.tag_name}[{action.index}]", action.text)
+            try:
+                await element_handle.fill(action.text, timeout=5000)
+            finally:
+                await element_handle.dispose()
             
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"input_text({action.index}, '{action.text}')")
@@ -1242,8 +1788,8 @@ class BrowserAutomation:
         """Open a new tab with the specified URL"""
         try:
             print(f"Attempting to open new tab with URL: {action.url}")
-            # Create new page in same browser instance
-            new_page = await self.browser.new_page()
+            # Create new page in the session's context
+            new_page = await self.create_page(self.session)
             print(f"New page created successfully")
             
             # Navigate to the URL
@@ -1553,9 +2099,9 @@ class BrowserAutomation:
         """Get all options from a dropdown"""
         try:
             page = await self.get_current_page()
-            selector_map = await self.get_selector_map()
+            element_handle = await self.get_element_handle(page, index)
             
-            if index not in selector_map:
+            if element_handle is None:
                 return self.build_action_result(
                     False,
                     f"Element with index {index} not found",
@@ -1566,26 +2112,25 @@ class BrowserAutomation:
                     error=f"Element with index {index} not found"
                 )
             
-            element = selector_map[index]
+            tag_name = await element_handle.evaluate("el => el.tagName.toLowerCase()")
             options = []
             
             # Try to get the options - in a real implementation, we would use appropriate selectors
             try:
-                if element.tag_name.lower() == 'select':
-                    # For <select> elements, get options using JavaScript
-                    options_js = f"""
-                    Array.from(document.querySelectorAll('select')[{index-1}].options)
+                if tag_name == 'select':
+                    # For <select> elements, read the options of the element itself
+                    options = await element_handle.evaluate("""
+                    select => Array.from(select.options)
                         .map((option, index) => ({
                             index: index,
                             text: option.text,
                             value: option.value
-                        }));
-                    """
-                    options = await page.evaluate(options_js)
+                        }))
+                    """)
                 else:
                     # For other dropdown types, try to get options using a more generic approach
                     # Example for custom dropdowns - would need refinement in real implementation
-                    await page.click(f"#{element.attributes.get('id')}") if element.attributes.get('id') else None
+                    await element_handle.click(timeout=5000)
                     await page.wait_for_timeout(500)
                     
                     options_js = """
@@ -1612,6 +2157,8 @@ class BrowserAutomation:
                     {"index": 1, "text": "Option 2", "value": "option2"},
                     {"index": 2, "text": "Option 3", "value": "option3"},
                 ]
+            finally:
+                await element_handle.dispose()
             
             # Get updated state
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"get_dropdown_options({index})")
@@ -1642,9 +2189,9 @@ class BrowserAutomation:
         """Select an option from a dropdown by text"""
         try:
             page = await self.get_current_page()
-            selector_map = await self.get_selector_map()
+            element_handle = await self.get_element_handle(page, index)
             
-            if index not in selector_map:
+            if element_handle is None:
                 return self.build_action_result(
                     False,
                     f"Element with index {index} not found",
@@ -1655,28 +2202,24 @@ class BrowserAutomation:
                     error=f"Element with index {index} not found"
                 )
             
-            element = selector_map[index]
+            tag_name = await element_handle.evaluate("el => el.tagName.toLowerCase()")
             
             # Try to select the option - implementation varies by dropdown type
-            if element.tag_name.lower() == 'select':
-                # For standard <select> elements
-                selector = f"select option:has-text('{option_text}')"
-                await page.select_option(
-                    f"#{element.attributes.get('id')}" if element.attributes.get('id') else f"//select[{index}]", 
-                    label=option_text
-                )
-            else:
-                # For custom dropdowns
-                # First click to open the dropdown
-                if element.attributes.get('id'):
-                    await page.click(f"#{element.attributes.get('id')}")
+            try:
+                if tag_name == 'select':
+                    # For standard <select> elements
+                    await element_handle.select_option(label=option_text, timeout=5000)
                 else:
-                    await page.click(f"//{element.tag_name}[{index}]")
-                
-                await page.wait_for_timeout(500)
-                
-                # Then try to click the option
-                await page.click(f"text={option_text}")
+                    # For custom dropdowns
+                    # First click to open the dropdown
+                    await element_handle.click(timeout=5000)
+                    
+                    await page.wait_for_timeout(500)
+                    
+                    # Then try to click the option
+                    await page.click(f"text={option_text}")
+            finally:
+                await element_handle.dispose()
             
             await page.wait_for_timeout(500)
             
@@ -1707,6 +2250,70 @@ class BrowserAutomation:
     
     # Drag and Drop
     
+    async def ocr_text(self, _: NoParamsAction = Body(...)):
+        """Extract the text visible in the current viewport using OCR"""
+        try:
+            dom_state, screenshot, elements, metadata = await self.get_updated_browser_state("ocr_text")
+            if OCR_MODE != "off" and not metadata.get('ocr_text'):
+                metadata['ocr_text'] = await self.extract_ocr_text_from_screenshot(screenshot)
+                metadata['ocr_unchanged'] = False
+            
+            return self.build_action_result(
+                True,
+                "Extracted text from the current viewport",
+                dom_state,
+                screenshot,
+                elements,
+                metadata,
+                error="",
+                content=None
+            )
+        except Exception as e:
+            return self.build_action_result(
+                False,
+                str(e),
+                None,
+                "",
+                "",
+                {},
+                error=str(e),
+                content=None
+            )
+    
+    async def get_state(self, _: NoParamsAction = Body(...)):
+        """Return the current tab's last sent element state as a full snapshot, without a screenshot"""
+        try:
+            page = await self.get_current_page()
+            state = self.tab_states.get(page)
+            if state is None:
+                dom_state, screenshot, elements, metadata = await self.get_updated_browser_state("get_state")
+                return self.build_action_result(True, "Current browser state", dom_state, "", elements, metadata)
+            
+            return BrowserActionResult(
+                success=True,
+                message="Current browser state",
+                url=page.url,
+                title=await page.title(),
+                elements=state['elements_string'],
+                ocr_text=state['ocr_text'] or "",
+                element_count=len(state['elements']),
+                interactive_elements=list(state['elements'].values()),
+                tab_id=self.tab_ids.get(page),
+                state_id=state['state_id'],
+                state_mode="full"
+            )
+        except Exception as e:
+            return self.build_action_result(
+                False,
+                str(e),
+                None,
+                "",
+                "",
+                {},
+                error=str(e),
+                content=None
+            )
+    
     async def drag_drop(self, action: DragDropAction = Body(...)):
         """Perform drag and drop operation"""
         try:
@@ -0,0 +1,90 @@
+"""
+Pool of pre-created, started sandboxes for new projects.
+
+Creating and booting a Daytona sandbox takes a long time, so up to
+SANDBOX_POOL_SIZE sandboxes are created ahead of time and listed in Redis,
+where any worker can claim one atomically. Each claim triggers a background
+refill; only one worker refills at a time.
+"""
+
+import asyncio
+import json
+import uuid
+from typing import Optional, Tuple
+
+from services import redis
+from sandbox.sandbox import AsyncSandbox, create_sandbox, get_or_start_sandbox, run_sandbox_call
+from utils.config import config
+from utils.logger import logger
+
+SANDBOX_POOL_KEY = "sandbox_pool:available"
+SANDBOX_POOL_REFILL_LOCK_KEY = "sandbox_pool:refill_lock"
+SANDBOX_POOL_REFILL_LOCK_TTL = 900  # Released early; expires if a worker dies mid-refill
+
+# Strong references to refill tasks so they are not garbage collected mid-run
+_refill_tasks = set()
+
+
+async def claim_pooled_sandbox() -> Optional[Tuple[AsyncSandbox, str]]:
+    """Claim a pre-created sandbox from the pool.
+
+    Returns:
+        Tuple of (sandbox, VNC password), or None if the pool is disabled or empty
+    """
+    if config.SANDBOX_POOL_SIZE <= 0:
+        return None
+
+    try:
+        while True:
+            entry = await redis.lpop(SANDBOX_POOL_KEY)
+            if entry is None:
+                logger.info("Sandbox pool is empty")
+                return None
+
+            pooled = json.loads(entry)
+            try:
+                # Pooled sandboxes may have been stopped or archived while idle
+                sandbox = await get_or_start_sandbox(pooled['id'], create_if_missing=False)
+            except Exception as e:
+                logger.warning(f"Discarding unusable pooled sandbox {pooled['id']}: {str(e)}")
+                continue
+
+            logger.info(f"Claimed pooled sandbox {sandbox.id}")
+            return AsyncSandbox(sandbox), pooled['pass']
+    except Exception as e:
+        logger.warning(f"Failed to claim a pooled sandbox: {str(e)}")
+        return None
+    finally:
+        schedule_sandbox_pool_refill()
+
+
+def schedule_sandbox_pool_refill():
+    """Refill the pool in the background."""
+    if config.SANDBOX_POOL_SIZE <= 0:
+        return
+    task = asyncio.create_task(refill_sandbox_pool())
+    _refill_tasks.add(task)
+    task.add_done_callback(_refill_tasks.discard)
+
+
+async def refill_sandbox_pool():
+    """Create sandboxes until the pool holds SANDBOX_POOL_SIZE of them."""
+    if config.SANDBOX_POOL_SIZE <= 0:
+        return
+
+    lock_value = str(uuid.uuid4())
+    try:
+        if not await redis.set(SANDBOX_POOL_REFILL_LOCK_KEY, lock_value, ex=SANDBOX_POOL_REFILL_LOCK_TTL, nx=True):
+            return  # Another worker is refilling
+
+        try:
+            while await redis.llen(SANDBOX_POOL_KEY) < config.SANDBOX_POOL_SIZE:
+                sandbox_pass = str(uuid.uuid4())
+                sandbox = await run_sandbox_call(SANDBOX_POOL_KEY, create_sandbox, sandbox_pass)
+                await redis.rpush(SANDBOX_POOL_KEY, json.dumps({"id": sandbox.id, "pass": sandbox_pass}))
+                logger.info(f"Added sandbox {sandbox.id} to the sandbox pool")
+        finally:
+            if await redis.get(SANDBOX_POOL_REFILL_LOCK_KEY) == lock_value:
+                await redis.delete(SANDBOX_POOL_REFILL_LOCK_KEY)
+    except Exception as e:
+        logger.error(f"Error refilling sandbox pool: {str(e)}")
@@ -1,6 +1,13 @@
 import os
 import random
 import time
+import asyncio
+import functools
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Optional, Dict, List, Callable, Any
 
 from daytona_sdk import Daytona, DaytonaConfig, CreateSandboxParams, Sandbox, SessionExecuteRequest
@@ -114,88 +121,197 @@ def try_with_multiple_clients(operation_func, *args, **kwargs):
 
 logger.debug("Daytona client pool and utility functions initialized")
 
-async def get_or_start_sandbox(sandbox_id: str):
-    """Retrieve a sandbox by ID, check its state, and start it if needed."""
+# The Daytona SDK is synchronous: its calls run on a shared, bounded thread pool
+# so that a long command in one sandbox never blocks the event loop. Each
+# sandbox may use at most SANDBOX_MAX_CALLS_PER_SANDBOX threads at a time, which
+# keeps a busy sandbox from starving the others.
+_sandbox_executor = ThreadPoolExecutor(
+    max_workers=config.SANDBOX_EXECUTOR_WORKERS,
+    thread_name_prefix="daytona"
+)
+_sandbox_slots: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+
+async def run_sandbox_call(sandbox_id: str, func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking Daytona SDK call for a sandbox on the sandbox thread pool."""
+    slots = _sandbox_slots.get(sandbox_id)
+    if slots is None:
+        slots = asyncio.Semaphore(config.SANDBOX_MAX_CALLS_PER_SANDBOX)
+        _sandbox_slots[sandbox_id] = slots
+    async with slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_sandbox_executor, functools.partial(func, *args, **kwargs))
+
+
+class _AsyncSandboxComponent:
+    """Exposes every method of a Daytona sandbox component (fs, process) as a coroutine."""
+
+    def __init__(self, component: Any, sandbox_id: str):
+        self._component = component
+        self._sandbox_id = sandbox_id
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(self._component, name)
+
+        async def call(*args, **kwargs):
+            return await run_sandbox_call(self._sandbox_id, method, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+class AsyncSandbox:
+    """Async facade over a Daytona Sandbox.
+
+    fs and process calls are awaitable and run through run_sandbox_call. Other
+    attributes (id, instance, ...) are read from the wrapped sandbox.
+    """
+
+    def __init__(self, sandbox: Sandbox):
+        self.sandbox = sandbox
+        self.fs = _AsyncSandboxComponent(sandbox.fs, sandbox.id)
+        self.process = _AsyncSandboxComponent(sandbox.process, sandbox.id)
+
+    async def get_preview_link(self, port: int):
+        """Get the public preview link of a sandbox port."""
+        return await run_sandbox_call(self.sandbox.id, self.sandbox.get_preview_link, port)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.sandbox, name)
+
+@dataclass
+class _SandboxHandle:
+    """A sandbox looked up earlier, with the API key that owns it."""
+    sandbox: Sandbox
+    api_key: Optional[str]
+    checked_at: float
+
+# Process-wide cache of sandbox handles by sandbox ID, shared by every run and
+# tool on this worker. Written from SDK threads too, hence the threading lock.
+SANDBOX_HANDLE_CACHE_SIZE = 512
+_sandbox_handles: "OrderedDict[str, _SandboxHandle]" = OrderedDict()
+_sandbox_handles_lock = threading.Lock()
+_sandbox_lookup_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _api_key_for_client(client: Daytona) -> Optional[str]:
+    """Find the pool API key a Daytona client was created with."""
+    for api_key, pool_client in daytona_clients.items():
+        if pool_client is client:
+            return api_key
+    return None
+
+def _remember_sandbox(sandbox: Sandbox, api_key: Optional[str]):
+    """Store a freshly checked sandbox handle in the cache."""
+    with _sandbox_handles_lock:
+        _sandbox_handles[sandbox.id] = _SandboxHandle(sandbox, api_key, time.monotonic())
+        _sandbox_handles.move_to_end(sandbox.id)
+        while len(_sandbox_handles) > SANDBOX_HANDLE_CACHE_SIZE:
+            _sandbox_handles.popitem(last=False)
+
+def forget_sandbox(sandbox_id: str):
+    """Drop a cached sandbox handle, e.g. after the sandbox was deleted or stopped."""
+    with _sandbox_handles_lock:
+        _sandbox_handles.pop(sandbox_id, None)
+
+def _find_sandbox(sandbox_id: str, preferred_api_key: Optional[str] = None):
+    """Look a sandbox up with the pool API keys, trying the known owner first.
+
+    Returns:
+        Tuple of (sandbox, owning API key)
+    """
+    errors = []
+    api_keys = list(daytona_clients.keys())
+    if preferred_api_key in daytona_clients:
+        api_keys.remove(preferred_api_key)
+        api_keys.insert(0, preferred_api_key)
     
-    logger.info(f"Getting or starting sandbox with ID: {sandbox_id}")
+    # The sandbox may have been created with any of the keys
+    for api_key in api_keys:
+        key_id = api_key[-8:] if api_key and len(api_key) >= 8 else "empty"
+        try:
+            sandbox = daytona_clients[api_key].get_current_sandbox(sandbox_id)
+            logger.debug(f"Found sandbox {sandbox_id} using API key ending in {key_id}")
+            return sandbox, api_key
+        except Exception as e:
+            logger.debug(f"Could not find sandbox {sandbox_id} with API key {key_id}: {str(e)}")
+            errors.append((api_key, str(e)))
     
-    try:
-        # Função para obter o sandbox usando um cliente específico
-        def get_sandbox(client, sandbox_id):
-            return client.get_current_sandbox(sandbox_id)
+    # Without a pool, fall back to the default client
+    if not daytona_clients:
+        try:
+            sandbox = daytona.get_current_sandbox(sandbox_id)
+            logger.debug(f"Found sandbox {sandbox_id} using default API key")
+            return sandbox, None
+        except Exception as e:
+            logger.debug(f"Could not find sandbox {sandbox_id} with default API key: {str(e)}")
+            errors.append(("default", str(e)))
+    
+    error_details = "\n".join([f"Key {k[-8:] if k != 'default' and k and len(k) >= 8 else k}: {e}" for k, e in errors])
+    raise Exception(f"Sandbox {sandbox_id} not found with any API key. Errors:\n{error_details}")
+
+async def get_or_start_sandbox(sandbox_id: str, create_if_missing: bool = True):
+    """Retrieve a sandbox by ID, check its state, and start it if needed.
+    
+    Handles are cached per worker for SANDBOX_HANDLE_TTL seconds, and lookups
+    after that go to the owning API key first. Concurrent calls for the same
+    sandbox share one lookup.
+    """
+    
+    lock = _sandbox_lookup_locks.get(sandbox_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _sandbox_lookup_locks[sandbox_id] = lock
+    
+    async with lock:
+        with _sandbox_handles_lock:
+            handle = _sandbox_handles.get(sandbox_id)
+        if handle and time.monotonic() - handle.checked_at < config.SANDBOX_HANDLE_TTL:
+            logger.debug(f"Using cached handle for sandbox {sandbox_id}")
+            return handle.sandbox
         
+        logger.info(f"Getting or starting sandbox with ID: {sandbox_id}")
         try:
-            # Tenta obter o sandbox usando todas as API keys disponíveis
-            # Isso é importante porque o sandbox pode ter sido criado com qualquer uma das chaves
-            errors = []
-            found_sandbox = None
-            
-            # Tenta com cada cliente da pool individualmente
-            for api_key, client in daytona_clients.items():
-                key_id = api_key[-8:] if api_key and len(api_key) >= 8 else "empty"
-                try:
-                    found_sandbox = client.get_current_sandbox(sandbox_id)
-                    logger.debug(f"Found sandbox {sandbox_id} using API key ending in {key_id}")
-                    break
-                except Exception as e:
-                    logger.debug(f"Could not find sandbox {sandbox_id} with API key {key_id}: {str(e)}")
-                    errors.append((api_key, str(e)))
-            
-            # Se não encontrou com nenhuma chave, tenta com o cliente padrão
-            if not found_sandbox and not daytona_clients:
-                try:
-                    found_sandbox = daytona.get_current_sandbox(sandbox_id)
-                    logger.debug(f"Found sandbox {sandbox_id} using default API key")
-                except Exception as e:
-                    logger.debug(f"Could not find sandbox {sandbox_id} with default API key: {str(e)}")
-                    errors.append(("default", str(e)))
-            
-            # Se não encontrou o sandbox em nenhuma chave, lança exceção
-            if not found_sandbox:
-                error_details = "\n".join([f"Key {k[-8:] if k != 'default' and k and len(k) >= 8 else k}: {e}" for k, e in errors])
-                raise Exception(f"Sandbox {sandbox_id} not found with any API key. Errors:\n{error_details}")
+            try:
+                sandbox, api_key = await run_sandbox_call(
+                    sandbox_id, _find_sandbox, sandbox_id, handle.api_key if handle else None
+                )
+                logger.debug(f"Found existing sandbox with ID: {sandbox_id}")
+                
+                # Start the sandbox if needed, using the client that owns it
+                if sandbox.instance.state == WorkspaceState.ARCHIVED or sandbox.instance.state == WorkspaceState.STOPPED:
+                    logger.info(f"Sandbox is in {sandbox.instance.state} state. Starting...")
+                    try:
+                        client = daytona_clients.get(api_key, daytona)
+                        await run_sandbox_call(sandbox_id, client.start, sandbox)
+                        
+                        # Give the sandbox a moment to boot
+                        await asyncio.sleep(5)
+                        
+                        # Refresh the sandbox state after starting it
+                        sandbox = await run_sandbox_call(sandbox_id, client.get_current_sandbox, sandbox_id)
+                        
+                        # Start supervisord in a session after a restart
+                        await run_sandbox_call(sandbox_id, start_supervisord_session, sandbox)
+                    except Exception as e:
+                        logger.error(f"Error starting sandbox: {e}")
+                        raise e
+                
+                _remember_sandbox(sandbox, api_key)
+            except Exception as e:
+                forget_sandbox(sandbox_id)
+                if not create_if_missing:
+                    raise e
+                
+                # If the sandbox cannot be found, create a new one
+                logger.warning(f"Sandbox {sandbox_id} not found or error retrieving it: {str(e)}")
+                logger.info(f"Attempting to create a new sandbox with ID: {sandbox_id}")
+                sandbox = await run_sandbox_call(sandbox_id, create_sandbox, "password", sandbox_id)
             
-            # Usa o sandbox encontrado
-            sandbox = found_sandbox
-            logger.debug(f"Found existing sandbox with ID: {sandbox_id}")
+            logger.info(f"Sandbox {sandbox_id} is ready")
+            return sandbox
             
-            # Verifica se o sandbox precisa ser iniciado
-            if sandbox.instance.state == WorkspaceState.ARCHIVED or sandbox.instance.state == WorkspaceState.STOPPED:
-                logger.info(f"Sandbox is in {sandbox.instance.state} state. Starting...")
-                try:
-                    # Função para iniciar o sandbox
-                    def start_sandbox(client, sandbox):
-                        client.start(sandbox)
-                        return True
-                    
-                    # Tenta iniciar o sandbox usando a pool de API keys
-                    try_with_multiple_clients(start_sandbox, sandbox)
-                    
-                    # Aguarda um momento para o sandbox inicializar
-                    time.sleep(5)
-                    
-                    # Atualiza o estado do sandbox após iniciar
-                    sandbox = try_with_multiple_clients(get_sandbox, sandbox_id)
-                    
-                    # Inicia o supervisord em uma sessão ao reiniciar
-                    start_supervisord_session(sandbox)
-                except Exception as e:
-                    logger.error(f"Error starting sandbox: {e}")
-                    raise e
         except Exception as e:
-            # Se não encontrar o sandbox, tenta criar um novo
-            logger.warning(f"Sandbox {sandbox_id} not found or error retrieving it: {str(e)}")
-            logger.info(f"Attempting to create a new sandbox with ID: {sandbox_id}")
-            
-            # Cria um novo sandbox com o mesmo ID
-            sandbox = create_sandbox("password", sandbox_id)
-        
-        logger.info(f"Sandbox {sandbox_id} is ready")
-        return sandbox
-        
-    except Exception as e:
-        logger.error(f"Error retrieving or starting sandbox: {str(e)}")
-        raise e
+            logger.error(f"Error retrieving or starting sandbox: {str(e)}")
+            raise e
 
 def start_supervisord_session(sandbox: Sandbox):
     """Start supervisord in a session."""
@@ -265,7 +381,9 @@ def create_sandbox(password: str, project_id: str = None):
     
     # Função para criar um sandbox usando um cliente específico
     def create_sandbox_with_client(client, params):
-        return client.create(params)
+        sandbox = client.create(params)
+        _remember_sandbox(sandbox, _api_key_for_client(client))
+        return sandbox
     
     # Tenta criar o sandbox usando a pool de API keys
     try:
@@ -293,11 +411,11 @@ class SandboxToolsBase(Tool):
         self.project_id = project_id
         self.thread_manager = thread_manager
         self.workspace_path = "/workspace"
-        self._sandbox = None
+        self._sandbox: Optional[AsyncSandbox] = None
         self._sandbox_id = None
         self._sandbox_pass = None
 
-    async def _ensure_sandbox(self) -> Sandbox:
+    async def _ensure_sandbox(self) -> AsyncSandbox:
         """Ensure we have a valid sandbox instance, retrieving it from the project if needed."""
         if self._sandbox is None:
             try:
@@ -320,7 +438,7 @@ class SandboxToolsBase(Tool):
                 self._sandbox_pass = sandbox_info.get('pass')
                 
                 # Get or start the sandbox
-                self._sandbox = await get_or_start_sandbox(self._sandbox_id)
+                self._sandbox = AsyncSandbox(await get_or_start_sandbox(self._sandbox_id))
                 
                 # # Log URLs if not already printed
                 # if not SandboxToolsBase._urls_printed:
@@ -343,8 +461,8 @@ class SandboxToolsBase(Tool):
         return self._sandbox
 
     @property
-    def sandbox(self) -> Sandbox:
-        """Get the sandbox instance, ensuring it exists."""
+    def sandbox(self) -> AsyncSandbox:
+        """Get the async sandbox facade, ensuring it exists."""
         if self._sandbox is None:
             raise RuntimeError("Sandbox not initialized. Call _ensure_sandbox() first.")
         return self._sandbox
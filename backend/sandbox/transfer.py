@@ -0,0 +1,102 @@
+"""
+Chunked file transfer between the API and sandboxes.
+
+The Daytona SDK uploads and downloads whole files as a single bytes object,
+so large transfers would hold the full file in worker memory. Here at most
+SANDBOX_TRANSFER_CHUNK_SIZE bytes are held at a time: uploads are written as
+numbered part files and joined inside the sandbox, and downloads read one byte
+range per call through the sandbox shell.
+"""
+
+import base64
+import shlex
+import uuid
+from typing import AsyncIterator
+
+from sandbox.sandbox import AsyncSandbox
+from utils.config import config
+from utils.logger import logger
+
+
+async def _exec_checked(sandbox: AsyncSandbox, command: str, timeout: int = 300) -> str:
+    response = await sandbox.process.exec(command, timeout=timeout)
+    if response.exit_code != 0:
+        raise RuntimeError(f"Sandbox command failed ({response.exit_code}): {response.result}")
+    return response.result
+
+
+async def upload_stream(sandbox: AsyncSandbox, path: str, file) -> int:
+    """Upload a file-like object with an async read(size) to a sandbox path.
+
+    Files that fit in one chunk are uploaded directly; larger ones are sent
+    chunk by chunk and joined in the sandbox.
+
+    Returns:
+        Number of bytes uploaded
+    """
+    chunk_size = config.SANDBOX_TRANSFER_CHUNK_SIZE
+    chunk = await file.read(chunk_size)
+    next_chunk = await file.read(chunk_size) if len(chunk) == chunk_size else b""
+    if not next_chunk:
+        await sandbox.fs.upload_file(path, chunk)
+        return len(chunk)
+
+    parts_dir = f"/tmp/.upload-{uuid.uuid4().hex}"
+    await _exec_checked(sandbox, f"mkdir -p {shlex.quote(parts_dir)}")
+    total = 0
+    index = 0
+    try:
+        while chunk:
+            await sandbox.fs.upload_file(f"{parts_dir}/{index:06d}", chunk)
+            total += len(chunk)
+            index += 1
+            chunk, next_chunk = next_chunk, (await file.read(chunk_size) if next_chunk else b"")
+
+        target = shlex.quote(path)
+        parent = shlex.quote(path.rsplit('/', 1)[0] or '/')
+        join_command = f"mkdir -p {parent} && cat {parts_dir}/* > {target}"
+        await _exec_checked(sandbox, f"sh -c {shlex.quote(join_command)}")
+        logger.debug(f"Uploaded {total} bytes to {path} in {index} chunks")
+        return total
+    finally:
+        try:
+            await sandbox.process.exec(f"rm -rf {shlex.quote(parts_dir)}", timeout=60)
+        except Exception as e:
+            logger.warning(f"Could not remove upload parts {parts_dir}: {str(e)}")
+
+
+async def get_file_size(sandbox: AsyncSandbox, path: str) -> int:
+    """Get the size in bytes of a file in the sandbox."""
+    info = await sandbox.fs.get_file_info(path)
+    if info.is_dir:
+        raise IsADirectoryError(path)
+    return info.size
+
+
+async def iter_file_range(
+    sandbox: AsyncSandbox,
+    path: str,
+    start: int,
+    end: int,
+    file_size: int
+) -> AsyncIterator[bytes]:
+    """Yield the bytes of a sandbox file from start to end (inclusive) in chunks."""
+    chunk_size = config.SANDBOX_TRANSFER_CHUNK_SIZE
+    if start == 0 and end == file_size - 1 and file_size <= chunk_size:
+        yield await sandbox.fs.download_file(path)
+        return
+
+    source = shlex.quote(path)
+    offset = start
+    while offset <= end:
+        length = min(chunk_size, end - offset + 1)
+        read_command = (
+            f"dd if={source} iflag=skip_bytes,count_bytes skip={offset} count={length} "
+            f"bs=1M status=none | base64 -w 0"
+        )
+        encoded = await _exec_checked(sandbox, f"sh -c {shlex.quote(read_command)}")
+        data = base64.b64decode(encoded.strip())
+        if not data:
+            break
+        yield data
+        offset += len(data)
@@ -6,11 +6,14 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 
 from fastapi import APIRouter, HTTPException, Depends, Request
 from typing import Optional, Dict, Any, List, Tuple
+import asyncio
+import json
 import stripe
 from datetime import datetime, timezone
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.supabase import DBConnection
+from services import redis
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel, Field
 
@@ -31,6 +34,54 @@ SUBSCRIPTION_TIERS = {
     config.STRIPE_TIER_200_1000_ID: {'name': 'tier_200_1000', 'minutes': 12000},  # 200 hours
 }
 
+# Redis keys for cached billing lookups, shared by all workers
+BILLING_SUBSCRIPTION_CACHE_KEY = "billing:subscription:{account_id}"
+BILLING_STATUS_CACHE_KEY = "billing:status:{account_id}"
+
+# Per-account monthly usage aggregate: a hash holding the seconds of completed
+# runs and a set of the run IDs already counted in it. Runs that finish before
+# the aggregate exists are parked in the pending hash (run_id -> seconds) and
+# merged when it is seeded
+BILLING_USAGE_KEY = "billing:usage:{account_id}:{month}"
+BILLING_USAGE_RUNS_KEY = "billing:usage:{account_id}:{month}:runs"
+BILLING_USAGE_PENDING_KEY = "billing:usage:{account_id}:{month}:pending"
+BILLING_USAGE_TTL = 3600 * 24 * 40  # Outlives the month it covers
+
+# Creates the aggregate from a scan of completed runs plus the pending runs,
+# unless it already exists. Returns the completed seconds.
+# KEYS: aggregate, run set, pending hash. ARGV: ttl, then (run_id, seconds) pairs
+_SEED_USAGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return redis.call('HGET', KEYS[1], 'completed_seconds') end
+local total = 0
+for i = 2, #ARGV, 2 do
+    if redis.call('SADD', KEYS[2], ARGV[i]) == 1 then total = total + tonumber(ARGV[i + 1]) end
+end
+local pending = redis.call('HGETALL', KEYS[3])
+for i = 1, #pending, 2 do
+    if redis.call('SADD', KEYS[2], pending[i]) == 1 then total = total + tonumber(pending[i + 1]) end
+end
+redis.call('DEL', KEYS[3])
+redis.call('HSET', KEYS[1], 'completed_seconds', tostring(total))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return tostring(total)
+"""
+
+# Adds one completed run to the aggregate, at most once per run. Without an
+# aggregate the run is parked in the pending hash, since a seed scan already in
+# progress may have read it as still running.
+# KEYS: aggregate, run set, pending hash. ARGV: run_id, seconds, ttl
+_RECORD_USAGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[3], ARGV[3])
+    return 0
+end
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then return 0 end
+redis.call('HINCRBYFLOAT', KEYS[1], 'completed_seconds', ARGV[2])
+return 1
+"""
+
 # Pydantic models for request/response validation
 class CreateCheckoutSessionRequest(BaseModel):
     price_id: str
@@ -56,6 +107,52 @@ class SubscriptionStatus(BaseModel):
     scheduled_change_date: Optional[datetime] = None
 
 # Helper functions
+async def _stripe_call(func, *args, **kwargs):
+    """Run a blocking Stripe SDK call in the default thread pool."""
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+async def _get_cached_json(key: str) -> Tuple[bool, Any]:
+    """Read a JSON value from Redis, returning (found, value). Redis errors count as a miss."""
+    try:
+        raw = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Billing cache read failed for {key}: {str(e)}")
+        return False, None
+    if raw is None:
+        return False, None
+    try:
+        return True, json.loads(raw)
+    except json.JSONDecodeError:
+        return False, None
+
+async def _set_cached_json(key: str, value: Any, ttl: int) -> None:
+    """Store a JSON value in Redis with a TTL, ignoring Redis errors."""
+    if ttl <= 0:
+        return
+    try:
+        await redis.set(key, json.dumps(value, default=str), ex=ttl)
+    except Exception as e:
+        logger.warning(f"Billing cache write failed for {key}: {str(e)}")
+
+async def invalidate_billing_cache(account_id: str) -> None:
+    """Drop the cached subscription and billing status of an account."""
+    for key in (BILLING_SUBSCRIPTION_CACHE_KEY, BILLING_STATUS_CACHE_KEY):
+        try:
+            await redis.delete(key.format(account_id=account_id))
+        except Exception as e:
+            logger.warning(f"Failed to invalidate billing cache for {account_id}: {str(e)}")
+
+async def get_account_id_for_customer(client, customer_id: str) -> Optional[str]:
+    """Get the account ID linked to a Stripe customer ID."""
+    result = await client.schema('basejump').from_('billing_customers') \
+        .select('account_id') \
+        .eq('id', customer_id) \
+        .execute()
+
+    if result.data and len(result.data) > 0:
+        return result.data[0]['account_id']
+    return None
+
 async def get_stripe_customer_id(client, user_id: str) -> Optional[str]:
     """Get the Stripe customer ID for a user."""
     result = await client.schema('basejump').from_('billing_customers') \
@@ -70,7 +167,7 @@ async def get_stripe_customer_id(client, user_id: str) -> Optional[str]:
 async def create_stripe_customer(client, user_id: str, email: str) -> str:
     """Create a new Stripe customer for a user."""
     # Create customer in Stripe
-    customer = stripe.Customer.create(
+    customer = await _stripe_call(stripe.Customer.create,
         email=email,
         metadata={"user_id": user_id}
     )
@@ -85,7 +182,29 @@ async def create_stripe_customer(client, user_id: str, email: str) -> str:
     
     return customer.id
 
-async def get_user_subscription(user_id: str) -> Optional[Dict]:
+# Marker for a failed Stripe lookup, which must not be cached as "no subscription"
+_LOOKUP_FAILED = object()
+
+async def get_user_subscription(user_id: str, use_cache: bool = True) -> Optional[Dict]:
+    """Get the current subscription for a user.
+
+    The Stripe lookup is cached in Redis for BILLING_SUBSCRIPTION_CACHE_TTL
+    seconds and invalidated by subscription webhooks. Pass use_cache=False
+    when the result is used to modify the subscription.
+    """
+    cache_key = BILLING_SUBSCRIPTION_CACHE_KEY.format(account_id=user_id)
+    if use_cache:
+        found, subscription = await _get_cached_json(cache_key)
+        if found:
+            return subscription
+
+    subscription = await _fetch_user_subscription(user_id)
+    if subscription is not _LOOKUP_FAILED:
+        await _set_cached_json(cache_key, subscription, config.BILLING_SUBSCRIPTION_CACHE_TTL)
+        return subscription
+    return None
+
+async def _fetch_user_subscription(user_id: str) -> Optional[Dict]:
     """Get the current subscription for a user from Stripe."""
     try:
         # Get customer ID
@@ -97,7 +216,7 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
             return None
             
         # Get all active subscriptions for the customer
-        subscriptions = stripe.Subscription.list(
+        subscriptions = await _stripe_call(stripe.Subscription.list,
             customer=customer_id,
             status='active'
         )
@@ -139,7 +258,7 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
             for sub in our_subscriptions:
                 if sub['id'] != most_recent['id']:
                     try:
-                        stripe.Subscription.modify(
+                        await _stripe_call(stripe.Subscription.modify,
                             sub['id'],
                             cancel_at_period_end=True
                         )
@@ -153,14 +272,23 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         
     except Exception as e:
         logger.error(f"Error getting subscription from Stripe: {str(e)}")
-        return None
+        return _LOOKUP_FAILED
 
-async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
-    # Get start of current month in UTC
-    now = datetime.now(timezone.utc)
-    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-    
+def _parse_run_timestamp(value: str) -> float:
+    """Convert an agent_runs ISO timestamp into epoch seconds."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def _usage_keys(account_id: str, started_at: datetime) -> List[str]:
+    """Redis keys of the usage aggregate for the month a run started in."""
+    month = started_at.strftime('%Y-%m')
+    return [
+        BILLING_USAGE_KEY.format(account_id=account_id, month=month),
+        BILLING_USAGE_RUNS_KEY.format(account_id=account_id, month=month),
+        BILLING_USAGE_PENDING_KEY.format(account_id=account_id, month=month),
+    ]
+
+async def _get_month_runs(client, user_id: str, start_of_month: datetime) -> List[Dict]:
+    """Get all agent runs of a user's threads started since the start of the month."""
     # First get all threads for this user
     threads_result = await client.table('threads') \
         .select('thread_id') \
@@ -168,28 +296,66 @@ async def calculate_monthly_usage(client, user_id: str) -> float:
         .execute()
     
     if not threads_result.data:
-        return 0.0
+        return []
     
     thread_ids = [t['thread_id'] for t in threads_result.data]
     
     # Then get all agent runs for these threads in current month
     runs_result = await client.table('agent_runs') \
-        .select('started_at, completed_at') \
+        .select('id, started_at, completed_at') \
         .in_('thread_id', thread_ids) \
         .gte('started_at', start_of_month.isoformat()) \
         .execute()
     
-    if not runs_result.data:
-        return 0.0
-    
-    # Calculate total minutes
+    return runs_result.data or []
+
+async def _get_running_runs(client, user_id: str, start_of_month: datetime) -> List[Dict]:
+    """Get the runs of a user that are still in progress this month."""
+    result = await client.table('agent_runs') \
+        .select('id, started_at, threads!inner(account_id)') \
+        .eq('status', 'running') \
+        .eq('threads.account_id', user_id) \
+        .gte('started_at', start_of_month.isoformat()) \
+        .execute()
+    return result.data or []
+
+async def _seed_monthly_usage(client, user_id: str, start_of_month: datetime) -> float:
+    """Build the usage aggregate for the month from agent_runs and return its seconds."""
+    runs = await _get_month_runs(client, user_id, start_of_month)
+    completed = [
+        (run['id'], _parse_run_timestamp(run['completed_at']) - _parse_run_timestamp(run['started_at']))
+        for run in runs if run.get('completed_at')
+    ]
+    args: List[Any] = [BILLING_USAGE_TTL]
+    for run_id, seconds in completed:
+        args.extend([run_id, seconds])
+    total_seconds = await redis.eval(_SEED_USAGE_SCRIPT, _usage_keys(user_id, start_of_month), args)
+    logger.info(f"Seeded monthly usage for account {user_id} from {len(completed)} completed runs")
+    return float(total_seconds)
+
+async def record_agent_run_usage(account_id: str, agent_run_id: str, started_at: str, completed_at: str) -> None:
+    """Add a finished agent run to its account's monthly usage aggregate.
+
+    Called once a run reaches a terminal status. Runs are counted at most
+    once, so repeated status updates for the same run are harmless.
+    """
+    try:
+        start = datetime.fromisoformat(started_at.replace('Z', '+00:00')).astimezone(timezone.utc)
+        seconds = _parse_run_timestamp(completed_at) - start.timestamp()
+        await redis.eval(_RECORD_USAGE_SCRIPT, _usage_keys(account_id, start), [agent_run_id, seconds, BILLING_USAGE_TTL])
+        await redis.delete(BILLING_STATUS_CACHE_KEY.format(account_id=account_id))
+    except Exception as e:
+        logger.warning(f"Failed to record usage of agent run {agent_run_id} for account {account_id}: {str(e)}")
+
+async def _scan_monthly_usage(client, user_id: str, now: datetime, start_of_month: datetime) -> float:
+    """Calculate monthly usage by summing every agent run of the month."""
     total_seconds = 0
     now_ts = now.timestamp()
     
-    for run in runs_result.data:
-        start_time = datetime.fromisoformat(run['started_at'].replace('Z', '+00:00')).timestamp()
+    for run in await _get_month_runs(client, user_id, start_of_month):
+        start_time = _parse_run_timestamp(run['started_at'])
         if run['completed_at']:
-            end_time = datetime.fromisoformat(run['completed_at'].replace('Z', '+00:00')).timestamp()
+            end_time = _parse_run_timestamp(run['completed_at'])
         else:
             # For running jobs, use current time
             end_time = now_ts
@@ -198,9 +364,42 @@ async def calculate_monthly_usage(client, user_id: str) -> float:
     
     return total_seconds / 60  # Convert to minutes
 
+async def calculate_monthly_usage(client, user_id: str) -> float:
+    """Calculate total agent run minutes for the current month for a user.
+
+    Completed runs come from the per-account aggregate in Redis, which is
+    built once per month and then updated as runs finish. Runs still in
+    progress are added from a query over the account's running runs. If
+    Redis is unavailable, every run of the month is scanned instead.
+    """
+    # Get start of current month in UTC
+    now = datetime.now(timezone.utc)
+    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    
+    try:
+        usage_key = _usage_keys(user_id, start_of_month)[0]
+        completed_seconds = await redis.hget(usage_key, 'completed_seconds')
+        if completed_seconds is None:
+            total_seconds = await _seed_monthly_usage(client, user_id, start_of_month)
+        else:
+            total_seconds = float(completed_seconds)
+    except Exception as e:
+        logger.warning(f"Usage aggregate unavailable for account {user_id}, scanning agent runs: {str(e)}")
+        return await _scan_monthly_usage(client, user_id, now, start_of_month)
+
+    # Add the time of runs that are still in progress
+    now_ts = now.timestamp()
+    for run in await _get_running_runs(client, user_id, start_of_month):
+        total_seconds += now_ts - _parse_run_timestamp(run['started_at'])
+    
+    return total_seconds / 60  # Convert to minutes
+
 async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optional[Dict]]:
     """
     Check if a user can run agents based on their subscription and usage.
+
+    The result is cached in Redis for BILLING_STATUS_CACHE_TTL seconds, so
+    usage may overshoot the monthly limit by at most that long.
     
     Returns:
         Tuple[bool, str, Optional[Dict]]: (can_run, message, subscription_info)
@@ -212,6 +411,11 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
             "plan_name": "Local Development",
             "minutes_limit": "no limit"
         }
+
+    cache_key = BILLING_STATUS_CACHE_KEY.format(account_id=user_id)
+    found, cached = await _get_cached_json(cache_key)
+    if found and isinstance(cached, list) and len(cached) == 3:
+        return cached[0], cached[1], cached[2]
     
     # Get current subscription
     subscription = await get_user_subscription(user_id)
@@ -242,9 +446,12 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
     
     # Check if within limits
     if current_usage >= tier_info['minutes']:
-        return False, f"Monthly limit of {tier_info['minutes']} minutes reached. Please upgrade your plan or wait until next month.", subscription
-    
-    return True, "OK", subscription
+        result = (False, f"Monthly limit of {tier_info['minutes']} minutes reached. Please upgrade your plan or wait until next month.", subscription)
+    else:
+        result = (True, "OK", subscription)
+
+    await _set_cached_json(cache_key, list(result), config.BILLING_STATUS_CACHE_TTL)
+    return result
 
 # API endpoints
 @router.post("/create-checkout-session")
@@ -269,7 +476,7 @@ async def create_checkout_session(
         
         # Get the target price and product ID
         try:
-            price = stripe.Price.retrieve(request.price_id, expand=['product'])
+            price = await _stripe_call(stripe.Price.retrieve, request.price_id, expand=['product'])
             product_id = price['product']['id']
         except stripe.error.InvalidRequestError:
             raise HTTPException(status_code=400, detail=f"Invalid price ID: {request.price_id}")
@@ -279,7 +486,7 @@ async def create_checkout_session(
             raise HTTPException(status_code=400, detail="Price ID does not belong to the correct product.")
             
         # Check for existing subscription for our product
-        existing_subscription = await get_user_subscription(current_user_id)
+        existing_subscription = await get_user_subscription(current_user_id, use_cache=False)
         # print("Existing subscription for product:", existing_subscription)
         
         if existing_subscription:
@@ -304,13 +511,13 @@ async def create_checkout_session(
                     }
                 
                 # Get current and new price details
-                current_price = stripe.Price.retrieve(current_price_id)
+                current_price = await _stripe_call(stripe.Price.retrieve, current_price_id)
                 new_price = price # Already retrieved
                 is_upgrade = new_price['unit_amount'] > current_price['unit_amount']
 
                 if is_upgrade:
                     # --- Handle Upgrade --- Immediate modification
-                    updated_subscription = stripe.Subscription.modify(
+                    updated_subscription = await _stripe_call(stripe.Subscription.modify,
                         subscription_id,
                         items=[{
                             'id': subscription_item['id'],
@@ -319,10 +526,11 @@ async def create_checkout_session(
                         proration_behavior='always_invoice', # Prorate and charge immediately
                         billing_cycle_anchor='now' # Reset billing cycle
                     )
+                    await invalidate_billing_cache(current_user_id)
                     
                     latest_invoice = None
                     if updated_subscription.get('latest_invoice'):
-                       latest_invoice = stripe.Invoice.retrieve(updated_subscription['latest_invoice']) 
+                       latest_invoice = await _stripe_call(stripe.Invoice.retrieve, updated_subscription['latest_invoice']) 
                     
                     return {
                         "subscription_id": updated_subscription['id'],
@@ -348,12 +556,12 @@ async def create_checkout_session(
                         
                         # Retrieve the subscription again to get the schedule ID if it exists
                         # This ensures we have the latest state before creating/modifying schedule
-                        sub_with_schedule = stripe.Subscription.retrieve(subscription_id)
+                        sub_with_schedule = await _stripe_call(stripe.Subscription.retrieve, subscription_id)
                         schedule_id = sub_with_schedule.get('schedule')
 
                         # Get the current phase configuration from the schedule or subscription
                         if schedule_id:
-                            schedule = stripe.SubscriptionSchedule.retrieve(schedule_id)
+                            schedule = await _stripe_call(stripe.SubscriptionSchedule.retrieve, schedule_id)
                             # Find the current phase in the schedule
                             # This logic assumes simple schedules; might need refinement for complex ones
                             current_phase = None
@@ -418,7 +626,7 @@ async def create_checkout_session(
                             logger.info(f"Updating existing schedule {schedule_id} for subscription {subscription_id}")
                             logger.debug(f"Current phase data: {current_phase_update_data}")
                             logger.debug(f"New phase data: {new_downgrade_phase_data}")
-                            updated_schedule = stripe.SubscriptionSchedule.modify(
+                            updated_schedule = await _stripe_call(stripe.SubscriptionSchedule.modify,
                                 schedule_id,
                                 phases=[current_phase_update_data, new_downgrade_phase_data],
                                 end_behavior='release' 
@@ -433,7 +641,7 @@ async def create_checkout_session(
                             logger.debug(f"Current price: {current_price_id}, New price: {request.price_id}")
                             
                             try:
-                                updated_schedule = stripe.SubscriptionSchedule.create(
+                                updated_schedule = await _stripe_call(stripe.SubscriptionSchedule.create,
                                     from_subscription=subscription_id,
                                     phases=[
                                         {
@@ -465,7 +673,7 @@ async def create_checkout_session(
                                 # print(f"Created new schedule {updated_schedule['id']} from subscription {subscription_id}")
                                 
                                 # Verify the schedule was created correctly
-                                fetched_schedule = stripe.SubscriptionSchedule.retrieve(updated_schedule['id'])
+                                fetched_schedule = await _stripe_call(stripe.SubscriptionSchedule.retrieve, updated_schedule['id'])
                                 logger.info(f"Schedule verification - Status: {fetched_schedule.get('status')}, Phase Count: {len(fetched_schedule.get('phases', []))}")
                                 logger.debug(f"Schedule details: {fetched_schedule}")
                             except Exception as schedule_error:
@@ -493,7 +701,7 @@ async def create_checkout_session(
                 raise HTTPException(status_code=500, detail=f"Error updating subscription: {str(e)}")
         else:
             # --- Create New Subscription via Checkout Session ---
-            session = stripe.checkout.Session.create(
+            session = await _stripe_call(stripe.checkout.Session.create,
                 customer=customer_id,
                 payment_method_types=['card'],
                     line_items=[{'price': request.price_id, 'quantity': 1}],
@@ -535,7 +743,7 @@ async def create_portal_session(
         # Ensure the portal configuration has subscription_update enabled
         try:
             # First, check if we have a configuration that already enables subscription update
-            configurations = stripe.billing_portal.Configuration.list(limit=100)
+            configurations = await _stripe_call(stripe.billing_portal.Configuration.list, limit=100)
             active_config = None
             
             # Look for a configuration with subscription_update enabled
@@ -554,7 +762,7 @@ async def create_portal_session(
                     default_config = configurations['data'][0]
                     logger.info(f"Updating default portal configuration: {default_config['id']} to enable subscription_update")
                     
-                    active_config = stripe.billing_portal.Configuration.update(
+                    active_config = await _stripe_call(stripe.billing_portal.Configuration.update,
                         default_config['id'],
                         features={
                             'subscription_update': {
@@ -571,7 +779,7 @@ async def create_portal_session(
                 else:
                     # Create a new configuration with subscription_update enabled
                     logger.info("Creating new portal configuration with subscription_update enabled")
-                    active_config = stripe.billing_portal.Configuration.create(
+                    active_config = await _stripe_call(stripe.billing_portal.Configuration.create,
                         business_profile={
                             'headline': 'Subscription Management',
                             'privacy_policy_url': config.FRONTEND_URL + '/privacy',
@@ -609,7 +817,7 @@ async def create_portal_session(
             portal_params["configuration"] = active_config['id']
         
         # Create the session
-        session = stripe.billing_portal.Session.create(**portal_params)
+        session = await _stripe_call(stripe.billing_portal.Session.create, **portal_params)
         
         return {"url": session.url}
         
@@ -668,7 +876,7 @@ async def get_subscription(
         schedule_id = subscription.get('schedule')
         if schedule_id:
             try:
-                schedule = stripe.SubscriptionSchedule.retrieve(schedule_id)
+                schedule = await _stripe_call(stripe.SubscriptionSchedule.retrieve, schedule_id)
                 # Find the *next* phase after the current one
                 next_phase = None
                 current_phase_end = current_item['current_period_end']
@@ -744,9 +952,20 @@ async def stripe_webhook(request: Request):
             raise HTTPException(status_code=400, detail="Invalid signature")
         
         # Handle the event
-        if event.type in ['customer.subscription.created', 'customer.subscription.updated', 'customer.subscription.deleted']:
-            # We don't need to do anything here as we'll query Stripe directly
-            pass
+        if event.type in [
+            'customer.subscription.created', 'customer.subscription.updated',
+            'customer.subscription.deleted', 'subscription_schedule.updated',
+            'checkout.session.completed'
+        ]:
+            # Subscriptions are read from Stripe, so only the cached lookups need to go
+            customer_id = event.data.object.get('customer')
+            if customer_id:
+                db = DBConnection()
+                client = await db.client
+                account_id = await get_account_id_for_customer(client, customer_id)
+                if account_id:
+                    await invalidate_billing_cache(account_id)
+                    logger.info(f"Invalidated billing cache for account {account_id} after {event.type}")
         
         return {"status": "success"}
         
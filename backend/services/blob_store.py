@@ -0,0 +1,176 @@
+"""
+Content-addressed blob store for browser screenshots.
+
+Screenshots are stored once per content hash in Supabase storage (or on the
+local filesystem when BLOB_STORE_BACKEND is "local"), together with a
+downscaled, recompressed variant sized for LLM image input. Messages keep only
+the small reference returned by store_screenshot instead of the base64 image;
+URLs for displaying it are signed when read, so they never expire in storage.
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from services.supabase import DBConnection
+from utils.config import config
+from utils.logger import logger
+
+SCREENSHOT_CONTENT_TYPE = "image/jpeg"
+
+# Hashes known to be stored already, to skip re-uploading repeated screenshots
+_KNOWN_HASHES_LIMIT = 2048
+_known_hashes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _screenshot_keys(digest: str) -> Dict[str, str]:
+    prefix = f"screenshots/{digest[:2]}/{digest}"
+    return {"key": f"{prefix}.jpg", "llm_key": f"{prefix}.llm.jpg"}
+
+
+def screenshot_ref(digest: str) -> Dict[str, Any]:
+    """Build the storage reference of a screenshot from its content hash."""
+    return {"hash": digest, **_screenshot_keys(digest)}
+
+
+def _make_llm_variant(image_bytes: bytes) -> Dict[str, Any]:
+    """Downscale and recompress an image for LLM input."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        width, height = image.size
+        variant = image.convert("RGB")
+        variant.thumbnail((config.SCREENSHOT_LLM_MAX_DIMENSION, config.SCREENSHOT_LLM_MAX_DIMENSION))
+        output = io.BytesIO()
+        variant.save(output, format="JPEG", quality=config.SCREENSHOT_LLM_JPEG_QUALITY, optimize=True)
+    return {"data": output.getvalue(), "width": width, "height": height, "llm_size": variant.size}
+
+
+def _local_path(key: str) -> str:
+    return os.path.join(config.BLOB_STORE_LOCAL_PATH, key)
+
+
+def _write_local(key: str, data: bytes):
+    path = _local_path(key)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_local(key: str) -> bytes:
+    with open(_local_path(key), "rb") as f:
+        return f.read()
+
+
+async def _put(key: str, data: bytes):
+    """Store a blob unless an object with the same key already exists."""
+    if config.BLOB_STORE_BACKEND == "local":
+        await asyncio.to_thread(_write_local, key, data)
+        return
+
+    client = await DBConnection().client
+    try:
+        await client.storage.from_(config.SCREENSHOT_BUCKET).upload(
+            key, data, {"content-type": SCREENSHOT_CONTENT_TYPE, "upsert": "false"}
+        )
+    except Exception as e:
+        # Keys are content hashes, so an existing object already holds these bytes
+        if "duplicate" in str(e).lower() or "already exists" in str(e).lower():
+            return
+        raise
+
+
+async def _get(key: str) -> bytes:
+    if config.BLOB_STORE_BACKEND == "local":
+        return await asyncio.to_thread(_read_local, key)
+
+    client = await DBConnection().client
+    return await client.storage.from_(config.SCREENSHOT_BUCKET).download(key)
+
+
+async def store_screenshot(screenshot_base64: str) -> Optional[Dict[str, Any]]:
+    """Store a base64 screenshot and its LLM variant, deduplicated by content hash.
+
+    Returns:
+        Reference to the stored screenshot, or None if it could not be stored
+    """
+    try:
+        image_bytes = base64.b64decode(screenshot_base64)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid screenshot data: {str(e)}")
+        return None
+
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    known = _known_hashes.get(digest)
+    if known is not None:
+        _known_hashes.move_to_end(digest)
+        return dict(known)
+
+    try:
+        variant = await asyncio.to_thread(_make_llm_variant, image_bytes)
+        keys = _screenshot_keys(digest)
+        await asyncio.gather(
+            _put(keys["key"], image_bytes),
+            _put(keys["llm_key"], variant["data"])
+        )
+    except Exception as e:
+        logger.error(f"Error storing screenshot {digest}: {str(e)}")
+        return None
+
+    ref = {
+        "hash": digest,
+        **keys,
+        "content_type": SCREENSHOT_CONTENT_TYPE,
+        "width": variant["width"],
+        "height": variant["height"],
+        "llm_width": variant["llm_size"][0],
+        "llm_height": variant["llm_size"][1],
+        "size": len(image_bytes),
+        "llm_size": len(variant["data"])
+    }
+    _known_hashes[digest] = ref
+    while len(_known_hashes) > _KNOWN_HASHES_LIMIT:
+        _known_hashes.popitem(last=False)
+    logger.debug(f"Stored screenshot {digest}: {len(image_bytes)} bytes, LLM variant {len(variant['data'])} bytes")
+    return dict(ref)
+
+
+async def load_screenshot_base64(ref: Dict[str, Any], variant: str = "llm") -> Optional[str]:
+    """Load a stored screenshot as base64.
+
+    Args:
+        ref: Reference returned by store_screenshot
+        variant: "llm" for the downscaled variant, "original" for the full image
+    """
+    key = ref.get("llm_key") if variant == "llm" else ref.get("key")
+    if not key:
+        return None
+    try:
+        data = await _get(key)
+    except Exception as e:
+        logger.error(f"Error loading screenshot {key}: {str(e)}")
+        return None
+    return base64.b64encode(data).decode("utf-8")
+
+
+async def get_screenshot_url(ref: Dict[str, Any]) -> Optional[str]:
+    """Get a signed URL for the full-resolution screenshot, if the backend supports it."""
+    if config.BLOB_STORE_BACKEND == "local":
+        return None
+    try:
+        client = await DBConnection().client
+        signed = await client.storage.from_(config.SCREENSHOT_BUCKET).create_signed_url(
+            ref["key"], config.SCREENSHOT_URL_TTL
+        )
+        return signed.get("signedURL") or signed.get("signedUrl")
+    except Exception as e:
+        logger.warning(f"Error creating signed URL for screenshot {ref.get('hash')}: {str(e)}")
+        return None
@@ -0,0 +1,190 @@
+"""
+Shared outbound HTTP layer for tool integrations and webhooks.
+
+Keeps one keep-alive httpx.AsyncClient per host, so repeated calls to the same
+API reuse pooled connections instead of paying a TLS handshake each time. Each
+host also gets a concurrency limit, a default timeout and retries with
+exponential backoff on connection errors, timeouts, 429 and 5xx responses.
+"""
+
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+import httpx
+
+from utils.config import config
+from utils.logger import logger
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Methods retried by default; others only when the caller passes retries
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_clients: Dict[Tuple[str, str, int], httpx.AsyncClient] = {}
+_host_slots: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# Pending closes of stale clients, referenced until they finish
+_closing_tasks: Set[asyncio.Task] = set()
+
+
+def _host_key(url: httpx.URL) -> Tuple[str, str, int]:
+    port = url.port or (443 if url.scheme == "https" else 80)
+    return url.scheme, url.host, port
+
+
+async def _aclose_clients(clients):
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug(f"Error closing stale HTTP client: {str(e)}")
+
+
+def _close_stale_clients(old_loop: Optional[asyncio.AbstractEventLoop], clients):
+    """Close the clients of a previous event loop, releasing their pooled connections.
+
+    They are closed on their own loop when it is still open; otherwise on the
+    current one, where connections of the closed loop that cannot be shut down
+    cleanly are left to garbage collection.
+    """
+    if old_loop is not None and not old_loop.is_closed():
+        asyncio.run_coroutine_threadsafe(_aclose_clients(clients), old_loop)
+    else:
+        task = asyncio.get_running_loop().create_task(_aclose_clients(clients))
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+
+
+def _get_client(url: httpx.URL) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    """Get the pooled client and concurrency limit for the host of a URL."""
+    global _loop
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        # Clients are bound to the loop that created them (e.g. scripts using asyncio.run)
+        stale = list(_clients.values())
+        _clients.clear()
+        _host_slots.clear()
+        if stale:
+            _close_stale_clients(_loop, stale)
+        _loop = loop
+
+    key = _host_key(url)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.HTTP_DEFAULT_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=config.HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=config.HTTP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_expiry=60.0
+            )
+        )
+        _clients[key] = client
+        _host_slots[key] = asyncio.Semaphore(config.HTTP_MAX_CONNECTIONS_PER_HOST)
+    return client, _host_slots[key]
+
+
+async def request(
+    method: str,
+    url: str,
+    *,
+    params: Optional[Dict[str, Any]] = None,
+    json: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None
+) -> httpx.Response:
+    """Send a request through the pooled client of the target host.
+
+    Args:
+        method: HTTP method
+        url: Absolute URL
+        params: Query parameters
+        json: JSON body
+        headers: Request headers
+        timeout: Overall timeout in seconds, HTTP_DEFAULT_TIMEOUT if omitted
+        retries: Extra attempts on transient failures. Defaults to
+            HTTP_MAX_RETRIES for idempotent methods and 0 otherwise.
+
+    Returns:
+        The final response; error statuses are returned, not raised
+    """
+    method = method.upper()
+    if retries is None:
+        retries = config.HTTP_MAX_RETRIES if method in IDEMPOTENT_METHODS else 0
+
+    client, slots = _get_client(httpx.URL(url))
+    request_timeout = httpx.Timeout(timeout, connect=min(timeout, 10.0)) if timeout else httpx.USE_CLIENT_DEFAULT
+
+    attempt = 0
+    while True:
+        try:
+            async with slots:
+                response = await client.request(
+                    method, url, params=params, json=json, headers=headers, timeout=request_timeout
+                )
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                return response
+            reason = f"status {response.status_code}"
+            retry_after = response.headers.get("retry-after")
+        except (httpx.TransportError, httpx.TimeoutException) as e:
+            if attempt >= retries:
+                raise
+            reason = f"{type(e).__name__}: {str(e)}"
+            retry_after = None
+
+        delay = config.HTTP_RETRY_BACKOFF_MS / 1000 * (2 ** attempt) * (1 + random.random() * 0.25)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), 30.0))
+        attempt += 1
+        logger.warning(f"{method} {url} failed ({reason}), retry {attempt}/{retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def stream(
+    method: str,
+    url: str,
+    *,
+    params: Optional[Dict[str, Any]] = None,
+    json: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None
+) -> AsyncIterator[httpx.Response]:
+    """Send a request through the pooled client and yield the response before its body is read.
+
+    The body is read incrementally with response.aiter_bytes(); the
+    connection returns to the pool when the block exits. Not retried.
+    """
+    client, slots = _get_client(httpx.URL(url))
+    request_timeout = httpx.Timeout(timeout, connect=min(timeout, 10.0)) if timeout else httpx.USE_CLIENT_DEFAULT
+    async with slots:
+        async with client.stream(
+            method.upper(), url, params=params, json=json, headers=headers, timeout=request_timeout
+        ) as response:
+            yield response
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    """Send a GET request through the shared HTTP layer."""
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs) -> httpx.Response:
+    """Send a POST request through the shared HTTP layer."""
+    return await request("POST", url, **kwargs)
+
+
+async def close():
+    """Close all pooled clients."""
+    clients = list(_clients.values())
+    _clients.clear()
+    _host_slots.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing HTTP client: {str(e)}")
@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional, Tuple
 
 # Redis client
 client = None
@@ -88,10 +88,10 @@ async def get_client():
 
 
 # Basic Redis operations
-async def set(key: str, value: str, ex: int = None):
-    """Set a Redis key."""
+async def set(key: str, value: str, ex: int = None, nx: bool = False):
+    """Set a Redis key. With nx=True, only if it does not exist yet."""
     redis_client = await get_client()
-    return await redis_client.set(key, value, ex=ex)
+    return await redis_client.set(key, value, ex=ex, nx=nx)
 
 
 async def get(key: str, default: str = None):
@@ -126,6 +126,18 @@ async def rpush(key: str, *values: Any):
     return await redis_client.rpush(key, *values)
 
 
+async def lpop(key: str) -> Optional[str]:
+    """Remove and return the first element of a list."""
+    redis_client = await get_client()
+    return await redis_client.lpop(key)
+
+
+async def blpop(keys: List[str], timeout: int = 0) -> Optional[Tuple[str, str]]:
+    """Remove and return the first element of the first non-empty list, waiting up to timeout seconds."""
+    redis_client = await get_client()
+    return await redis_client.blpop(keys, timeout=timeout)
+
+
 async def lrange(key: str, start: int, end: int) -> List[str]:
     """Get a range of elements from a list."""
     redis_client = await get_client()
@@ -138,6 +150,64 @@ async def llen(key: str) -> int:
     return await redis_client.llen(key)
 
 
+# Stream operations
+async def xadd(key: str, fields: Dict[str, str], maxlen: Optional[int] = None, approximate: bool = True) -> str:
+    """Append an entry to a stream, optionally capping its length. Returns the entry ID."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, maxlen=maxlen, approximate=approximate)
+
+
+async def xread(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None) -> List[Tuple[str, List[Tuple[str, Dict[str, str]]]]]:
+    """Read entries after the given IDs from one or more streams, blocking up to block ms."""
+    redis_client = await get_client()
+    return await redis_client.xread(streams, count=count, block=block)
+
+
+async def xrange(key: str, min: str = "-", max: str = "+", count: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Get a range of entries from a stream."""
+    redis_client = await get_client()
+    return await redis_client.xrange(key, min=min, max=max, count=count)
+
+
+async def xlen(key: str) -> int:
+    """Get the number of entries in a stream."""
+    redis_client = await get_client()
+    return await redis_client.xlen(key)
+
+
+# Hash operations
+async def hget(key: str, field: str) -> Optional[str]:
+    """Get the value of a hash field."""
+    redis_client = await get_client()
+    return await redis_client.hget(key, field)
+
+
+async def hincrby(key: str, field: str, amount: int = 1) -> int:
+    """Increment the integer value of a hash field."""
+    redis_client = await get_client()
+    return await redis_client.hincrby(key, field, amount)
+
+
+async def hgetall(key: str) -> Dict[str, str]:
+    """Get all fields and values of a hash."""
+    redis_client = await get_client()
+    return await redis_client.hgetall(key)
+
+
+# Set operations
+async def srem(key: str, *members: str) -> int:
+    """Remove one or more members from a set."""
+    redis_client = await get_client()
+    return await redis_client.srem(key, *members)
+
+
+# Scripting
+async def eval(script: str, keys: List[str], args: List[Any]) -> Any:
+    """Run a Lua script atomically on the server."""
+    redis_client = await get_client()
+    return await redis_client.eval(script, len(keys), *keys, *args)
+
+
 # Key management
 async def expire(key: str, time: int):
     """Set a key's time to live in seconds."""
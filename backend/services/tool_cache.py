@@ -0,0 +1,176 @@
+"""
+Result cache for paid external tool calls (data providers, web search, scraping).
+
+Entries are addressed by a hash of the namespace and the canonical JSON of the
+call arguments, so the same query with differently ordered payload keys shares
+one entry. Results live in Redis, shared by all workers, with a small
+in-process LRU in front of it. Redis holds at most TOOL_CACHE_MAX_ENTRIES
+entries: when the limit is exceeded the entries closest to expiry are evicted.
+Hits and misses are counted per namespace in the tool_cache:stats hash.
+
+Only successful results should be stored; failures from the fetch function
+propagate and are never cached. If Redis is unavailable the cache degrades to
+calling the fetch function directly.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+TOOL_CACHE_KEY = "tool_cache:{namespace}:{digest}"
+TOOL_CACHE_INDEX_KEY = "tool_cache:index"
+TOOL_CACHE_STATS_KEY = "tool_cache:stats"
+
+# Stores an entry and keeps the index (scored by expiry time) within the entry limit.
+# ARGV: value, ttl, expires_at, now, max_entries
+_STORE_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[4])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[5])
+if excess > 0 then
+    local evicted = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    for _, key in ipairs(evicted) do redis.call('DEL', key) end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+return excess
+"""
+
+# Process-local LRU of cache key -> (expires_at, value)
+_local_entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+
+def make_cache_key(namespace: str, params: Any) -> str:
+    """Build the cache key for a call from its namespace and arguments."""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    return TOOL_CACHE_KEY.format(namespace=namespace, digest=digest)
+
+
+def _get_local(key: str) -> Tuple[bool, Any]:
+    entry = _local_entries.get(key)
+    if entry is None:
+        return False, None
+    expires_at, value = entry
+    if expires_at <= time.time():
+        _local_entries.pop(key, None)
+        return False, None
+    _local_entries.move_to_end(key)
+    return True, value
+
+
+def _set_local(key: str, value: Any, expires_at: float):
+    _local_entries[key] = (expires_at, value)
+    _local_entries.move_to_end(key)
+    while len(_local_entries) > config.TOOL_CACHE_LOCAL_ENTRIES:
+        _local_entries.popitem(last=False)
+
+
+async def _record(namespace: str, outcome: str):
+    try:
+        await redis.hincrby(TOOL_CACHE_STATS_KEY, f"{namespace}:{outcome}")
+    except Exception as e:
+        logger.debug(f"Could not record tool cache {outcome} for {namespace}: {str(e)}")
+
+
+async def get_cached(namespace: str, params: Any) -> Tuple[bool, Any]:
+    """Look up a cached result.
+
+    Returns:
+        Tuple of (found, value)
+    """
+    key = make_cache_key(namespace, params)
+    found, value = _get_local(key)
+    if found:
+        return True, value
+
+    try:
+        redis_client = await redis.get_client()
+        pipe = redis_client.pipeline()
+        pipe.get(key)
+        pipe.ttl(key)
+        cached, ttl = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error reading tool cache entry {key}: {str(e)}")
+        return False, None
+
+    if cached is None:
+        return False, None
+    value = json.loads(cached)
+    if ttl and ttl > 0:
+        _set_local(key, value, time.time() + ttl)
+    return True, value
+
+
+async def set_cached(namespace: str, params: Any, value: Any, ttl: Optional[int] = None):
+    """Store a successful result for ttl seconds (TOOL_CACHE_DEFAULT_TTL if omitted)."""
+    ttl = ttl or config.TOOL_CACHE_DEFAULT_TTL
+    if ttl <= 0:
+        return
+
+    key = make_cache_key(namespace, params)
+    serialized = json.dumps(value, ensure_ascii=False, default=str)
+    if len(serialized.encode('utf-8')) > config.TOOL_CACHE_MAX_VALUE_BYTES:
+        logger.debug(f"Not caching {namespace} result of {len(serialized)} chars: above size limit")
+        return
+
+    now = time.time()
+    _set_local(key, value, now + ttl)
+    try:
+        evicted = await redis.eval(
+            _STORE_SCRIPT,
+            [key, TOOL_CACHE_INDEX_KEY],
+            [serialized, ttl, now + ttl, now, config.TOOL_CACHE_MAX_ENTRIES]
+        )
+        if evicted and int(evicted) > 0:
+            logger.debug(f"Evicted {evicted} tool cache entries to stay within limit")
+    except Exception as e:
+        logger.warning(f"Error writing tool cache entry {key}: {str(e)}")
+
+
+async def cached_call(
+    namespace: str,
+    params: Any,
+    fetch: Callable[[], Awaitable[Any]],
+    ttl: Optional[int] = None
+) -> Any:
+    """Return the cached result of a call, or run fetch and cache what it returns.
+
+    Args:
+        namespace: Cache namespace, e.g. "data_provider:zillow" or "web_search"
+        params: JSON-serializable call arguments identifying the result
+        fetch: Coroutine function producing the result on a miss
+        ttl: Seconds to keep the result, TOOL_CACHE_DEFAULT_TTL if omitted
+
+    Returns:
+        The cached or freshly fetched result
+    """
+    if not config.TOOL_CACHE_ENABLED:
+        return await fetch()
+
+    found, value = await get_cached(namespace, params)
+    if found:
+        logger.debug(f"Tool cache hit for {namespace}")
+        await _record(namespace, "hits")
+        return value
+
+    await _record(namespace, "misses")
+    value = await fetch()
+    await set_cached(namespace, params, value, ttl)
+    return value
+
+
+async def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Get hit and miss counts per namespace."""
+    raw = await redis.hgetall(TOOL_CACHE_STATS_KEY)
+    stats: Dict[str, Dict[str, int]] = {}
+    for field, count in raw.items():
+        namespace, _, outcome = field.rpartition(":")
+        stats.setdefault(namespace, {"hits": 0, "misses": 0})[outcome] = int(count)
+    return stats
@@ -1939,6 +1939,23 @@ CREATE TABLE IF NOT EXISTS "public"."agent_runs" (
 ALTER TABLE "public"."agent_runs" OWNER TO "postgres";
 
 
+CREATE TABLE IF NOT EXISTS "public"."agent_run_response_segments" (
+    "agent_run_id" "uuid" NOT NULL,
+    "segment_index" integer NOT NULL,
+    "start_index" integer NOT NULL,
+    "response_count" integer NOT NULL,
+    "last_entry_id" "text" NOT NULL,
+    "data" "text" NOT NULL,
+    "created_at" timestamp with time zone DEFAULT "timezone"('utc'::"text", "now"()) NOT NULL
+);
+
+
+ALTER TABLE "public"."agent_run_response_segments" OWNER TO "postgres";
+
+
+COMMENT ON TABLE "public"."agent_run_response_segments" IS 'Agent run responses archived while the run progresses, as base64 zlib-compressed JSON arrays';
+
+
 CREATE TABLE IF NOT EXISTS "public"."messages" (
     "message_id" "uuid" DEFAULT "gen_random_uuid"() NOT NULL,
     "thread_id" "uuid" NOT NULL,
@@ -2091,6 +2108,11 @@ ALTER TABLE ONLY "public"."agent_runs"
 
 
 
+ALTER TABLE ONLY "public"."agent_run_response_segments"
+    ADD CONSTRAINT "agent_run_response_segments_pkey" PRIMARY KEY ("agent_run_id", "segment_index");
+
+
+
 ALTER TABLE ONLY "public"."devices"
     ADD CONSTRAINT "devices_pkey" PRIMARY KEY ("id");
 
@@ -2307,6 +2329,11 @@ ALTER TABLE ONLY "public"."agent_runs"
 
 
 
+ALTER TABLE ONLY "public"."agent_run_response_segments"
+    ADD CONSTRAINT "agent_run_response_segments_agent_run_id_fkey" FOREIGN KEY ("agent_run_id") REFERENCES "public"."agent_runs"("id") ON DELETE CASCADE;
+
+
+
 ALTER TABLE ONLY "public"."devices"
     ADD CONSTRAINT "fk_account" FOREIGN KEY ("account_id") REFERENCES "basejump"."accounts"("id") ON DELETE CASCADE;
 
@@ -2469,6 +2496,10 @@ CREATE POLICY "Service role bypass RLS on agent_runs" ON "public"."agent_runs" U
 
 
 
+CREATE POLICY "Service role bypass RLS on agent_run_response_segments" ON "public"."agent_run_response_segments" USING ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text")) WITH CHECK ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text"));
+
+
+
 CREATE POLICY "Service role bypass RLS on messages" ON "public"."messages" USING ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text")) WITH CHECK ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text"));
 
 
@@ -2610,6 +2641,10 @@ CREATE POLICY "agent_run_update_policy" ON "public"."agent_runs" FOR UPDATE USIN
 ALTER TABLE "public"."agent_runs" ENABLE ROW LEVEL SECURITY;
 
 
+
+ALTER TABLE "public"."agent_run_response_segments" ENABLE ROW LEVEL SECURITY;
+
+
 ALTER TABLE "public"."devices" ENABLE ROW LEVEL SECURITY;
 
 
@@ -3198,6 +3233,10 @@ GRANT ALL ON TABLE "public"."agent_runs" TO "service_role";
 
 
 
+GRANT ALL ON TABLE "public"."agent_run_response_segments" TO "service_role";
+
+
+
 GRANT ALL ON TABLE "public"."messages" TO "anon";
 GRANT ALL ON TABLE "public"."messages" TO "authenticated";
 GRANT ALL ON TABLE "public"."messages" TO "service_role";
@@ -1750,6 +1750,20 @@ CREATE TABLE IF NOT EXISTS "public"."agent_runs" (
 
 ALTER TABLE "public"."agent_runs" OWNER TO "postgres";
 
+CREATE TABLE IF NOT EXISTS "public"."agent_run_response_segments" (
+    "agent_run_id" "uuid" NOT NULL,
+    "segment_index" integer NOT NULL,
+    "start_index" integer NOT NULL,
+    "response_count" integer NOT NULL,
+    "last_entry_id" "text" NOT NULL,
+    "data" "text" NOT NULL,
+    "created_at" timestamp with time zone DEFAULT "timezone"('utc'::"text", "now"()) NOT NULL
+);
+
+ALTER TABLE "public"."agent_run_response_segments" OWNER TO "postgres";
+
+COMMENT ON TABLE "public"."agent_run_response_segments" IS 'Agent run responses archived while the run progresses, as base64 zlib-compressed JSON arrays';
+
 CREATE TABLE IF NOT EXISTS "public"."devices" (
     "id" "uuid" DEFAULT "extensions"."uuid_generate_v4"() NOT NULL,
     "account_id" "uuid" NOT NULL,
@@ -1917,6 +1931,9 @@ ALTER TABLE ONLY "public"."accounts"
 ALTER TABLE ONLY "public"."agent_runs"
     ADD CONSTRAINT "agent_runs_pkey" PRIMARY KEY ("id");
 
+ALTER TABLE ONLY "public"."agent_run_response_segments"
+    ADD CONSTRAINT "agent_run_response_segments_pkey" PRIMARY KEY ("agent_run_id", "segment_index");
+
 ALTER TABLE ONLY "public"."devices"
     ADD CONSTRAINT "devices_pkey" PRIMARY KEY ("id");
 
@@ -2011,6 +2028,9 @@ ALTER TABLE ONLY "basejump"."invitations"
 ALTER TABLE ONLY "public"."agent_runs"
     ADD CONSTRAINT "agent_runs_thread_id_fkey" FOREIGN KEY ("thread_id") REFERENCES "public"."threads"("thread_id");
 
+ALTER TABLE ONLY "public"."agent_run_response_segments"
+    ADD CONSTRAINT "agent_run_response_segments_agent_run_id_fkey" FOREIGN KEY ("agent_run_id") REFERENCES "public"."agent_runs"("id") ON DELETE CASCADE;
+
 ALTER TABLE ONLY "public"."devices"
     ADD CONSTRAINT "fk_account" FOREIGN KEY ("account_id") REFERENCES "basejump"."accounts"("id") ON DELETE CASCADE;
 
@@ -2047,6 +2067,7 @@ ALTER TABLE "basejump"."billing_subscriptions" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "basejump"."config" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "basejump"."invitations" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "public"."agent_runs" ENABLE ROW LEVEL SECURITY;
+ALTER TABLE "public"."agent_run_response_segments" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "public"."devices" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "public"."messages" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "public"."projects" ENABLE ROW LEVEL SECURITY;
@@ -2105,6 +2126,8 @@ CREATE POLICY "Account members can view their own recordings" ON "public"."recor
 
 CREATE POLICY "Service role bypass RLS on agent_runs" ON "public"."agent_runs" USING ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text")) WITH CHECK ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text"));
 
+CREATE POLICY "Service role bypass RLS on agent_run_response_segments" ON "public"."agent_run_response_segments" USING ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text")) WITH CHECK ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text"));
+
 CREATE POLICY "Service role bypass RLS on messages" ON "public"."messages" USING ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text")) WITH CHECK ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text"));
 
 CREATE POLICY "Service role bypass RLS on projects" ON "public"."projects" USING ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text")) WITH CHECK ((("auth"."jwt"() ->> 'role'::"text") = 'service_role'::"text"));
@@ -2230,6 +2253,7 @@ GRANT ALL ON TABLE "public"."accounts" TO "service_role";
 GRANT ALL ON TABLE "public"."agent_runs" TO "anon";
 GRANT ALL ON TABLE "public"."agent_runs" TO "authenticated";
 GRANT ALL ON TABLE "public"."agent_runs" TO "service_role";
+GRANT ALL ON TABLE "public"."agent_run_response_segments" TO "service_role";
 
 GRANT ALL ON TABLE "public"."messages" TO "anon";
 GRANT ALL ON TABLE "public"."messages" TO "authenticated";
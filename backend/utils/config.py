@@ -136,6 +136,65 @@ class Configuration:
     REDIS_PASSWORD: str
     REDIS_SSL: bool = True
     
+    # Agent run streaming: adjacent assistant chunks are merged for up to this
+    # many milliseconds or bytes before being written to Redis (0 disables)
+    AGENT_STREAM_COALESCE_MS: int = 50
+    AGENT_STREAM_COALESCE_BYTES: int = 4096
+    # Responses per compressed segment when archiving agent run responses
+    AGENT_RUN_ARCHIVE_SEGMENT_SIZE: int = 200
+    
+    # Daytona SDK calls run on a thread pool of this size, with at most
+    # SANDBOX_MAX_CALLS_PER_SANDBOX of its threads used by any one sandbox
+    SANDBOX_EXECUTOR_WORKERS: int = 32
+    SANDBOX_MAX_CALLS_PER_SANDBOX: int = 4
+    
+    # Seconds a looked-up sandbox handle is reused before its state is checked again
+    SANDBOX_HANDLE_TTL: int = 60
+    # Number of pre-created, started sandboxes kept for new projects (0 disables)
+    SANDBOX_POOL_SIZE: int = 0
+    # Largest piece of a file held in memory while uploading to or downloading from a sandbox
+    SANDBOX_TRANSFER_CHUNK_SIZE: int = 8 * 1024 * 1024
+    # How the browser tool reaches the browser API in a sandbox: "http" through the
+    # sandbox preview link (falling back to exec on connection errors) or "exec" with curl,
+    # and the largest response accepted from it
+    BROWSER_API_TRANSPORT: str = "http"
+    BROWSER_API_MAX_RESPONSE_BYTES: int = 32 * 1024 * 1024
+    # Attachments uploaded to a sandbox at the same time when initiating an agent
+    FILE_UPLOAD_CONCURRENCY: int = 4
+    
+    # Shared outbound HTTP client (services/http_client.py): pooled connections
+    # and concurrent requests per host, default timeout (seconds), retries and base retry delay
+    HTTP_MAX_CONNECTIONS_PER_HOST: int = 20
+    HTTP_DEFAULT_TIMEOUT: int = 30
+    HTTP_MAX_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF_MS: int = 500
+    
+    # Tool result cache (services/tool_cache.py) for data provider and web search
+    # calls: Redis entry limit, in-process LRU size, largest cached value and default TTL
+    TOOL_CACHE_ENABLED: bool = True
+    TOOL_CACHE_MAX_ENTRIES: int = 10000
+    TOOL_CACHE_LOCAL_ENTRIES: int = 256
+    TOOL_CACHE_MAX_VALUE_BYTES: int = 512 * 1024
+    TOOL_CACHE_DEFAULT_TTL: int = 3600
+    
+    # Browser screenshot blob store (services/blob_store.py): "supabase" or "local"
+    # backend, LLM variant size and JPEG quality, and lifetime (seconds) of the URLs
+    # signed on read by /thread/{thread_id}/screenshots/{hash}
+    BLOB_STORE_BACKEND: str = "supabase"
+    BLOB_STORE_LOCAL_PATH: str = "/tmp/blob_store"
+    SCREENSHOT_BUCKET: str = "browser-screenshots"
+    SCREENSHOT_LLM_MAX_DIMENSION: int = 1024
+    SCREENSHOT_LLM_JPEG_QUALITY: int = 70
+    SCREENSHOT_URL_TTL: int = 3600
+    
+    # Background summarization (agentpress/summarization_worker.py): "redis" or "local"
+    # queue, share of the context threshold (percent) at which a thread is queued,
+    # and worker loops per process
+    SUMMARIZATION_WORKER_ENABLED: bool = True
+    SUMMARIZATION_QUEUE_BACKEND: str = "redis"
+    SUMMARIZATION_TRIGGER_PERCENT: int = 70
+    SUMMARIZATION_WORKER_CONCURRENCY: int = 2
+    
     # Daytona sandbox configuration
     DAYTONA_API_KEY: str
     DAYTONA_SERVER_URL: str
@@ -175,6 +234,10 @@ class Configuration:
     STRIPE_DEFAULT_PLAN_ID: Optional[str] = None
     STRIPE_DEFAULT_TRIAL_DAYS: int = 14
     
+    # Billing lookups cached in Redis (seconds); subscription webhooks invalidate both
+    BILLING_SUBSCRIPTION_CACHE_TTL: int = 600
+    BILLING_STATUS_CACHE_TTL: int = 60
+    
     # Stripe Product IDs
     STRIPE_PRODUCT_ID_PROD: str = 'prod_SCl7AQ2C8kK1CD'  # Production product ID
     STRIPE_PRODUCT_ID_STAGING: str = 'prod_SCgIj3G7yPOAWY'  # Staging product ID
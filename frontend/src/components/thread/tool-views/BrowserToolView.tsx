@@ -1,10 +1,11 @@
-import React, { useMemo } from "react";
+import React, { useEffect, useMemo, useState } from "react";
 import { Globe, MonitorPlay, ExternalLink, CheckCircle, AlertTriangle, CircleDashed } from "lucide-react";
 import { ToolViewProps } from "./types";
 import { extractBrowserUrl, extractBrowserOperation, formatTimestamp, getToolTitle } from "./utils";
 import { ApiMessageType } from '@/components/thread/types';
 import { safeJsonParse } from '@/components/thread/utils';
 import { cn } from "@/lib/utils";
+import { getScreenshotUrl } from "@/lib/api";
 
 export function BrowserToolView({ 
   name = "browser-operation",
@@ -52,6 +53,9 @@ export function BrowserToolView({
 
   // Find the browser_state message and extract the screenshot
   let screenshotBase64: string | null = null;
+  let storedScreenshotUrl: string | null = null;
+  let screenshotHash: string | null = null;
+  let browserStateThreadId: string | null = null;
   if (browserStateMessageId && messages.length > 0) {
     const browserStateMessage = messages.find(msg => 
         (msg.type as string) === 'browser_state' && 
@@ -59,10 +63,30 @@ export function BrowserToolView({
     );
     
     if (browserStateMessage) {
-        const browserStateContent = safeJsonParse<{ screenshot_base64?: string }>(browserStateMessage.content, {});
+        const browserStateContent = safeJsonParse<{ screenshot_base64?: string; screenshot_url?: string; screenshot_ref?: { hash?: string } }>(browserStateMessage.content, {});
         screenshotBase64 = browserStateContent?.screenshot_base64 || null;
+        // Older messages stored a signed URL, which may have expired
+        storedScreenshotUrl = browserStateContent?.screenshot_url || null;
+        screenshotHash = browserStateContent?.screenshot_ref?.hash || null;
+        browserStateThreadId = browserStateMessage.thread_id || null;
     }
   }
+
+  // Stored screenshots are shown through a URL signed when the view opens
+  const [signedScreenshotUrl, setSignedScreenshotUrl] = useState<string | null>(null);
+  useEffect(() => {
+    setSignedScreenshotUrl(null);
+    if (screenshotBase64 || !screenshotHash || !browserStateThreadId) return;
+    let cancelled = false;
+    getScreenshotUrl(browserStateThreadId, screenshotHash).then(url => {
+      if (!cancelled) setSignedScreenshotUrl(url);
+    });
+    return () => { cancelled = true; };
+  }, [screenshotBase64, screenshotHash, browserStateThreadId]);
+
+  const screenshotSrc = screenshotBase64
+    ? `data:image/jpeg;base64,${screenshotBase64}`
+    : signedScreenshotUrl || storedScreenshotUrl;
   
   // Check if we have a VNC preview URL from the project
   const vncPreviewUrl = project?.sandbox?.vnc_preview ? 
@@ -110,10 +134,10 @@ export function BrowserToolView({
               isRunning && vncIframe ? (
                 // Use the memoized iframe for live preview
                 vncIframe
-              ) : screenshotBase64 ? (
+              ) : screenshotSrc ? (
                 <div className="flex items-center justify-center w-full h-full max-h-[650px] overflow-auto">
                   <img 
-                    src={`data:image/jpeg;base64,${screenshotBase64}`} 
+                    src={screenshotSrc} 
                     alt="Browser Screenshot"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -139,10 +163,10 @@ export function BrowserToolView({
               )
             ) : (
               // For non-last tool calls, only show screenshot if available, otherwise show "No Browser State image found"
-              screenshotBase64 ? (
+              screenshotSrc ? (
                 <div className="flex items-center justify-center w-full h-full max-h-[650px] overflow-auto">
                   <img 
-                    src={`data:image/jpeg;base64,${screenshotBase64}`} 
+                    src={screenshotSrc} 
                     alt="Browser Screenshot"
                     className="max-w-full max-h-full object-contain"
                   />
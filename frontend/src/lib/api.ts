@@ -68,7 +68,8 @@ export type AgentRun = {
   status: 'running' | 'completed' | 'stopped' | 'error';
   started_at: string;
   completed_at: string | null;
-  responses: Message[];
+  // Not included in run listings; fetch pages from /agent-run/{id}/responses
+  responses?: Message[];
   error: string | null;
 }
 
@@ -754,6 +755,33 @@ export const getAgentRuns = async (threadId: string): Promise<AgentRun[]> => {
   }
 };
 
+export const getScreenshotUrl = async (threadId: string, screenshotHash: string): Promise<string | null> => {
+  try {
+    const supabase = createClient();
+    const { data: { session } } = await supabase.auth.getSession();
+
+    if (!session?.access_token) {
+      throw new Error('No access token available');
+    }
+
+    const response = await fetch(`${API_URL}/thread/${threadId}/screenshots/${screenshotHash}`, {
+      headers: {
+        'Authorization': `Bearer ${session.access_token}`,
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error(`Error getting screenshot URL: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+    return data.url || null;
+  } catch (error) {
+    console.error('Failed to get screenshot URL:', error);
+    return null;
+  }
+};
+
 export const streamAgent = (agentRunId: string, callbacks: {
   onMessage: (content: string) => void;
   onError: (error: Error | string) => void;